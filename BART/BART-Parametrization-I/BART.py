@@ -73,6 +73,8 @@ import makeatm   as mat
 import makecfg   as mc
 import bestFit   as bf
 import cf        as cf
+import stages    as st
+import opacitystore as ost
 
 sys.path.append(MC3dir)
 import mcutils   as mu
@@ -130,6 +132,15 @@ def main():
                        help="Run only Transit to generate the Opacity table.")
   parser.add_argument("--resume",                action='store_true',
                        help="Resume a previous run.")
+  parser.add_argument("--dry-run", dest="dry_run", action='store_true',
+                       help="Print which pipeline stages would run, and "
+                            "exit.")
+  parser.add_argument("--plan", dest="plan", action="store", default=None,
+                       help="Write the pipeline-stage keys and status to "
+                            "this JSON file.", metavar="FILE")
+  parser.add_argument("--batch", dest="batch", action='store_true',
+                       help="Run non-interactively (do not pause to check "
+                            "the initial PT profile).")
   # Directories and files options:
   group = parser.add_argument_group("Directories and files")
   group.add_argument("--loc_dir", dest="loc_dir",
@@ -275,11 +286,51 @@ def main():
   group.add_argument("--outmod", dest="outmod",
            help="Output with modulation values [default: %(default)s]",
            type=str, action="store", default=None)
+  group.add_argument("--opacity_store", dest="opacity_store",
+           help="Directory of the shared (content-addressed) opacity-grid "
+                "store [default: %(default)s]",
+           type=str, action="store", default=None)
   group.add_argument("--shareOpacity", dest="shareOpacity",
            help="If True, use shared memory for the Transit opacity file "
                 "[default: %(default)s]",
            type=eval, action="store", default=True)
 
+  # Coarse burn-in options:
+  group = parser.add_argument_group("Coarse burn-in")
+  group.add_argument("--coarse_wnfactor", dest="coarse_wnfactor",
+           help="Wavenumber-sampling factor of the reduced-resolution "
+                "model evaluated during the MCMC burn-in "
+                "[default: %(default)s]",
+           type=int, action="store", default=1)
+  group.add_argument("--coarse_laystep", dest="coarse_laystep",
+           help="Layer-sampling step of the reduced-resolution model "
+                "evaluated during the MCMC burn-in [default: %(default)s]",
+           type=int, action="store", default=1)
+  group.add_argument("--coarse_tempdelt", dest="coarse_tempdelt",
+           help="Opacity-grid temperature sampling interval of the "
+                "reduced-resolution model evaluated during the MCMC "
+                "burn-in [default: %(default)s]",
+           type=float, action="store", default=None)
+
+  # Multi-column model options:
+  group = parser.add_argument_group("Multi-column model")
+  group.add_argument("--columns", dest="columns",
+           help="Number of atmospheric columns of the (eclipse) model; "
+                "the PT parameters of each column follow the previous "
+                "column's [default: %(default)s]",
+           type=int, action="store", default=1)
+  group.add_argument("--column_weights", dest="column_weights",
+           help="Disk fraction of each column [default: equal fractions]",
+           type=mu.parray, action="store", default=None)
+
+  # Posterior-predictive options:
+  group = parser.add_argument_group("Posterior predictive")
+  group.add_argument("--predictive", dest="predictive",
+           help="Number of posterior samples to evaluate for the "
+                "posterior-predictive spectra (requires the MCMC savefile) "
+                "[default: %(default)s]",
+           type=int, action="store", default=0)
+
 
   # Remaining_argv contains all other command-line-arguments:
   cargs, remaining_argv = cparser.parse_known_args()
@@ -323,105 +374,207 @@ def main():
   if not os.path.isabs(date_dir):
     date_dir = os.getcwd() + "/" + date_dir
   mu.msg(1, "Output folder: '{:s}'".format(date_dir), indent=2)
-  try:
-    os.mkdir(date_dir)
-  except OSError, e:
-    if e.errno == 17: # Allow overwritting while we debug
-      pass
-    else:
-      mu.error("Cannot create folder '{:s}'. {:s}.".format(date_dir,
-                                                     os.strerror(e.errno)))
+  if not dry_run:
+    try:
+      os.mkdir(date_dir)
+    except OSError, e:
+      if e.errno == 17: # Allow overwritting while we debug
+        pass
+      else:
+        mu.error("Cannot create folder '{:s}'. {:s}.".format(date_dir,
+                                                       os.strerror(e.errno)))
   # Copy files to date dir:
   # BART configuration file:
-  shutil.copy2(cfile, date_dir)
+  if not dry_run:
+    shutil.copy2(cfile, date_dir)
   # TEP file:
   if not os.path.isfile(tep_name):
     mu.error("Tepfile ('{:s}') Not found.".format(tep_name))
-  else:
+  elif not dry_run:
     shutil.copy2(tep_name, date_dir + os.path.basename(tep_name))
 
-  # Check if files already exist:
-  runMCMC = 0  # Flag that indicate which steps to run
+  # Check if files already exist (a provided file skips the stage that
+  # makes it and all the stages before it):
+  provided = 0
   # Atmospheric file:
   if os.path.isfile(atmfile):
     atmfile = os.path.realpath(atmfile)
-    shutil.copy2(atmfile, date_dir + os.path.basename(atmfile))
-    mu.msg(1, "Atmospheric file copied from: '{:s}'.".format(atmfile),indent=2)
-    runMCMC |= 8
+    if not dry_run:
+      shutil.copy2(atmfile, date_dir + os.path.basename(atmfile))
+      mu.msg(1, "Atmospheric file copied from: '{:s}'.".format(atmfile),
+             indent=2)
+    provided = max(provided, 4)
   # Pre-atmospheric file:
   if os.path.isfile(preatm_file):
     preatm_file = os.path.realpath(preatm_file)
-    shutil.copy2(preatm_file, date_dir + os.path.basename(preatm_file))
-    mu.msg(1, "Pre-atmospheric file copied from: '{:s}'.".format(preatm_file),
-           indent=2)
-    runMCMC |= 4
+    if not dry_run:
+      shutil.copy2(preatm_file, date_dir + os.path.basename(preatm_file))
+      mu.msg(1, "Pre-atmospheric file copied from: '{:s}'.".
+                format(preatm_file), indent=2)
+    provided = max(provided, 3)
   # Elemental-abundances file:
   if abun_file is not None and os.path.isfile(abun_file):
-    shutil.copy2(abun_file, date_dir + os.path.basename(abun_file))
-    mu.msg(1, "Elemental abundances file copied from: '{:s}'.".
-              format(abun_file), indent=2)
-    runMCMC |= 2
+    if not dry_run:
+      shutil.copy2(abun_file, date_dir + os.path.basename(abun_file))
+      mu.msg(1, "Elemental abundances file copied from: '{:s}'.".
+                format(abun_file), indent=2)
+    provided = max(provided, 2)
   # Pressure file:
   if press_file is not None and os.path.isfile(press_file):
-    shutil.copy2(press_file, date_dir + os.path.basename(press_file))
-    mu.msg(1, "Pressure file copied from: '{:s}'.".format(press_file), indent=2)
-    runMCMC |= 1
+    if not dry_run:
+      shutil.copy2(press_file, date_dir + os.path.basename(press_file))
+      mu.msg(1, "Pressure file copied from: '{:s}'.".format(press_file),
+             indent=2)
+    provided = max(provided, 1)
+
+  # Plan the pipeline stages.  Each stage key hashes the stage
+  # configuration values, input files, and the keys of the stages it
+  # depends on; a stage runs only if its key or outputs changed:
+  cache = st.StageCache(date_dir, dry_run)
+  tepkey = st.fingerprint(tep_name)
 
+  # Pressure file:
+  if provided >= 1:
+    presskey = cache.key("pressure", files=[press_file])
+  else:
+    press_file = date_dir + press_file
+    presskey = cache.key("pressure", [n_layers, p_top, p_bottom, log])
+  press_status = cache.status("pressure", presskey, provided >= 1)
+
+  if uniform is not None:
+    # Uniform-abundance profiles replace the abundances, pre-atmospheric,
+    # and TEA stages:
+    if provided >= 4:
+      atmkey = cache.key("atmosphere", files=[atmfile])
+    else:
+      atmfile = date_dir + atmfile
+      atmkey = cache.key("atmosphere",
+                         [uniform, out_spec, refpress, PTinit, PTtype],
+                         [abun_basic], [presskey, tepkey])
+    atm_status = cache.status("atmosphere", atmkey, provided >= 4)
+  else:
+    # Elemental-abundances file:
+    if provided >= 2:
+      abunkey = cache.key("abundances", files=[abun_file])
+    else:
+      abun_file = date_dir + abun_file
+      abunkey = cache.key("abundances", [solar_times, COswap], [abun_basic])
+    abun_status = cache.status("abundances", abunkey, provided >= 2)
+
+    # Pre-atmospheric file:
+    if provided >= 3:
+      preatmkey = cache.key("preatm", files=[preatm_file])
+    else:
+      preatm_file = date_dir + preatm_file
+      preatmkey = cache.key("preatm", [PTinit, PTtype, in_elem, out_spec],
+                            depends=[presskey, abunkey, tepkey])
+    preatm_status = cache.status("preatm", preatmkey, provided >= 3)
+
+    # Atmospheric file:
+    if provided >= 4:
+      atmkey = cache.key("TEA", files=[atmfile])
+    else:
+      atmfile = date_dir + atmfile
+      TEAconfig = []
+      if config.has_section("TEA"):
+        TEAconfig = config.items("TEA")
+      atmkey = cache.key("TEA", [out_spec, refpress, TEAconfig],
+                         depends=[preatmkey, abunkey, tepkey])
+    atm_status = cache.status("TEA", atmkey, provided >= 4)
+
+  # Opacity table (depends on the Transit sampling arguments and on the
+  # same input files as the opacity-store key):
+  opacitykey = cache.key("opacity",
+                  [(arg, defaults.get(arg)) for arg in ost.OPACITYARGS],
+                  ost.gridfiles(defaults, date_dir), [atmkey])
+  opacity_status = cache.status("opacity", opacitykey,
+                                os.path.isfile(opacityfile))
+
+  # Reduced-resolution model for the burn-in:
+  coarse = (coarse_wnfactor > 1 or coarse_laystep > 1 or
+            coarse_tempdelt is not None)
+  coarsekey = None
+  if coarse:
+    coarsekey = cache.key("coarse",
+                  [coarse_wnfactor, coarse_laystep, coarse_tempdelt],
+                  depends=[opacitykey])
+    coarse_status = cache.status("coarse", coarsekey)
+
+  # MCMC (the posterior-predictive options do not affect it; the data
+  # files enter by content):
+  MCMCconfig = dict([(key, val) for key, val in defaults.items()
+                     if not key.startswith("predictive")])
+  MCMCinputs = [tep_name, kurucz]
+  if filter is not None:
+    MCMCinputs += list(filter)
+  MCMCkey = cache.key("MCMC", MCMCconfig, MCMCinputs,
+                      depends=[atmkey, opacitykey, coarsekey])
+  MCMC_status = cache.status("MCMC", MCMCkey, force=resume)
+
+  cache.report()
+  if plan is not None:
+    cache.writeplan(plan, {"date_dir":date_dir, "atmfile":atmfile,
+                           "opacityfile":os.path.join(date_dir, opacityfile),
+                           "logfile":date_dir + logfile})
+  if dry_run:
+    mu.msg(1, "~~ BART End (dry run) ~~")
+    return
 
   # Generate files as needed:
-  if runMCMC < 1:  # Pressure file
-    press_file = date_dir + press_file
+  if press_status == "run":  # Pressure file
     mp.makeP(n_layers, p_top, p_bottom, press_file, log)
     mu.msg(1, "Created new pressure file.", indent=2)
+    cache.done("pressure", presskey, [press_file])
 
   # Make uniform-abundance profiles if requested:
-  if uniform is not None and runMCMC < 8:
+  if uniform is not None and atm_status == "run":
     # Calculate the temperature profile:
     temp = ipt.initialPT2(date_dir, PTinit, press_file, PTtype, tep_name)
     # Generate the uniform-abundance profiles file:
-    mat.uniform(date_dir + atmfile, press_file, abun_basic, tep_name,
+    mat.uniform(atmfile, press_file, abun_basic, tep_name,
                out_spec, uniform, temp, refpress)
-    # Update the runMCMC flag to skip upcoming steps:
-    runMCMC |= 8
+    cache.done("atmosphere", atmkey, [atmfile])
 
-  if runMCMC < 2:  # Elemental-abundances file
-    abun_file = date_dir + abun_file
+  if uniform is None and abun_status == "run":  # Elemental-abundances file
     mu.msg(1, "CO swap: {}".format(COswap), indent=2)
     mat.makeAbun(abun_basic, abun_file, solar_times, COswap)
     mu.msg(1, "Created new elemental abundances file.", indent=2)
+    cache.done("abundances", abunkey, [abun_file])
 
-  if runMCMC < 4:  # Pre-atmospheric file
+  if uniform is None and preatm_status == "run":  # Pre-atmospheric file
     # Calculate the temperature profile:
     temp = ipt.initialPT2(date_dir, PTinit, press_file, PTtype, tep_name)
     # Choose a pressure-temperature profile
-    mu.msg(1, "\nChoose temperature and pressure profile:", indent=2)
-    raw_input("  open Initial PT profile figure and\n" 
-              "  press enter to continue or quit and choose other initial "
-              "PT parameters.")
-    preatm_file = date_dir + preatm_file
+    if not batch:
+      mu.msg(1, "\nChoose temperature and pressure profile:", indent=2)
+      raw_input("  open Initial PT profile figure and\n" 
+                "  press enter to continue or quit and choose other initial "
+                "PT parameters.")
     mat.make_preatm(tep_name, press_file, abun_file, in_elem, out_spec,
                   preatm_file, temp)
     mu.msg(1, "Created new pre-atmospheric file.", indent=2)
+    cache.done("preatm", preatmkey, [preatm_file])
 
-  if runMCMC < 8:  # Atmospheric file
+  if uniform is None and atm_status == "run":  # Atmospheric file
     # Generate the TEA configuration file:
     mc.makeTEA(cfile, TEAdir)
     # Call TEA to calculate the atmospheric file:
     TEAcall = TEAdir + "tea/runatm.py"
-    TEAout  = os.path.splitext(atmfile)[0]  # Remove extension
     # Execute TEA:
     mu.msg(1, "\nExecute TEA:")
     proc = subprocess.Popen([TEAcall, preatm_file, 'TEA'])
     proc.communicate()
+    if proc.returncode != 0:
+      mu.error("TEA failed (return code {:d}).".format(proc.returncode))
 
-    shutil.copy2(date_dir+"TEA/results/TEA.tea", date_dir+atmfile) 
-    atmfile = date_dir + atmfile
+    shutil.copy2(date_dir+"TEA/results/TEA.tea", atmfile)
     # Add radius array:
     mat.makeRadius(out_spec, atmfile, abun_file, tep_name, refpress)
     mu.msg(1, "Added radius column to TEA atmospheric file.", indent=2)
     # Re-format file for use with transit:
     mat.reformat(atmfile)
     mu.msg(1, "Atmospheric file reformatted for Transit.", indent=2)
+    cache.done("TEA", atmkey, [atmfile])
 
   if justTEA:
     mu.msg(1, "~~ BART End (after TEA) ~~")
@@ -430,57 +583,133 @@ def main():
   # Make the MC3 configuration file:
   MCMC_cfile = os.path.realpath(loc_dir) + "/MCMC_" + os.path.basename(cfile)
   mc.makeMCMC(cfile, MCMC_cfile, logfile)
-  # Make transit configuration file:
-  mc.makeTransit(MCMC_cfile, tep_name, shareOpacity)
+  # Locate the opacity grid in the content-addressed store:
+  opakey = None
+  if opacity_store is not None and opacity_status != "provided":
+    gridkey   = ost.gridkey(defaults, atmfile, date_dir)
+    storefile = ost.storefile(opacity_store, gridkey, opacityfile)
+    opakey    = ost.shmkey(gridkey)
 
-  # Generate the opacity file if it doesn't exist:
-  if not os.path.isfile(opacityfile):
-    mu.msg(1, "Transit call to generate the Opacity grid table.")
-    Tcall = Transitdir + "/transit/transit"
-    subprocess.call(["{:s} -c {:s} --justOpacity".format(Tcall, tconfig)],
-                    shell=True, cwd=date_dir)
-  else:
-    mu.msg(1, "\nTransit copies the existing opacity file from:\n '{:s}'.".
+  # Make transit configuration file:
+  mc.makeTransit(MCMC_cfile, tep_name, shareOpacity, opakey)
+
+  # Generate the opacity file if needed:
+  runopacity = os.path.join(date_dir, opacityfile)
+  if opacity_status == "run":
+    # Transit would read (or overwrite a linked) previous grid:
+    if os.path.lexists(runopacity):
+      os.remove(runopacity)
+    if opakey is not None and os.path.isfile(storefile):
+      mu.msg(1, "\nOpacity grid found in the store:\n '{:s}'.".
+                format(storefile), indent=2)
+    else:
+      mu.msg(1, "Transit call to generate the Opacity grid table.")
+      Tcall = Transitdir + "/transit/transit"
+      returncode = subprocess.call(["{:s} -c {:s} --justOpacity".
+                                    format(Tcall, tconfig)],
+                                   shell=True, cwd=date_dir)
+      if returncode != 0:
+        mu.error("Transit failed to generate the opacity grid (return "
+                 "code {:d}).".format(returncode))
+      if not os.path.isfile(runopacity):
+        mu.error("Transit did not write the opacity grid '{:s}'.".
+                 format(runopacity))
+      if opakey is not None:
+        ost.put(runopacity, storefile)
+    if opakey is not None:
+      ost.link(storefile, runopacity)
+    cache.done("opacity", opacitykey, [runopacity])
+  elif opacity_status == "provided":
+    mu.msg(1, "\nTransit links the existing opacity file from:\n '{:s}'.".
                  format(opacityfile), indent=2)
-    shutil.copy2(opacityfile, date_dir + os.path.basename(opacityfile))
+    ost.link(opacityfile, date_dir + os.path.basename(opacityfile))
+
+  # Reduced-resolution model for the burn-in:
+  if coarse:
+    mu.msg(1, "Make the reduced-resolution model for the burn-in.")
+    full_atmfile   = date_dir + os.path.basename(atmfile)
+    coarse_atmfile = os.path.splitext(full_atmfile)[0] + "_coarse.atm"
+    mat.decimate(full_atmfile, coarse_atmfile, coarse_laystep)
+    coarse_tconfig, coarse_opacityfile = mc.makeCoarse(MCMC_cfile,
+                        coarse_atmfile, coarse_wnfactor, coarse_tempdelt)
+    if (coarse_status == "run" or coarse_opacityfile is None or
+        not os.path.isfile(coarse_opacityfile)):
+      mu.msg(1, "Transit call to generate the coarse Opacity grid table.")
+      Tcall = Transitdir + "/transit/transit"
+      returncode = subprocess.call(["{:s} -c {:s} --justOpacity".format(Tcall,
+                                    coarse_tconfig)], shell=True, cwd=date_dir)
+      if returncode != 0:
+        mu.error("Transit failed to generate the coarse opacity grid "
+                 "(return code {:d}).".format(returncode))
+      if coarse_opacityfile is not None:
+        cache.done("coarse", coarsekey,
+                   [os.path.join(date_dir, coarse_opacityfile)])
 
   if justOpacity:
     mu.msg(1, "~~ BART End (after Transit opacity calculation) ~~")
     return
 
-  # Run the MCMC:
-  mu.msg(1, "\nStart MCMC:")
-  MC3call = MC3dir + "/mccubed.py"
-  subprocess.call(["mpiexec {:s} -c {:s}".format(MC3call, MCMC_cfile)],
-                  shell=True, cwd=date_dir)
-
-  # Run best-fit Transit call
-  mu.msg(1, "\nTransit call with the best-fitting values.")
- 
   # MCcubed output file
   MCfile = date_dir + logfile
 
-  # Call bestFit submodule and make new bestFit_tconfig.cfg
-  bf.callTransit(atmfile, tep_name, MCfile, stepsize, molfit, solution,
-                 refpress, tconfig, date_dir, params, burnin, abun_basic)
-
-  # Best-fit tconfig
-  bestFit_tconfig = date_dir + 'bestFit_tconfig.cfg'
-
-  # Call Transit with the best-fit tconfig
-  Tcall = Transitdir + "/transit/transit"
-  subprocess.call(["{:s} -c {:s}".format(Tcall, bestFit_tconfig)],
-                   shell=True, cwd=date_dir)
-
-  # Plot best-fit eclipse or modulation spectrum, depending on solution:
-  if solution == 'eclipse':
-    # Plot best-fit eclipse spectrum
-    bf.plot_bestFit_Spectrum(filter, kurucz, tep_name, solution, outflux,
-                             data, uncert, date_dir)
-  elif solution == 'transit':
-    # Plot best-fit transit spectrum
-    bf.plot_bestFit_Spectrum(filter, kurucz, tep_name, solution, outmod,
-                             data, uncert, date_dir)
+  # Run the MCMC:
+  if MCMC_status == "run":
+    mu.msg(1, "\nStart MCMC:")
+    MC3call = MC3dir + "/mccubed.py"
+    returncode = subprocess.call(["mpiexec {:s} -c {:s}".
+                                  format(MC3call, MCMC_cfile)],
+                                 shell=True, cwd=date_dir)
+    # A crashed or killed MCMC leaves partial (or stale) outputs, stop
+    # before anything reads them:
+    if returncode != 0:
+      mu.error("The MCMC did not complete (return code {:d}).".
+               format(returncode))
+    savefile = os.path.join(date_dir, defaults.get("savefile", "output.npy"))
+    cache.done("MCMC", MCMCkey, [MCfile, savefile])
+
+  # Run best-fit Transit call (the best-fit outputs describe a single
+  # atmospheric column):
+  if columns > 1:
+    mu.msg(1, "\nSkip the best-fit Transit call (multi-column model).")
+  else:
+    mu.msg(1, "\nTransit call with the best-fitting values.")
+ 
+    # Burned-in iterations trimmed by MC3 (may be estimated automatically):
+    if bf.read_burnin(MCfile) is not None:
+      burnin = bf.read_burnin(MCfile)
+
+    # Call bestFit submodule and make new bestFit_tconfig.cfg
+    bf.callTransit(atmfile, tep_name, MCfile, stepsize, molfit, solution,
+                   refpress, tconfig, date_dir, params, burnin, abun_basic)
+
+    # Best-fit tconfig
+    bestFit_tconfig = date_dir + 'bestFit_tconfig.cfg'
+
+    # Call Transit with the best-fit tconfig
+    Tcall = Transitdir + "/transit/transit"
+    subprocess.call(["{:s} -c {:s}".format(Tcall, bestFit_tconfig)],
+                     shell=True, cwd=date_dir)
+
+    # Plot best-fit eclipse or modulation spectrum, depending on solution:
+    if solution == 'eclipse':
+      # Plot best-fit eclipse spectrum
+      bf.plot_bestFit_Spectrum(filter, kurucz, tep_name, solution, outflux,
+                               data, uncert, date_dir)
+    elif solution == 'transit':
+      # Plot best-fit transit spectrum
+      bf.plot_bestFit_Spectrum(filter, kurucz, tep_name, solution, outmod,
+                               data, uncert, date_dir)
+
+  # Posterior-predictive spectra on the BART workers:
+  if predictive > 0:
+    mu.msg(1, "\nPosterior-predictive spectra.")
+    PPcall = BARTdir + "/code/predictive.py"
+    returncode = subprocess.call(["mpiexec {:s} -c {:s}".
+                                  format(PPcall, MCMC_cfile)],
+                                 shell=True, cwd=date_dir)
+    if returncode != 0:
+      mu.error("The posterior-predictive stage failed (return code {:d}).".
+               format(returncode))
 
   # Run Transit with unlimited 'toomuch' argument for contribution
   # function calculation:
@@ -66,6 +66,7 @@ import PT        as pt
 import wine      as w
 import reader    as rd
 import constants as c
+import multicolumn as mcol
 
 BARTdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(BARTdir + "/../modules/MCcubed/src/")
@@ -123,6 +124,10 @@ def main(comm):
   parser.add_argument("--quiet",             action="store_true",
                       help="Set verbosity level to minimum",
                       dest="quiet")
+  parser.add_argument("--sendspec",          action="store_true",
+                      help="Return the spectrum along with the band fluxes "
+                           "(posterior-predictive evaluation)",
+                      dest="sendspec")
   # Input-Converter Options:
   group = parser.add_argument_group("Input Converter Options")
   group.add_argument("--atmospheric_file",  action="store",
@@ -136,6 +141,15 @@ def main(comm):
                      help="Internal temperature of the planet [default: "
                      "%(default)s].",
                      dest="tint",    type=float,  default=100.0)
+  group.add_argument("--columns",           action="store",
+                     help="Number of atmospheric columns (the PT "
+                     "parameters of each column follow the previous "
+                     "column's) [default: %(default)s].",
+                     dest="columns", type=int,    default=1)
+  group.add_argument("--column_weights",    action="store",
+                     help="Disk fraction of each column [default: equal "
+                     "fractions].",
+                     dest="column_weights", type=mu.parray, default=None)
   # transit Options:
   group = parser.add_argument_group("transit Options")
   group.add_argument("--config",  action="store",
@@ -164,10 +178,11 @@ def main(comm):
   rank = comm.Get_rank()
   verb = rank == 0
 
-  # Get (Broadcast) the number of parameters and iterations from MPI:
-  array1 = np.zeros(2, np.int)
+  # Get (Broadcast) the number of parameters, iterations, and the
+  # evaluation index to switch from the coarse to the full model from MPI:
+  array1 = np.zeros(3, np.int)
   mu.comm_bcast(comm, array1)
-  npars, niter = array1
+  npars, niter, iswitch = array1
 
   # :::::::  Initialize the Input converter ::::::::::::::::::::::::::
   atmfile  = args2.atmfile
@@ -199,66 +214,48 @@ def main(comm):
   nradfit = int(solution == 'transit')  # 1 for transit, 0 for eclipse
   nPT     = nfree - nmolfit - nradfit   # Number of PT free parameters
 
+  # Multi-column model (the columns share the abundances):
+  ncolumns = args2.columns
+  if ncolumns > 1 and solution != "eclipse":
+    mu.error("The multi-column model requires the eclipse geometry.")
+  if nPT % ncolumns != 0:
+    mu.error("The {:d} PT parameters cannot be split into {:d} "
+             "columns.".format(nPT, ncolumns))
+  nPTcol  = nPT / ncolumns              # PT parameters per column
+  weights = mcol.columnweights(args2.column_weights, ncolumns)
+
+  # Use the reduced-resolution atmosphere and transit configuration
+  # during a coarse burn-in:
+  tconfig = args2.tconfig
+  if iswitch > 0:
+    atmfile = args2.coarse_atmfile
+    tconfig = args2.coarse_tconfig
+    mu.msg(verb, "Coarse-resolution burn-in with: '{:s}'.".format(tconfig))
+
   # Read atmospheric file to get data arrays:
-  species, pressure, temp, abundances = mat.readatm(atmfile)
-  # Reverse pressure order (for PT to work):
-  pressure = pressure[::-1]
+  (pressure, abundances, profiles, ratio,
+   imetals, imol, iH2, iHe) = setup_atm(atmfile, molfit, verb)
   nlayers  = len(pressure)   # Number of atmospheric layers
-  nspecies = len(species)    # Number of species in the atmosphere
-  mu.msg(verb, "There are {:d} layers and {:d} species.".format(nlayers,
-                                                                nspecies))
-  # Find index for Hydrogen and Helium:
-  species = np.asarray(species)
-  iH2     = np.where(species=="H2")[0]
-  iHe     = np.where(species=="He")[0]
-  # Get H2/He abundance ratio:
-  ratio = (abundances[:,iH2] / abundances[:,iHe]).squeeze()
-  # Find indices for the metals:
-  imetals = np.where((species != "He") & (species != "H2"))[0]
-  # Index of molecular abundances being modified:
-  imol = np.zeros(nmolfit, dtype='i')
-  print(molfit, species)
-  for i in np.arange(nmolfit):
-    imol[i] = np.where(np.asarray(species) == molfit[i])[0]
 
   # Pressure-Temperature profile:
   PTargs = [PTtype]
   if PTtype == "line":
     # Planetary surface gravity (in cm s-2):
     gplanet = 100.0 * sc.G * mplanet / rplanet**2
-    # Additional PT arguments:
-    PTargs += [rstar, tstar, tint, sma, gplanet]
+    # Additional PT arguments (with the tabulated E2 fast path):
+    PTargs += [rstar, tstar, tint, sma, gplanet, True]
+  elif PTtype == "madhu":
+    # Plan the inversion profile once for this pressure grid:
+    PTargs += [pt.InversionPlan(pressure)]
 
   # Allocate arrays for receiving and sending data to master:
   freepars = np.zeros(nfree,                 dtype='d')
-  profiles = np.zeros((nspecies+1, nlayers), dtype='d')
   # This are sub-sections of profiles, containing just the temperature and
   # the abundance profiles, respectively:
   tprofile  = profiles[0, :]
   aprofiles = profiles[1:,:]
-
-  # Store abundance profiles:
-  for i in np.arange(nspecies):
-    aprofiles[i] = abundances[:, i]
-
-  # :::::::  Spawn transit code  :::::::::::::::::::::::::::::::::::::
-  # # transit configuration file:
-  transitcfile = args2.tconfig
- 
-  # FINDME: Find a way to set verb to the transit subprocesses.
-  # Silence all threads except rank 0:
-  # if verb == 0:
-  #   rargs = ["--quiet"]
-  # else:
-  #   rargs = []
-
-  # Initialize the transit python module:
-  transit_args = ["transit", "-c", transitcfile]
-  trm.transit_init(len(transit_args), transit_args)
-
-  # Get wavenumber array from transit:
-  nwave  = trm.get_no_samples()
-  specwn = trm.get_waveno_arr(nwave)
+  # Temperature profile of each column:
+  tcolumns  = np.zeros((ncolumns, nlayers), np.double)
 
   # :::::::  Output Converter  :::::::::::::::::::::::::::::::::::::::
   ffile    = args2.filter    # Filter files
@@ -275,56 +272,91 @@ def main(comm):
   # FINDME: Separate filter/stellar interpolation?
   # Get stellar model:
   starfl, starwn, tmodel, gmodel = w.readkurucz(kurucz, tstar, gstar)
-  # Read and resample the filters:
-  nifilter  = [] # Normalized interpolated filter
-  istarfl   = [] # interpolated stellar flux
-  wnindices = [] # wavenumber indices used in interpolation
-  for i in np.arange(nfilters):
-    # Read filter:
-    filtwaven, filttransm = w.readfilter(ffile[i])
-    # Check that filter boundaries lie within the spectrum wn range:
-    if filtwaven[0] < specwn[0] or filtwaven[-1] > specwn[-1]:
-      mu.exit(message="Wavenumber array ({:.2f} - {:.2f} cm-1) does not "
-              "cover the filter[{:d}] wavenumber range ({:.2f} - {:.2f} "
-              "cm-1).".format(specwn[0], specwn[-1], i, filtwaven[0],
-                                                        filtwaven[-1]))
 
-    # Resample filter and stellar spectrum:
-    nifilt, strfl, wnind = w.resample(specwn, filtwaven, filttransm,
-                                              starwn,    starfl)
-    mu.msg(verb, "OCON FLAG 67: mean star flux: %.3e"%np.mean(strfl))
-    nifilter.append(nifilt)
-    istarfl.append(strfl)
-    wnindices.append(wnind)
+  # :::::::  Spawn transit code  :::::::::::::::::::::::::::::::::::::
+  # Initialize transit, read and resample the filters:
+  nwave, specwn, nifilter, istarfl, wnindices = setup_transit(tconfig,
+                                               ffile, starwn, starfl, verb)
+  # Column pool (serial, do not fork processes from an MPI worker):
+  if ncolumns > 1:
+    pool = mcol.ColumnPool(ncolumns, comm)
 
   # Allocate arrays for receiving and sending data to master:
   spectrum = np.zeros(nwave,    dtype='d')
   bandflux = np.zeros(nfilters, dtype='d')
 
+  # A posterior-predictive evaluation returns the band fluxes followed
+  # by the spectrum.  Send the wavenumber array to the master first:
+  sendspec = args2.sendspec
+  nout = nfilters + sendspec*nwave
+  if sendspec:
+    mu.comm_gather(comm, np.array([nwave], np.double), MPI.DOUBLE)
+    mu.comm_gather(comm, specwn, MPI.DOUBLE)
+
   # Allocate array to receive parameters from MPI:
   params = np.zeros(npars, np.double)
 
+  # PT parameters and radius of the current setup (a block-wise step that
+  # does not change them reuses the temperature profile and radius):
+  lastPT  = np.tile(np.nan, nPT)
+  lastrad = np.nan
+
   # ::::::  Main MCMC Loop  ::::::::::::::::::::::::::::::::::::::::::
   # ::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 
+  ieval = 0  # Evaluation counter
   while niter >= 0:
     niter -= 1
     # Receive parameters from MCMC:
     mu.comm_scatter(comm, params)
+
+    # End of the coarse burn-in, switch to the full-resolution model:
+    if ieval == iswitch:
+      mu.msg(verb, "Switch to the full-resolution model.")
+      if ncolumns > 1:
+        pool.close()
+      trm.free_memory()
+      (pressure, abundances, profiles, ratio,
+       imetals, imol, iH2, iHe) = setup_atm(args2.atmfile, molfit, verb)
+      nlayers   = len(pressure)
+      tprofile  = profiles[0, :]
+      aprofiles = profiles[1:,:]
+      tcolumns  = np.zeros((ncolumns, nlayers), np.double)
+      nwave, specwn, nifilter, istarfl, wnindices = setup_transit(
+                                 args2.tconfig, ffile, starwn, starfl, verb)
+      if ncolumns > 1:
+        pool = mcol.ColumnPool(ncolumns, comm)
+      if PTtype == "madhu":
+        PTargs[1:] = [pt.InversionPlan(pressure)]
+      lastPT[:] = np.nan
+      lastrad   = np.nan
+    ieval += 1
     #mu.msg(verb, "ICON FLAG 71: incon pars: {:s}".
     #             format(str(params).replace("\n", "")))
 
+    # Skip proposals screened out by the MCMC (delayed acceptance):
+    if np.isnan(params[0]):
+      mu.comm_gather(comm, -np.ones(nout), MPI.DOUBLE)
+      continue
+
     # Input converter calculate the profiles:
     try:
-      tprofile[:] = pt.PT_generator(pressure, params[0:nPT], PTargs)[::-1]
+      if not np.array_equal(params[0:nPT], lastPT):
+        lastPT[:] = np.nan
+        for k in np.arange(ncolumns):
+          tcolumns[k] = pt.PT_generator(pressure,
+                          params[k*nPTcol:(k+1)*nPTcol], PTargs)[::-1]
+        tprofile[:] = tcolumns[0]
+        lastPT[:] = params[0:nPT]
     except ValueError:
       mu.msg(verb, 'Input parameters give non-physical profile.')
-      # FINDME: what to do here?
+      mu.comm_gather(comm, -np.ones(nout), MPI.DOUBLE)
+      continue
 
     # If the temperature goes out of bounds:
-    if np.any(tprofile < Tmin) or np.any(tprofile > Tmax):
+    if np.any(tcolumns < Tmin) or np.any(tcolumns > Tmax):
       print("Out of bounds")
-      mu.comm_gather(comm, -np.ones(nfilters), MPI.DOUBLE)
+      mu.comm_gather(comm, -np.ones(nout), MPI.DOUBLE)
       continue
 
     #mu.msg(verb, "T pars: \n{}\n".format(PTargs))
@@ -342,7 +374,7 @@ def main(comm):
     molfit_sum = np.asarray(molfit_sum)
     if np.any(molfit_sum > 0.14):
       #print("Sum of molfit species is larger then 15% - SKIP!")
-      mu.comm_gather(comm, -np.ones(nfilters), MPI.DOUBLE)
+      mu.comm_gather(comm, -np.ones(nout), MPI.DOUBLE)
       continue
 
     # Update H2, He abundances so sum(abundances) = 1.0 in each layer:
@@ -353,13 +385,20 @@ def main(comm):
     #                               q[50], profiles[iH2+1,50], profiles[:,50]))
 
     # Set the 'surface' level:
-    if solution == "transit":
+    if solution == "transit" and params[nPT] != lastrad:
       trm.set_radius(params[nPT])
+      lastrad = params[nPT]
 
     if rank == 1:
       print("Iteration: {:05}".format(niter))
     # Let transit calculate the model spectrum:
-    spectrum = trm.run_transit(profiles.flatten(), nwave)
+    if ncolumns == 1:
+      spectrum = trm.run_transit(profiles.flatten(), nwave)
+    else:
+      # Disk-integrated spectrum of the columns:
+      colprofiles = np.tile(profiles, (ncolumns, 1, 1))
+      colprofiles[:, 0] = tcolumns
+      spectrum = np.dot(weights, pool.run(colprofiles, nwave))
 
     # Output converter band-integrate the spectrum:
     # Calculate the band-integrated intensity per filter:
@@ -375,7 +414,10 @@ def main(comm):
     # Send resutls back to MCMC:
     #mu.msg(verb, "OCON FLAG 95: Flux band integrated ({})".format(bandflux))
     #mu.msg(verb, "{}".format(params[nPT:]))
-    mu.comm_gather(comm, bandflux, MPI.DOUBLE)
+    if sendspec:
+      mu.comm_gather(comm, np.concatenate((bandflux, spectrum)), MPI.DOUBLE)
+    else:
+      mu.comm_gather(comm, bandflux, MPI.DOUBLE)
     #mu.msg(verb, "OCON FLAG 97: Sent results back to MCMC")
 
   # ::::::  End main Loop  :::::::::::::::::::::::::::::::::::::::::::
@@ -383,6 +425,8 @@ def main(comm):
 
   # Close communications and disconnect:
   mu.comm_disconnect(comm)
+  if ncolumns > 1:
+    pool.close()
   mu.msg(verb, "FUNC FLAG 99: func out")
 
   # Close the transit communicators:
@@ -390,6 +434,143 @@ def main(comm):
   mu.msg(verb, "FUNC FLAG OUT ~~ 100 ~~")
 
 
+def setup_atm(atmfile, molfit, verb):
+  """
+  Read an atmospheric file and set up the arrays used by the Input
+  converter to compute the temperature and abundance profiles.
+
+  Parameters:
+  -----------
+  atmfile: String
+     Atmospheric file.
+  molfit: 1D string ndarray
+     Names of the molecules with fitted abundances.
+  verb: Integer
+     Verbosity level.
+
+  Returns:
+  --------
+  pressure: 1D float ndarray
+     Pressure array in increasing order (for PT to work).
+  abundances: 2D float ndarray
+     Abundances array of shape (nlayers, nspecies).
+  profiles: 2D float ndarray
+     Array of shape (nspecies+1, nlayers) with the temperature and
+     abundance profiles (initialized with the file abundances).
+  ratio: 1D float ndarray
+     H2/He abundance ratio per layer.
+  imetals: 1D integer ndarray
+     Indices of the species other than H2 and He.
+  imol: 1D integer ndarray
+     Indices of the molfit species.
+  iH2: 1D integer ndarray
+     Index of H2.
+  iHe: 1D integer ndarray
+     Index of He.
+  """
+  # Read atmospheric file to get data arrays:
+  species, pressure, temp, abundances = mat.readatm(atmfile)
+  # Reverse pressure order (for PT to work):
+  pressure = pressure[::-1]
+  nlayers  = len(pressure)   # Number of atmospheric layers
+  nspecies = len(species)    # Number of species in the atmosphere
+  mu.msg(verb, "There are {:d} layers and {:d} species.".format(nlayers,
+                                                                nspecies))
+  # Find index for Hydrogen and Helium:
+  species = np.asarray(species)
+  iH2     = np.where(species=="H2")[0]
+  iHe     = np.where(species=="He")[0]
+  # Get H2/He abundance ratio:
+  ratio = (abundances[:,iH2] / abundances[:,iHe]).squeeze()
+  # Find indices for the metals:
+  imetals = np.where((species != "He") & (species != "H2"))[0]
+  # Index of molecular abundances being modified:
+  nmolfit = len(molfit)
+  imol = np.zeros(nmolfit, dtype='i')
+  print(molfit, species)
+  for i in np.arange(nmolfit):
+    imol[i] = np.where(np.asarray(species) == molfit[i])[0]
+
+  # Temperature and abundance profiles:
+  profiles = np.zeros((nspecies+1, nlayers), dtype='d')
+  # Store abundance profiles:
+  for i in np.arange(nspecies):
+    profiles[i+1] = abundances[:, i]
+
+  return pressure, abundances, profiles, ratio, imetals, imol, iH2, iHe
+
+
+def setup_transit(tconfig, ffile, starwn, starfl, verb):
+  """
+  Initialize the transit python module and resample the filters and
+  stellar spectrum into the transit wavenumber array.
+
+  Parameters:
+  -----------
+  tconfig: String
+     Transit configuration file.
+  ffile: 1D string ndarray
+     Filter files.
+  starwn: 1D float ndarray
+     Stellar model wavenumber array.
+  starfl: 1D float ndarray
+     Stellar model flux.
+  verb: Integer
+     Verbosity level.
+
+  Returns:
+  --------
+  nwave: Integer
+     Number of wavenumber samples.
+  specwn: 1D float ndarray
+     Transit wavenumber array.
+  nifilter: List
+     Normalized interpolated filters.
+  istarfl: List
+     Interpolated stellar flux.
+  wnindices: List
+     Wavenumber indices used in the interpolation.
+  """
+  # FINDME: Find a way to set verb to the transit subprocesses.
+  # Silence all threads except rank 0:
+  # if verb == 0:
+  #   rargs = ["--quiet"]
+  # else:
+  #   rargs = []
+
+  # Initialize the transit python module:
+  transit_args = ["transit", "-c", tconfig]
+  trm.transit_init(len(transit_args), transit_args)
+
+  # Get wavenumber array from transit:
+  nwave  = trm.get_no_samples()
+  specwn = trm.get_waveno_arr(nwave)
+
+  # Read and resample the filters:
+  nifilter  = [] # Normalized interpolated filter
+  istarfl   = [] # interpolated stellar flux
+  wnindices = [] # wavenumber indices used in interpolation
+  for i in np.arange(len(ffile)):
+    # Read filter:
+    filtwaven, filttransm = w.readfilter(ffile[i])
+    # Check that filter boundaries lie within the spectrum wn range:
+    if filtwaven[0] < specwn[0] or filtwaven[-1] > specwn[-1]:
+      mu.exit(message="Wavenumber array ({:.2f} - {:.2f} cm-1) does not "
+              "cover the filter[{:d}] wavenumber range ({:.2f} - {:.2f} "
+              "cm-1).".format(specwn[0], specwn[-1], i, filtwaven[0],
+                                                        filtwaven[-1]))
+
+    # Resample filter and stellar spectrum:
+    nifilt, strfl, wnind = w.resample(specwn, filtwaven, filttransm,
+                                              starwn,    starfl)
+    mu.msg(verb, "OCON FLAG 67: mean star flux: %.3e"%np.mean(strfl))
+    nifilter.append(nifilt)
+    istarfl.append(strfl)
+    wnindices.append(wnind)
+
+  return nwave, specwn, nifilter, istarfl, wnindices
+
+
 if __name__ == "__main__":
   # Open communications with the master:
   comm = MPI.Comm.Get_parent()
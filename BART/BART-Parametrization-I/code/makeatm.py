@@ -77,13 +77,18 @@ import constants as c
           Extracts the surface gravity from the given TEP file.
     readatm:
           Reads atmospheric file made by TEA.
+    writebinatm, readbinatm:
+          Write and memory-map the binary companion of an atmospheric file.
     radpress:
           Calculates the radii for each layer given planetary surface gravity
           and the pressure, temperature, and mean-molecular-mass arrays.
+          Accepts a set of temperature profiles at once.
     readAbun:
           Trims the elemental data of interest from 'abundances.txt' file.
     stoich:
           Calculates stoichiometric values of output species.
+    molar_mass:
+          Calculates (and caches) the molar mass of species.
     mean_molar_mass:
           Calculates mean molecular mass of all output species.
     makeRadius:
@@ -239,13 +244,17 @@ def radpress(pressure, temperature, mu, p0, R0, g):
   hidrostatic-equilibrium equation with the constraint that:
   radius(p0) = R0.
 
+  The radii are integrated with the trapezoid rule in log-pressure.
+  temperature (and mu) can be 2D arrays of shape (nprofiles, nlayers)
+  to compute the radii of many profiles at once.
+
   Parameters:
   -----------
   pressure: 1D float ndarray
      Atmospheric layers' pressure in bars.
-  temperature: 1D float ndarray
+  temperature: 1D or 2D float ndarray
      Atmospheric layers' temperature in K.
-  mu: 1D float ndarray
+  mu: 1D or 2D float ndarray
      Atmospheric layers' mean molecular mass.
   p0: Float
      Reference pressure level, i.e. R(p0) = R0, in bars.
@@ -253,62 +262,46 @@ def radpress(pressure, temperature, mu, p0, R0, g):
      Reference radius level in km.
   g: Float
      Atmospheric gravity in m s-2.
-  """
-  # Number of layers in the atmosphere:
-  n = len(pressure)
-
-  # Allocate array of radii:
-  rad = np.zeros(n)
 
+  Returns:
+  --------
+  rad: 1D or 2D float ndarray
+     Radius of the atmospheric layers (same shape as temperature).
+  """
   # Interpolate temp and mu in lin-log space (1bar)
-  interPT = interp1d(np.log10(pressure), temperature)
-  intermu = interp1d(np.log10(pressure), mu)
-
-  # Get temp and mu at surface pressure (1bar)
+  logp = np.log10(pressure)
   try:
-    temp_1bar = interPT(np.log10(p0))
-    mu_1bar   = intermu(np.log10(p0))
-  except IOError:
+    temp_1bar = interp1d(logp, temperature, axis=-1)(np.log10(p0))
+    mu_1bar   = interp1d(logp, mu,          axis=-1)(np.log10(p0))
+  except ValueError:
     print("Referenced surface pressure of {:.3e} bar is not in the "
           "range of pressures: [{}, {}] bar.".
            format(p0, np.amin(pressure), np.amax(pressure)))
+    raise
 
   # Return back to desending order for radius calculation
-  press = pressure   [::-1]
-  temp  = temperature[::-1]
-  mu    = mu         [::-1]
+  press = pressure[::-1]
+  temp_mu = (np.asarray(temperature) / mu)[..., ::-1]
+
+  # Hydrostatic-equilibrium factor:
+  H = sc.Avogadro * sc.k / g
 
   # Find the index of the closest pressure point to p0:
   idx = np.argmin(np.abs(press - p0))
+  # Radius at this point (R0 if the point is at p0):
+  rad_idx = R0 + 0.5 * (temp_mu[..., idx] + temp_1bar / mu_1bar) * \
+                 H * np.log(p0/press[idx])
 
-  # If p0 is not in press:
-  if press[idx] != p0:
-      # If the point is above p0:
-      if press[idx] > p0:
-          rad[idx] = R0 + 0.5 * (temp[idx] / mu[idx] + temp_1bar / mu_1bar) *\
-                     (sc.Avogadro * sc.k * np.log(p0/press[idx]) / g)
-      # If the point is below p0:
-      else:
-          rad[idx] = R0 - 0.5 * (temp[idx] / mu[idx] + temp_1bar / mu_1bar) *\
-                     (sc.Avogadro * sc.k * np.log(press[idx]/p0) / g)
-
-  else:
-      rad[idx] = R0
-
-  # Calculate radius below p0:
-  for i in reversed(np.arange(idx)):
-      rad[i] = rad[i+1] - 0.5 * (temp[i] / mu[i] + temp[i+1] / mu[i+1]) * \
-               (sc.Avogadro * sc.k * np.log(press[i]/press[i+1]) / g)
-  # Calculate radius above p0:
-  for i in np.arange(idx+1, n):
-      rad[i] = rad[i-1] + 0.5 * (temp[i] / mu[i] + temp[i-1] / mu[i-1]) * \
-               (sc.Avogadro * sc.k * np.log(press[i-1]/press[i]) / g)
+  # Cumulative radius increments between layers (from the bottom up):
+  rad = np.zeros(np.shape(temp_mu))
+  rad[..., 1:] = np.cumsum(0.5 * (temp_mu[..., 1:] + temp_mu[..., :-1]) *
+                           H * np.log(press[:-1]/press[1:]), axis=-1)
+  # Set the radius at p0:
+  rad += np.asarray(rad_idx - rad[..., idx])[..., np.newaxis]
 
   # Reverse the order of calculated radii to write them in the right order
   # in pre-atm file:
-  rad = rad[::-1]
-
-  return rad
+  return rad[..., ::-1]
 
 
 def makeAbun(solar_abun, abun_file, solar_times=1, COswap=False):
@@ -378,6 +371,48 @@ def makeAbun(solar_abun, abun_file, solar_times=1, COswap=False):
     f.close()
 
 
+# Elemental masses (per abundances file) and species molar masses (per
+# abundances file and species name):
+_element_mass = {}
+_species_mass = {}
+
+def molar_mass(species, abun_file):
+  """
+  Molar mass of a list of species.  The elemental masses and the
+  species stoichiometry (see stoich) are evaluated only once, and
+  cached for the following calls.
+
+  Parameters:
+  -----------
+  species: 1D string list
+     Species names (the JANAF extension, if any, is ignored).
+  abun_file: String
+     Name of the elemental-abundances file.
+
+  Returns:
+  --------
+  mass: 1D float ndarray
+     Molar mass of the species (in g mol-1).
+  """
+  if abun_file not in _element_mass:
+    index, element, dex, name, weights = read_eabun(abun_file)
+    _element_mass[abun_file] = dict(zip(element, weights))
+  emass = _element_mass[abun_file]
+
+  mass = np.zeros(len(species))
+  for i in np.arange(len(species)):
+    key = abun_file, species[i]
+    if key not in _species_mass:
+      # Remove the JANAF extension from species name and get the
+      #  stoichiometric data:
+      spec_stoich = stoich(species[i].partition('_')[0])
+      # Add the mass from each element in this species:
+      _species_mass[key] = np.sum([emass[elem] * float(count)
+                                   for elem, count in spec_stoich])
+    mass[i] = _species_mass[key]
+  return mass
+
+
 # calculates species stoichiometric values
 def stoich(specie):
     '''
@@ -485,9 +520,10 @@ def mean_molar_mass(abun_file, atmfile):
     output atmospheric file to get all the data, trims the names of the
     output species and makes a stoichiometric array to store the values of
     all output species. It calls the stoich() function to get each species
-    stoichiometric values, multiplies elemental weights with each element
-    number in a species and sum them for all output species at each layer
-    in the atmosphere. It stores the values in the mu array for every layer.
+    stoichiometric values (through molar_mass), multiplies elemental weights
+    with each element number in a species and sum them for all output
+    species at each layer in the atmosphere. It stores the values in the mu
+    array for every layer.
  
     Parameters
     ----------
@@ -507,36 +543,11 @@ def mean_molar_mass(abun_file, atmfile):
     2015-03-05  Patricio  Simplified a few calculations.
     """
 
-    # Read the elemental abundances file:
-    index, element, dex, name, weights = read_eabun(abun_file)
-
     # Read the atmospheric file:
     out_spec, pressure, temp, abundances = readatm(atmfile)
 
-    # Number of molecules:
-    nspec   = len(out_spec)
-    # Number of layers in the atmosphere:
-    nLayers = len(abundances)
-
-    spec_weight = np.zeros(nspec)
-    # Get the mass of each species:
-    for i in np.arange(nspec):
-      # Remove the JANAF extension from species name and get the
-      #  stoichiometric data:
-      spec_stoich = stoich(out_spec[i].partition('_')[0])
-      # Add the mass from each element in this species:
-      for j in np.arange(len(spec_stoich)):
-        # Find the element:
-        elem_idx = np.where(element == spec_stoich[j,0])
-        # Add the weighted mass:
-        spec_weight[i] += weights[elem_idx][0] * float(spec_stoich[j,1])
-
-    # Allocate array (for each layer) of mean molar mass:
-    mu = np.zeros(nLayers)
-
-    # Sum of all species weight in the layer:
-    for i in np.arange(nLayers):
-        mu[i] = sum(spec_weight * abundances[i])
+    # Sum of all species weight in each layer:
+    mu = np.dot(abundances, molar_mass(out_spec, abun_file))
 
     return mu
 
@@ -598,9 +609,6 @@ def makeRadius(out_spec, atmfile, abun_file, tepfile, p0):
   # Calculate the radius of each layer:
   rad = radpress(pressure, temperature, mu, p0, Rp, g)
 
-  # Number of layers in the atmosphere
-  nLayers = len(abundances)
-
   # Number of molecules
   nspec = len(molecules)
 
@@ -613,24 +621,9 @@ def makeRadius(out_spec, atmfile, abun_file, tepfile, p0):
   # Write new label
   fout.write(label + '\n')
 
-  # Write atm file for each run
-  for i in np.arange(nLayers): 
-      # Radius, pressure, and temp for the current line
-      radi = str('%10.3f'%rad[i])
-      presi = str('%10.4e'%pressure[i])
-      tempi = str('%7.2f'%temperature[i])
-
-      # Insert radii array
-      fout.write(radi.ljust(10) + ' ')
-
-      # Insert results from the current line (T-P) to atm file
-      fout.write(presi.ljust(10) + ' ')
-      fout.write(tempi.ljust(7) + ' ')
-
-      # Write current abundances
-      for j in np.arange(nspec):
-          fout.write('%1.4e'%abundances[i][j] + ' ')
-      fout.write('\n')
+  # Write atm file (radius, pressure, temperature, and abundances):
+  data = np.column_stack((rad, pressure, temperature, abundances))
+  np.savetxt(fout, data, fmt="%10.3f %10.4e %7.2f " + "%1.4e " * nspec)
 
   # Close atm file
   fout.close()
@@ -771,12 +764,9 @@ def uniform(atmfile, press_file, abun_file, tepfile, species, abundances, temp,
   f.write("#Pressure   Temp     " +
         "".join(["{:<18s}".format(mol) for mol in spec]) + "\n")
 
-  # For each layer write TEA data
-  for i in np.arange(len(press)):
-      # Pressure, and Temperature
-      f.write("{:10.4e} {:8.2f}  ".format(press[i], temp[i]))
-      # Elemental abundance list
-      f.write("  ".join(["{:16.10e}".format(ab) for ab in abun]) + "\n")
+  # For each layer write TEA data (pressure, temperature, and abundances):
+  data = np.column_stack((press, temp, np.tile(abun, (len(press), 1))))
+  np.savetxt(f, data, fmt="%10.4e %8.2f  " + "  ".join(["%16.10e"]*len(abun)))
   f.close()
 
   # Calculate the radius of each layer and put it into the atmfile:
@@ -785,6 +775,94 @@ def uniform(atmfile, press_file, abun_file, tepfile, species, abundances, temp,
   reformat(atmfile)
 
 
+def binatmfile(atmfile):
+    """
+    Name of the binary companion file of an atmospheric file.
+    """
+    return atmfile + ".bin"
+
+
+def writebinatm(atmfile, molecules, data):
+    """
+    Write the binary companion of an atmospheric file: a text header
+    with the format version, the stamp (size and modification time) of
+    the text file, the data shape, and the species list, padded to a
+    multiple of 64 bytes, followed by the contiguous float64 data block.
+
+    The text file remains the interchange format; the binary file is
+    just a cache.  Failures to write (e.g., read-only directories) are
+    ignored.
+
+    Parameters
+    ----------
+    atmfile: String
+       Name of the atmospheric (text) file.
+    molecules: 1D string array
+       Species names.
+    data: 2D float ndarray
+       Atmospheric data (one layer per row, as in the text file).
+    """
+    data = np.ascontiguousarray(data, "<f8")
+    stat = os.stat(atmfile)
+    header = ("#BARTATM 1\n"
+              "{:d} {!r} {:d} {:d}\n".format(stat.st_size, stat.st_mtime,
+                                             np.shape(data)[0],
+                                             np.shape(data)[1]) +
+              " ".join(molecules) + "\n")
+    header += " " * ((-len(header)-1) % 64) + "\n"
+
+    # Write to a temporary file and rename (atomic for concurrent readers):
+    tmpfile = "{:s}.{:d}".format(binatmfile(atmfile), os.getpid())
+    try:
+        f = open(tmpfile, "wb")
+        f.write(header)
+        data.tofile(f)
+        f.close()
+        os.rename(tmpfile, binatmfile(atmfile))
+    except (IOError, OSError):
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+
+
+def readbinatm(atmfile):
+    """
+    Memory-map the binary companion of an atmospheric file.
+
+    Parameters
+    ----------
+    atmfile: String
+       Name of the atmospheric (text) file.
+
+    Returns
+    -------
+    molecules: 1D string list
+       Species names.
+    data: 2D float ndarray
+       Copy-on-write memory map of the atmospheric data.
+    None if the binary file does not exist or does not match the
+    current text file.
+    """
+    binfile = binatmfile(atmfile)
+    if not os.path.isfile(binfile):
+        return None
+    stat = os.stat(atmfile)
+
+    f = open(binfile, "rb")
+    version = f.readline()
+    info    = f.readline().split()
+    molecules = f.readline().split()
+    f.readline()  # Padding
+    offset = f.tell()
+    f.close()
+
+    if (version != "#BARTATM 1\n" or len(info) != 4 or
+        int(info[0]) != stat.st_size or float(info[1]) != stat.st_mtime):
+        return None
+    shape = int(info[2]), int(info[3])
+    data = np.memmap(binfile, "<f8", "c", offset, shape)
+    return molecules, data
+
+
 # reads final TEA atmospheric file
 def readatm(atmfile):
     """
@@ -810,6 +888,9 @@ def readatm(atmfile):
     Notes
     -----
     Atmospheric data starts two lines after the header line: #TEADATA
+    The parsed data is cached in a binary companion file (see
+    writebinatm), which is memory-mapped by the following calls while the
+    text file remains unchanged.
 
     Revisions
     ---------
@@ -821,53 +902,78 @@ def readatm(atmfile):
                           radius array in it.
     """
 
-    # Open the atmospheric file and read
-    f = open(atmfile, 'r')
-    lines = np.asarray(f.readlines())
-    f.close()
+    # Use the binary companion file when it is up to date:
+    binatm = readbinatm(atmfile)
+    if binatm is not None:
+        molecules, data = binatm
+    else:
+        # Open the atmospheric file and read
+        f = open(atmfile, 'r')
+        lines = f.readlines()
+        f.close()
 
-    # Get the molecules
-    imol = np.where(lines == "#SPECIES\n")[0][0] + 1
-    molecules = lines[imol].split()
+        # Get the molecules
+        imol = lines.index("#SPECIES\n") + 1
+        molecules = lines[imol].split()
 
-    # Find the line where the layers info begins
-    start = np.where(lines == "#TEADATA\n")[0][0] + 2 
+        # Find the line where the layers info begins
+        start = lines.index("#TEADATA\n") + 2
 
-    # Number of columns
-    ncol = len(lines[start].split())
+        # Number of columns and layers
+        ncol  = len(lines[start].split())
+        ndata = len(lines) - start
 
-    # Number of layers
-    ndata = len(lines) - start  
+        # Parse all layers at once
+        data = np.array(" ".join(lines[start:]).split(),
+                        np.double).reshape(ndata, ncol)
 
-    # Read atmfile without radius array in it or with it
-    pressure = np.zeros(ndata, np.double)
-    temp     = np.zeros(ndata, np.double) 
-    if ncol == len(molecules) + 2:
-        # Number of abundances (elements per line except Press and T) 
-        nabun = len(lines[start].split()) - 2  
-        abundances = np.zeros((ndata, nabun), np.double)
-
-        # Extract pressure, temperature, and abundance data
-        for i in np.arange(ndata):
-            line = lines[start+i].strip().split()  
-            pressure[i]   = line[0]
-            temp[i]       = line[1]   
-            abundances[i] = line[2:] 
-    else:
-        # Number of abundances (elements per line except Radius, Press and T) 
-        nabun = len(lines[start].split()) - 3  
-        abundances = np.zeros((ndata, nabun), np.double)
+        # Store the binary companion file for the next readers
+        writebinatm(atmfile, molecules, data)
 
-        # Extract pressure, temperature, and abundance data
-        for i in np.arange(ndata):
-            line = lines[start+i].strip().split()  
-            pressure[i]   = line[1]
-            temp[i]       = line[2]   
-            abundances[i] = line[3:] 
+    # Read atmfile without radius array in it or with it
+    icol = np.shape(data)[1] - len(molecules) - 2
+    pressure   = data[:, icol]
+    temp       = data[:, icol+1]
+    abundances = data[:, icol+2:]
 
     return molecules, pressure, temp, abundances   
 
 
+def decimate(atmfile, outfile, laystep):
+    """
+    Write a reduced-resolution copy of an atmospheric file, keeping
+    every laystep-th layer (and always the last layer).
+
+    Parameters
+    ----------
+    atmfile: String
+       Name of the input atmospheric file.
+    outfile: String
+       Name of the output atmospheric file.
+    laystep: Integer
+       Layer-sampling step.
+    """
+
+    # Open the atmospheric file and read
+    f = open(atmfile, 'r')
+    lines = f.readlines()
+    f.close()
+
+    # Find the line where the layers info begins
+    start = lines.index("#TEADATA\n") + 2
+
+    # Indices of the layers to keep (keep the top of the atmosphere)
+    ilay = np.arange(start, len(lines), max(int(laystep), 1))
+    if ilay[-1] != len(lines) - 1:
+        ilay = np.append(ilay, len(lines) - 1)
+
+    # Save the decimated file
+    f = open(outfile, 'w')
+    f.writelines(lines[:start])
+    f.writelines([lines[i] for i in ilay])
+    f.close()
+
+
 # reformats final TEA atmospheric file for Transit
 def reformat(atmfile):
     """
@@ -66,7 +66,7 @@ sys.path.append(filedir + "/../modules/MCcubed/src/")
 import mcutils as mu
 
 
-def makeTransit(cfile, tepfile, shareOpacity):
+def makeTransit(cfile, tepfile, shareOpacity, opakey=None):
   """
   Make the transit configuration file.
 
@@ -76,6 +76,11 @@ def makeTransit(cfile, tepfile, shareOpacity):
      BART configuration file.
   tepfile: String
      A TEP file.
+  shareOpacity: Bool
+     If True, place the opacity grid in shared memory.
+  opakey: Integer
+     Shared-memory key of the opacity grid (see opacitystore.shmkey).
+     If None, transit derives it from the opacity file.
   """
 
   # Known transit arguments:
@@ -84,7 +89,7 @@ def makeTransit(cfile, tepfile, shareOpacity):
                 "wnlow",   "wnhigh",   "wndelt",  "wnfct", "wnosamp",
                 "tlow",    "thigh",    "tempdelt",
                 "allowq",  "nwidth",
-                "opacityfile",
+                "opacityfile", "opathreads",
                 "molfile",
                 "toomuch", "tauiso", "outtau", "taulevel", "modlevel",
                 "starrad", "transparent",
@@ -141,6 +146,8 @@ def makeTransit(cfile, tepfile, shareOpacity):
 
   if shareOpacity:
     tcfile.write("shareOpacity \n")
+  if opakey is not None:
+    tcfile.write("opakey {:d}\n".format(opakey))
   tcfile.close()
 
 
@@ -173,7 +180,8 @@ def makeMCMC(cfile, MCMC_cfile, logfile):
                 "cia", "loc_dir"]
   output_args = ["tconfig",    "atmfile",   "opacityfile", "press_file",
                  "abun_basic", "abun_file", "preatm_file", "outflux",
-                 "outmod",     "savemodel", "logfile"]
+                 "outmod",     "savemodel", "logfile",
+                 "predictive_file"]
 
   # Set default logfile:
   if "logfile" not in args:
@@ -206,11 +214,105 @@ def makeMCMC(cfile, MCMC_cfile, logfile):
   if os.path.isfile(params):
     Bconfig.set(section, "params", os.path.realpath(params))
 
+  # Block-wise proposals, one block for the PT parameters, one for the
+  # radius (transit geometry), and one for each molfit species:
+  if "blocks" in args and Bconfig.get(section, "blocks").strip() == "auto":
+    if os.path.isfile(params):
+      nparams = len(np.loadtxt(params, ndmin=2))
+    else:
+      nparams = len(params.split())
+    nmolfit = len(Bconfig.get(section, "molfit").split())
+    nradfit = int(Bconfig.get(section, "solution").strip() == "transit")
+    nPT     = nparams - nmolfit - nradfit
+    blocks  = [0]*nPT + [1]*nradfit + list(range(1+nradfit, 1+nradfit+nmolfit))
+    Bconfig.set(section, "blocks", " ".join([str(b) for b in blocks]))
+
   # Write the configuration file for use by MC3:
   with open(MCMC_cfile, 'w') as configfile:
     Bconfig.write(configfile)
 
 
+def makeCoarse(MCMC_cfile, coarse_atmfile, wnfactor=1, tempdelt=None):
+  """
+  Make a reduced-resolution transit configuration file for a coarse
+  burn-in, and add the coarse-model arguments to the MC3 configuration
+  file.
+
+  Parameters:
+  -----------
+  MCMC_cfile: String
+     MC3 configuration file (made by makeMCMC, after makeTransit).
+  coarse_atmfile: String
+     Reduced-resolution atmospheric file.
+  wnfactor: Integer
+     Multiplication factor for the wavenumber sampling interval (the
+     oversampling factor is divided by the same factor).
+  tempdelt: Float
+     Opacity-grid temperature sampling interval.  If None, keep the
+     full-resolution value.
+
+  Returns:
+  --------
+  coarse_tconfig: String
+     Reduced-resolution transit configuration file.
+  coarse_opacityfile: String
+     Reduced-resolution opacity-grid file.
+  """
+
+  # Name of the configuration-file section:
+  section = "MCMC"
+  Bconfig = ConfigParser.SafeConfigParser()
+  Bconfig.optionxform = str
+  Bconfig.read([MCMC_cfile])
+
+  # Full-resolution transit configuration file:
+  tconfig = Bconfig.get(section, "tconfig")
+  f = open(tconfig, "r")
+  lines = f.readlines()
+  f.close()
+
+  # Transit resolves relative file names against its run folder:
+  date_dir = os.path.dirname(os.path.realpath(tconfig))
+  root, ext = os.path.splitext(os.path.realpath(tconfig))
+  coarse_tconfig = root + "_coarse" + ext
+  coarse_opacityfile = None
+
+  tcfile = open(coarse_tconfig, "w")
+  for line in lines:
+    fields = line.split()
+    if len(fields) < 2:
+      tcfile.write(line)
+      continue
+    key = fields[0]
+    if   key == "atm":
+      line = "atm {:s}\n".format(os.path.realpath(coarse_atmfile))
+    elif key == "wndelt":
+      line = "wndelt {:.10g}\n".format(float(fields[1]) * wnfactor)
+    elif key == "wnosamp":
+      line = "wnosamp {:d}\n".format(max(int(fields[1])//wnfactor, 1))
+    elif key == "tempdelt" and tempdelt is not None:
+      line = "tempdelt {:.10g}\n".format(tempdelt)
+    elif key == "opakey":
+      # The coarse grid gets its own shared-memory segment:
+      continue
+    elif key == "opacityfile":
+      oroot, oext = os.path.splitext(
+                      os.path.realpath(os.path.join(date_dir, fields[1])))
+      coarse_opacityfile = oroot + "_coarse" + oext
+      line = "opacityfile {:s}\n".format(coarse_opacityfile)
+    tcfile.write(line)
+  tcfile.close()
+
+  # The workers switch from the coarse to the full model after the burn-in:
+  Bconfig.set(section, "coarsefunc", "hack BARTfunc {:s}".format(filedir))
+  Bconfig.set(section, "coarse_tconfig", coarse_tconfig)
+  Bconfig.set(section, "coarse_atmfile", os.path.realpath(coarse_atmfile))
+  with open(MCMC_cfile, 'w') as configfile:
+    Bconfig.write(configfile)
+
+  return coarse_tconfig, coarse_opacityfile
+
+
 def makeTEA(cfile, TEAdir):
   """
   Make a TEA configuration file.
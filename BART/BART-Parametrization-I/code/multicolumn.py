@@ -0,0 +1,206 @@
+# ****************************** START LICENSE *******************************
+# Bayesian Atmospheric Radiative Transfer (BART), a code to infer
+# properties of planetary atmospheres based on observed spectroscopic
+# information.
+#
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington. Principal developers included graduate students
+# Patricio E. Cubillos and Jasmina Blecic, programmer Madison Stemm, and
+# undergraduates M. Oliver Bowman and Andrew S. D. Foster.  The included
+# 'transit' radiative transfer code is based on an earlier program of
+# the same name written by Patricio Rojo (Univ. de Chile, Santiago) when
+# he was a graduate student at Cornell University under Joseph
+# Harrington.  Statistical advice came from Thomas J. Loredo and Nate
+# B. Lust.
+#
+# Copyright (C) 2015 University of Central Florida.  All rights reserved.
+#
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+#
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+#
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+#
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# Jasmina Blecic <jasmina@physics.ucf.edu>
+#
+# or alternatively,
+#
+# Joseph Harrington, Patricio Cubillos, and Jasmina Blecic
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+#
+# Thank you for testing BART!
+# ******************************* END LICENSE *******************************
+
+
+"""
+    Multi-column forward model: evaluate the emission spectra of several
+    atmospheric columns (e.g., a hot spot and the rest of the dayside) in
+    parallel, and combine them with the fraction of the planetary disk
+    that each column covers.
+
+    The column processes are forked once transit is initialized, so they
+    share (copy-on-write) the opacity grid and the CIA tables that transit
+    already holds in memory.  Only the profiles and the spectra go
+    through the pipes.  Forking after MPI initialization is not safe,
+    so a pool created in an MPI process evaluates the columns serially.
+
+    Functions
+    ---------
+    columnweights:
+          Normalized disk fraction of each column.
+    ColumnPool:
+          Processes that evaluate the columns of a model.
+"""
+
+import sys, os
+import multiprocessing as mp
+import numpy as np
+
+BARTdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(BARTdir + "/../modules/transit/transit/python")
+import transit_module as trm
+
+
+def columnweights(weights, ncolumns):
+  """
+  Normalized disk fraction of each column.
+
+  Parameters:
+  -----------
+  weights: 1D float iterable
+     Relative disk fraction of each column (equal fractions if None).
+  ncolumns: Integer
+     Number of columns.
+
+  Returns:
+  --------
+  weights: 1D float ndarray
+     Column weights, normalized to add up to one.
+  """
+  if weights is None:
+    return np.tile(1.0/ncolumns, ncolumns)
+  weights = np.asarray(weights, np.double)
+  if len(weights) != ncolumns:
+    raise ValueError("There are {:d} column weights for {:d} columns.".
+                     format(len(weights), ncolumns))
+  if np.any(weights < 0) or np.sum(weights) <= 0:
+    raise ValueError("The column weights must be non-negative, with a "
+                     "positive sum.")
+  return weights / np.sum(weights)
+
+
+def _column(conn):
+  """
+  Column process: evaluate the spectrum of each received profile until
+  receiving None.
+  """
+  while True:
+    task = conn.recv()
+    if task is None:
+      break
+    profiles, nwave = task
+    conn.send(trm.run_transit(profiles, nwave))
+  conn.close()
+
+
+class ColumnPool(object):
+  """
+  Processes that evaluate the columns of a model (the calling process
+  evaluates the first column).  Create the pool after transit_init, and
+  close it before free_memory.  With an MPI communicator, the calling
+  process evaluates all the columns (no processes are forked).
+
+  Example:
+  --------
+  >>> pool = ColumnPool(2)
+  >>> spectra = pool.run(colprofiles, nwave)
+  >>> spectrum = np.dot(weights, spectra)
+  >>> pool.close()
+  """
+  def __init__(self, ncolumns, comm=None):
+    """
+    Parameters:
+    -----------
+    ncolumns: Integer
+       Number of atmospheric columns.
+    comm: MPI communicator
+       Communicator of the calling process, if it runs under MPI.
+    """
+    self.ncolumns = ncolumns
+    self.conns = []
+    self.procs = []
+    if comm is not None:
+      return
+    for i in np.arange(1, ncolumns):
+      conn, child = mp.Pipe()
+      proc = mp.Process(target=_column, args=(child,))
+      proc.daemon = True
+      proc.start()
+      child.close()
+      self.conns.append(conn)
+      self.procs.append(proc)
+
+
+  def run(self, profiles, nwave):
+    """
+    Evaluate the spectra of the columns.
+
+    Parameters:
+    -----------
+    profiles: 3D float ndarray
+       Temperature and abundance profiles of each column, of shape
+       (ncolumns, nspecies+1, nlayers).
+    nwave: Integer
+       Number of wavenumber samples.
+
+    Returns:
+    --------
+    spectra: 2D float ndarray
+       Transit output spectrum of each column, of shape (ncolumns, nwave).
+    """
+    nforked = len(self.conns)
+    for conn, colprofiles in zip(self.conns, profiles[1:]):
+      conn.send((colprofiles.flatten(), nwave))
+    spectra = np.zeros((self.ncolumns, nwave), np.double)
+    spectra[0] = trm.run_transit(profiles[0].flatten(), nwave)
+    # Columns without a process (serial pool):
+    for i in np.arange(nforked+1, self.ncolumns):
+      spectra[i] = trm.run_transit(profiles[i].flatten(), nwave)
+    for i in np.arange(1, nforked+1):
+      spectra[i] = self.conns[i-1].recv()
+    return spectra
+
+
+  def close(self):
+    """
+    Stop the column processes.
+    """
+    for conn in self.conns:
+      conn.send(None)
+      conn.close()
+    for proc in self.procs:
+      proc.join()
+    self.conns = []
+    self.procs = []
@@ -0,0 +1,192 @@
+# ****************************** START LICENSE *******************************
+# Bayesian Atmospheric Radiative Transfer (BART), a code to infer
+# properties of planetary atmospheres based on observed spectroscopic
+# information.
+#
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington. Principal developers included graduate students
+# Patricio E. Cubillos and Jasmina Blecic, programmer Madison Stemm, and
+# undergraduates M. Oliver Bowman and Andrew S. D. Foster.  The included
+# 'transit' radiative transfer code is based on an earlier program of
+# the same name written by Patricio Rojo (Univ. de Chile, Santiago) when
+# he was a graduate student at Cornell University under Joseph
+# Harrington.  Statistical advice came from Thomas J. Loredo and Nate
+# B. Lust.
+#
+# Copyright (C) 2015 University of Central Florida.  All rights reserved.
+#
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+#
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+#
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+#
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# Jasmina Blecic <jasmina@physics.ucf.edu>
+#
+# or alternatively,
+#
+# Joseph Harrington, Patricio Cubillos, and Jasmina Blecic
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+#
+# Thank you for testing BART!
+# ******************************* END LICENSE *******************************
+
+"""
+    Content-addressed store of Transit opacity grids.  A grid is keyed
+    by a hash of the inputs that define it (Transit sampling arguments,
+    line-database, CIA, and molecules files, and the atmospheric file),
+    and the run directories reference the stored grid through a link
+    instead of a copy.  The grid key also sets the Transit shared-memory
+    key (opakey), so that runs with the same grid share one segment.
+
+    Functions
+    ---------
+    gridfiles:
+          Input files of an opacity grid.
+    gridkey:
+          Content key of an opacity grid.
+    shmkey:
+          Shared-memory key from a grid key.
+    storefile:
+          Name of a grid in the store.
+    put:
+          Move a grid into the store.
+    link:
+          Reference a file by a hard or symbolic link.
+"""
+
+import os
+import shutil
+import hashlib
+
+import stages as st
+
+BARTdir = os.path.dirname(os.path.realpath(__file__))
+
+# Transit arguments that define an opacity grid:
+OPACITYARGS = ["wllow", "wlhigh", "wlfct", "wnlow", "wnhigh", "wndelt",
+               "wnfct", "wnosamp", "tlow", "thigh", "tempdelt", "allowq",
+               "nwidth", "molfile", "linedb", "cia"]
+
+
+def gridfiles(args, date_dir):
+  """
+  Input files of an opacity grid: the line databases, the CIA files, and
+  the molecules file (the Transit default if not set).
+
+  Parameters:
+  -----------
+  args: Dictionary
+     Transit arguments (as in the BART configuration file).
+  date_dir: String
+     Directory where Transit runs (for relative file names).
+
+  Returns:
+  --------
+  files: List of strings
+     Input file names.
+  """
+  files = []
+  for arg in ["linedb", "cia", "molfile"]:
+    if arg in args:
+      files += [os.path.join(date_dir, f) for f in args[arg].split()]
+  if "molfile" not in args:
+    files.append(os.path.realpath(BARTdir +
+                                  "/../modules/transit/inputs/molecules.dat"))
+  return files
+
+
+def gridkey(args, atmfile, date_dir):
+  """
+  Content key of an opacity grid.
+
+  Parameters:
+  -----------
+  args: Dictionary
+     Transit arguments (as in the BART configuration file).
+  atmfile: String
+     Atmospheric file (the grid depends on its layers and abundances).
+  date_dir: String
+     Directory where Transit runs (for relative file names).
+
+  Returns:
+  --------
+  key: String
+     Hexadecimal SHA-1 digest of the grid inputs.
+  """
+  files = [atmfile] + gridfiles(args, date_dir)
+
+  sha = hashlib.sha1()
+  sha.update(repr([(arg, args.get(arg)) for arg in OPACITYARGS]))
+  for filename in files:
+    sha.update(st.fingerprint(filename))
+  return sha.hexdigest()
+
+
+def shmkey(key):
+  """
+  Transit shared-memory key (a positive, even, 31-bit integer) from a
+  grid key.  Transit uses shmkey and shmkey+1 for its two segments.
+  """
+  return (int(key[:8], 16) & 0x7ffffffe) or 2
+
+
+def storefile(store, key, opacityfile):
+  """
+  Name of a grid in the store (the grid key, with the extension of the
+  opacity file).
+  """
+  return os.path.join(store, key + os.path.splitext(opacityfile)[1])
+
+
+def put(filename, storefile):
+  """
+  Move a grid file into the store.
+  """
+  store = os.path.dirname(storefile)
+  if store != "" and not os.path.isdir(store):
+    os.makedirs(store)
+  try:
+    os.rename(filename, storefile)
+  except OSError:  # Across file systems
+    shutil.move(filename, storefile)
+
+
+def link(source, dest):
+  """
+  Reference source at dest with a hard link, or with a symbolic link if
+  the files are in different file systems (copy as a last resort).
+  """
+  if os.path.lexists(dest):
+    if os.path.exists(dest) and os.path.samefile(source, dest):
+      return
+    os.remove(dest)
+  try:
+    os.link(source, dest)
+  except OSError:
+    try:
+      os.symlink(os.path.realpath(source), dest)
+    except OSError:
+      shutil.copy2(source, dest)
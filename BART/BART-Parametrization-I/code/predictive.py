@@ -0,0 +1,346 @@
+#! /usr/bin/env python
+
+# ****************************** START LICENSE *******************************
+# Bayesian Atmospheric Radiative Transfer (BART), a code to infer
+# properties of planetary atmospheres based on observed spectroscopic
+# information.
+# 
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington. Principal developers included graduate students
+# Patricio E. Cubillos and Jasmina Blecic, programmer Madison Stemm, and
+# undergraduates M. Oliver Bowman and Andrew S. D. Foster.  The included
+# 'transit' radiative transfer code is based on an earlier program of
+# the same name written by Patricio Rojo (Univ. de Chile, Santiago) when
+# he was a graduate student at Cornell University under Joseph
+# Harrington.  Statistical advice came from Thomas J. Loredo and Nate
+# B. Lust.
+# 
+# Copyright (C) 2015 University of Central Florida.  All rights reserved.
+# 
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+# 
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+# 
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+# 
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# Jasmina Blecic <jasmina@physics.ucf.edu>
+# 
+# or alternatively,
+# 
+# Joseph Harrington, Patricio Cubillos, and Jasmina Blecic
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+# 
+# Thank you for testing BART!
+# ******************************* END LICENSE *******************************
+
+"""
+    Posterior-predictive spectra: draw samples from the MCMC chain store,
+    evaluate their spectra and band fluxes with the BART workers, and
+    reduce them into percentile bands.
+
+    Functions
+    ---------
+    drawsamples:
+          Draw random parameter sets from the MCMC posterior.
+    evaluate:
+          Evaluate the drawn models on the BART workers.
+    quantiles:
+          Percentile bands of the evaluated models.
+    main:
+          Run the posterior-predictive stage from a configuration file.
+
+    Usage
+    -----
+    mpiexec predictive.py -c MCMC_config_file
+"""
+
+import sys, os
+import argparse, ConfigParser
+import numpy as np
+from mpi4py import MPI
+
+BARTdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(BARTdir + "/../modules/MCcubed/src/")
+import mcutils as mu
+import bestFit as bf
+
+
+def drawsamples(savefile, params, stepsize, burnin, nsamples):
+  """
+  Draw random parameter sets from the (post burn-in) MCMC posterior.
+
+  Parameters:
+  -----------
+  savefile: String
+     MCMC output file with the parameters of shape (nchains, nfree, niter).
+  params: 1D float ndarray
+     Model parameters (provides the values of the fixed parameters).
+  stepsize: 1D float ndarray
+     Parameters stepsize (zero for fixed, negative for shared parameters).
+  burnin: Integer
+     Number of burned-in iterations per chain.
+  nsamples: Integer
+     Number of samples to draw.
+
+  Returns:
+  --------
+  samples: 2D float ndarray
+     Full parameter sets of shape (nsamples, npars).
+  """
+  if not os.path.isfile(savefile) and os.path.isfile(savefile + ".npy"):
+    savefile += ".npy"
+  if not os.path.isfile(savefile):
+    mu.error("MCMC output file ('{:s}') not found.".format(savefile))
+  allparams = np.load(savefile, mmap_mode="r")
+  nchains, nfree, niter = np.shape(allparams)
+  if burnin >= niter:
+    mu.error("The burn-in ({:d}) is longer than the chains ({:d}).".
+             format(burnin, niter))
+
+  # Draw without replacement, unless asked for more than the posterior size:
+  npost = nchains * (niter-burnin)
+  idraw = np.random.choice(npost, nsamples, replace=nsamples > npost)
+  ichain, iiter = idraw / (niter-burnin), idraw % (niter-burnin) + burnin
+  # Sort the draws to read the chain store sequentially:
+  isort = np.lexsort((iiter, ichain))
+
+  ifree  = np.where(stepsize > 0)[0]
+  ishare = np.where(stepsize < 0)[0]
+  samples = np.tile(np.asarray(params, np.double), (nsamples, 1))
+  samples[:,ifree] = allparams[ichain[isort], :, iiter[isort]]
+  for s in ishare:
+    samples[:,s] = samples[:,-int(stepsize[s])-1]
+  return samples
+
+
+def evaluate(comm, samples, nprocs, nfilters, drawfile):
+  """
+  Evaluate the models of the drawn samples on the BART workers, storing
+  the band fluxes and spectra into a memory-mapped file.
+
+  Parameters:
+  -----------
+  comm: MPI communicator
+     Communicator with the (--sendspec) BARTfunc workers.
+  samples: 2D float ndarray
+     Parameter sets of shape (nsamples, npars).
+  nprocs: Integer
+     Number of workers.
+  nfilters: Integer
+     Number of filters (band fluxes per model).
+  drawfile: String
+     Output .npy file with the models of shape (nsamples, nfilters+nwave),
+     each row holds the band fluxes followed by the spectrum.
+
+  Returns:
+  --------
+  specwn: 1D float ndarray
+     Wavenumber array of the spectra.
+  """
+  nsamples, npars = np.shape(samples)
+  nbatch = (nsamples-1)/nprocs + 1
+
+  # Send the number of parameters and iterations (no coarse switch):
+  array1 = np.asarray([npars, nbatch-1, -1], np.int)
+  mu.comm_bcast(comm, array1, MPI.INT)
+
+  # Receive the wavenumber array:
+  nwave = np.zeros(nprocs, np.double)
+  mu.comm_gather(comm, nwave)
+  nwave = int(nwave[0])
+  specwn = np.zeros(nprocs*nwave, np.double)
+  mu.comm_gather(comm, specwn)
+  specwn = specwn[0:nwave]
+
+  nout = nfilters + nwave
+  draws = np.lib.format.open_memmap(drawfile, mode="w+", dtype=np.double,
+                                    shape=(nsamples, nout))
+  sendp  = np.zeros((nprocs, npars), np.double)
+  models = np.zeros(nprocs*nout,     np.double)
+  for b in np.arange(nbatch):
+    start = b*nprocs
+    end   = np.amin((start+nprocs, nsamples))
+    # The workers skip the NaN padding of the last batch:
+    sendp[:] = np.nan
+    sendp[0:end-start] = samples[start:end]
+    mu.comm_scatter(comm, sendp.flatten(), MPI.DOUBLE)
+    mu.comm_gather(comm, models)
+    draws[start:end] = np.reshape(models, (nprocs, nout))[0:end-start]
+    mu.progressbar((b+1.0)/nbatch)
+  draws.flush()
+  del draws
+  return specwn
+
+
+def quantiles(drawfile, nfilters, levels, chunksize=2048):
+  """
+  Compute the percentile bands of the evaluated models, reading the
+  memory-mapped models in blocks of wavenumber samples.
+
+  Parameters:
+  -----------
+  drawfile: String
+     File with the models of shape (nsamples, nfilters+nwave).
+  nfilters: Integer
+     Number of filters.
+  levels: 1D float ndarray
+     Percentiles to compute (between 0 and 100).
+  chunksize: Integer
+     Number of columns reduced at a time.
+
+  Returns:
+  --------
+  bandflux: 2D float ndarray
+     Band-flux percentiles of shape (nlevels, nfilters).
+  spectrum: 2D float ndarray
+     Spectrum percentiles of shape (nlevels, nwave).
+  nvalid: Integer
+     Number of models used (the workers flag non-physical models
+     with -1).
+  """
+  draws = np.load(drawfile, mmap_mode="r")
+  nsamples, nout = np.shape(draws)
+  igood = np.where(~np.all(draws[:,0:nfilters] == -1.0, axis=1))[0]
+  nvalid = len(igood)
+  if nvalid == 0:
+    mu.error("All the posterior-predictive models are non-physical.")
+
+  bands = np.zeros((len(levels), nout), np.double)
+  for start in np.arange(0, nout, chunksize):
+    end = np.amin((start+chunksize, nout))
+    bands[:,start:end] = np.percentile(draws[igood,start:end], list(levels),
+                                       axis=0)
+  return bands[:,0:nfilters], bands[:,nfilters:], nvalid
+
+
+def main():
+  """
+  Posterior-predictive stage of BART.
+
+  Notes:
+  ------
+  The output file ('predictive_file') is a .npz file with the arrays:
+  wn (the spectrum wavenumber, in cm-1), levels (the percentiles),
+  bandflux (nlevels, nfilters), spectrum (nlevels, nwave), and the
+  number of drawn (nsamples) and non-physical-free (nvalid) models.
+  The spectra are the transit outputs (flux for eclipse geometry,
+  modulation for transit geometry).
+  """
+  # Parse the config file from the command line:
+  cparser = argparse.ArgumentParser(description=__doc__, add_help=False,
+                         formatter_class=argparse.RawDescriptionHelpFormatter)
+  cparser.add_argument("-c", "--config_file",
+                       help="Configuration file", metavar="FILE")
+  args, remaining_argv = cparser.parse_known_args()
+
+  cfile = args.config_file
+  if cfile is None or not os.path.isfile(cfile):
+    mu.error("Configuration file: '{}' not found.".format(cfile))
+  config = ConfigParser.SafeConfigParser()
+  config.optionxform = str
+  config.read([cfile])
+  defaults = dict(config.items("MCMC"))
+
+  parser = argparse.ArgumentParser(parents=[cparser])
+  parser.add_argument("--params",   dest="params",   type=mu.parray,
+                                    action="store",  default=None)
+  parser.add_argument("--stepsize", dest="stepsize", type=mu.parray,
+                                    action="store",  default=None)
+  parser.add_argument("--burnin",   dest="burnin",   type=int,
+                                    action="store",  default=0)
+  parser.add_argument("--nchains",  dest="nchains",  type=int,
+                                    action="store",  default=10)
+  parser.add_argument("--savefile", dest="savefile", type=str,
+                                    action="store",  default="output.npy")
+  parser.add_argument("--logfile",  dest="logfile",  type=str,
+                                    action="store",  default=None)
+  parser.add_argument("--filter",   dest="filter",   type=mu.parray,
+                                    action="store",  default=None)
+  group = parser.add_argument_group("Posterior predictive")
+  group.add_argument("--predictive",        dest="predictive",
+           help="Number of posterior samples to evaluate "
+                "[default: %(default)s]",
+           type=int,       action="store", default=0)
+  group.add_argument("--predictive_levels", dest="predictive_levels",
+           help="Percentiles of the posterior-predictive bands "
+                "[default: %(default)s]",
+           type=mu.parray, action="store",
+           default=[2.5, 16.0, 50.0, 84.0, 97.5])
+  group.add_argument("--predictive_file",   dest="predictive_file",
+           help="Posterior-predictive output file [default: %(default)s]",
+           type=str,       action="store", default="predictive.npz")
+  group.add_argument("--predictive_keep",   dest="predictive_keep",
+           help="Keep the file with all evaluated models "
+                "[default: %(default)s]",
+           type=eval,      action="store", default=False)
+  parser.set_defaults(**defaults)
+  args2, unknown = parser.parse_known_args(remaining_argv)
+
+  nsamples = args2.predictive
+  outfile  = args2.predictive_file
+  levels   = np.asarray(args2.predictive_levels, np.double)
+  if nsamples <= 0:
+    mu.error("The number of posterior-predictive samples must be positive.")
+
+  # The params may come from a file:
+  params   = args2.params
+  stepsize = args2.stepsize
+  if isinstance(params[0], str):
+    array = mu.read2array(params[0])
+    if len(array) >= 4:
+      stepsize = array[3]
+    params = array[0]
+  params   = np.asarray(params,   np.double)
+  stepsize = np.asarray(stepsize, np.double)
+  nfilters = len(args2.filter)
+  nprocs   = args2.nchains
+  # Use the burn-in reported by MC3 (may be estimated automatically):
+  burnin   = args2.burnin
+  if args2.logfile is not None and os.path.isfile(args2.logfile):
+    if bf.read_burnin(args2.logfile) is not None:
+      burnin = bf.read_burnin(args2.logfile)
+
+  mu.msg(1, "Draw {:d} samples from '{:s}'.".format(nsamples,
+                                                    args2.savefile), indent=2)
+  samples = drawsamples(args2.savefile, params, stepsize, burnin, nsamples)
+
+  # Spawn the BART workers, returning the spectra:
+  comm = mu.comm_spawn("BARTfunc.py", nprocs, cfile, rargs=["--sendspec"],
+                       path=BARTdir + "/")
+  drawfile = os.path.splitext(outfile)[0] + "_models.npy"
+  specwn = evaluate(comm, samples, nprocs, nfilters, drawfile)
+  mu.comm_disconnect(comm)
+
+  bandflux, spectrum, nvalid = quantiles(drawfile, nfilters, levels)
+  np.savez(outfile, wn=specwn, levels=levels, bandflux=bandflux,
+           spectrum=spectrum, nsamples=nsamples, nvalid=nvalid)
+  if not args2.predictive_keep:
+    os.remove(drawfile)
+  mu.msg(1, "\nPosterior-predictive bands from {:d} valid models (of {:d}) "
+            "written to '{:s}'.".format(nvalid, nsamples, outfile), indent=2)
+
+
+if __name__ == "__main__":
+  main()
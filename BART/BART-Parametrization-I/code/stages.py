@@ -0,0 +1,251 @@
+# ****************************** START LICENSE *******************************
+# Bayesian Atmospheric Radiative Transfer (BART), a code to infer
+# properties of planetary atmospheres based on observed spectroscopic
+# information.
+#
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington. Principal developers included graduate students
+# Patricio E. Cubillos and Jasmina Blecic, programmer Madison Stemm, and
+# undergraduates M. Oliver Bowman and Andrew S. D. Foster.  The included
+# 'transit' radiative transfer code is based on an earlier program of
+# the same name written by Patricio Rojo (Univ. de Chile, Santiago) when
+# he was a graduate student at Cornell University under Joseph
+# Harrington.  Statistical advice came from Thomas J. Loredo and Nate
+# B. Lust.
+#
+# Copyright (C) 2015 University of Central Florida.  All rights reserved.
+#
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+#
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+#
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+#
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# Jasmina Blecic <jasmina@physics.ucf.edu>
+#
+# or alternatively,
+#
+# Joseph Harrington, Patricio Cubillos, and Jasmina Blecic
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+#
+# Thank you for testing BART!
+# ******************************* END LICENSE *******************************
+
+"""
+    Content-hash cache of the BART pipeline stages (pressure file,
+    elemental abundances, pre-atmospheric file, TEA, opacity tables, and
+    MCMC).  Each stage is keyed by a hash of its configuration values,
+    its input files, and the keys of the stages it depends on, so that a
+    stage reruns only when something it depends on changed.
+
+    Functions
+    ---------
+    fingerprint:
+          Hash the content of a file.
+    StageCache:
+          Record and query the stage keys of an output directory.
+"""
+
+import os
+import hashlib
+import json
+
+import mcutils as mu
+
+# Files larger than this (in bytes) are fingerprinted by their size and
+# modification time instead of their content:
+HASHSIZE = 64 * 1024**2
+
+
+def fingerprint(filename):
+  """
+  Hash the content of a file.
+
+  Parameters:
+  -----------
+  filename: String
+     File name.
+
+  Returns:
+  --------
+  fp: String
+     Hexadecimal SHA-1 digest of the file content (of the size and
+     modification time for files larger than HASHSIZE), or 'missing' if
+     the file does not exist.
+  """
+  if filename is None or not os.path.isfile(filename):
+    return "missing"
+  stat = os.stat(filename)
+  sha = hashlib.sha1()
+  if stat.st_size > HASHSIZE:
+    sha.update("{:d} {!r}".format(stat.st_size, stat.st_mtime))
+  else:
+    f = open(filename, "rb")
+    for block in iter(lambda: f.read(1024**2), ""):
+      sha.update(block)
+    f.close()
+  return sha.hexdigest()
+
+
+class StageCache(object):
+  """
+  Keys of the pipeline stages run in an output directory, stored in the
+  'stages.json' file of that directory.
+
+  Example:
+  --------
+  >>> cache = StageCache(date_dir)
+  >>> key = cache.key("pressure", [n_layers, p_top, p_bottom, log])
+  >>> if cache.status("pressure", key) == "run":
+  >>>   mp.makeP(n_layers, p_top, p_bottom, press_file, log)
+  >>>   cache.done("pressure", key, [press_file])
+  """
+  def __init__(self, date_dir, dryrun=False):
+    """
+    Parameters:
+    -----------
+    date_dir: String
+       Output directory.
+    dryrun: Bool
+       If True, never write the cache file.
+    """
+    self.cachefile = os.path.join(date_dir, "stages.json")
+    self.dryrun = dryrun
+    self.stages = {}
+    self.plan   = []  # (stage, status) pairs, see status()
+    self.keys   = {}  # Key of each planned stage
+    if os.path.isfile(self.cachefile):
+      f = open(self.cachefile, "r")
+      self.stages = json.load(f)
+      f.close()
+
+
+  def key(self, stage, values=[], files=[], depends=[]):
+    """
+    Hash the inputs of a stage.
+
+    Parameters:
+    -----------
+    stage: String
+       Stage name.
+    values: List or dict
+       Configuration values of the stage.
+    files: List of strings
+       Input files of the stage (see fingerprint).
+    depends: List of strings
+       Keys of the stages this stage depends on.
+
+    Returns:
+    --------
+    key: String
+       Hexadecimal SHA-1 digest of the stage inputs.
+    """
+    if isinstance(values, dict):
+      values = sorted(values.items())
+    sha = hashlib.sha1()
+    sha.update(stage)
+    sha.update(repr(values))
+    for filename in files:
+      sha.update(fingerprint(filename))
+    for depend in depends:
+      sha.update(str(depend))
+    return sha.hexdigest()
+
+
+  def needed(self, stage, key):
+    """
+    Check whether a stage must run: its key differs from the recorded
+    key, or any of its recorded outputs is missing.
+    """
+    record = self.stages.get(stage)
+    if record is None or record["key"] != key:
+      return True
+    return not all([os.path.isfile(out) for out in record["outputs"]])
+
+
+  def done(self, stage, key, outputs):
+    """
+    Record a completed stage and its output files.
+    """
+    self.stages[stage] = {"key":key, "outputs":list(outputs)}
+    if self.dryrun:
+      return
+    f = open(self.cachefile, "w")
+    json.dump(self.stages, f, indent=2, sort_keys=True)
+    f.close()
+
+
+  def status(self, stage, key, provided=False, force=False):
+    """
+    Decide (and record in the plan) whether a stage runs.
+
+    Parameters:
+    -----------
+    stage: String
+       Stage name.
+    key: String
+       Stage key (see key).
+    provided: Bool
+       If True, the user provided the stage output.
+    force: Bool
+       If True, run the stage regardless of the cache.
+
+    Returns:
+    --------
+    status: String
+       'provided', 'run', or 'cached'.
+    """
+    if provided:
+      status = "provided"
+    elif force or self.needed(stage, key):
+      status = "run"
+    else:
+      status = "cached"
+    self.plan.append((stage, status))
+    self.keys[stage] = key
+    return status
+
+
+  def report(self):
+    """
+    Print the status of the planned stages.
+    """
+    mu.msg(1, "\nPipeline stages:")
+    for stage, status in self.plan:
+      mu.msg(1, "{:<12s} {:s}".format(stage, status), indent=2)
+
+
+  def writeplan(self, planfile, files={}):
+    """
+    Write the key and status of the planned stages (and the given
+    output file names) into a JSON file.  The campaign runner reads
+    these to find the stages that several runs share.
+    """
+    plan = {"stages":dict([(stage, {"key":self.keys[stage], "status":status})
+                           for stage, status in self.plan]),
+            "files":files}
+    f = open(planfile, "w")
+    json.dump(plan, f, indent=2, sort_keys=True)
+    f.close()
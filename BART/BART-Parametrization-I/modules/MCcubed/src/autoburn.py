@@ -0,0 +1,179 @@
+# ******************************* START LICENSE *****************************
+# 
+# Multi-Core Markov-chain Monte Carlo (MC3), a code to estimate
+# model-parameter best-fitting values and Bayesian posterior
+# distributions.
+# 
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington.  Principal developers included graduate student
+# Patricio E. Cubillos and programmer Madison Stemm.  Statistical advice
+# came from Thomas J. Loredo and Nate B. Lust.
+# 
+# Copyright (C) 2014 University of Central Florida.  All rights reserved.
+# 
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+# 
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+# 
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+# 
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# 
+# or alternatively,
+# 
+# Joseph Harrington and Patricio Cubillos
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+# 
+# Thank you for using MC3!
+
+
+import numpy as np
+
+
+def stabilize(chisq, window=None):
+  """
+  Find the iteration where the chi-square of the chains stabilizes.
+
+  Parameters:
+  -----------
+  chisq: 2D float ndarray
+     Chi-square of the chains state, of shape (nchains, niter).
+  window: Integer
+     Number of iterations averaged together (default: niter/50).
+
+  Returns:
+  --------
+  istable: Integer
+     First iteration where the (window-averaged) median chi-square
+     across the chains falls within one standard deviation of the
+     chi-square level of the second half of the run.
+  """
+  nchains, niter = np.shape(chisq)
+  if window is None:
+    window = niter/50
+  window = int(np.amax((window, 1)))
+
+  # Median chi-square across the chains, averaged over windows:
+  nwin = niter/window
+  medchisq = np.median(chisq[:,0:nwin*window], axis=0)
+  medchisq = np.mean(np.reshape(medchisq, (nwin, window)), axis=1)
+
+  # Reference level and spread (MAD scaled to a standard deviation):
+  late   = chisq[:,niter/2:]
+  level  = np.median(late)
+  spread = 1.4826 * np.median(np.abs(late - level))
+  istable = np.where(medchisq <= level + spread)[0]
+  if len(istable) == 0:
+    return niter/2
+  return istable[0] * window
+
+
+def geweke(chains, first=0.1, last=0.5, nbatch=10):
+  """
+  Geweke-style diagnostic: z-score of the difference between the mean
+  of the first and last segments of the chains.  The variances of the
+  means come from batch means, to account for the autocorrelation.
+
+  Parameters:
+  -----------
+  chains: 3D float ndarray
+     Parameter chains of shape (nchains, nfree, niter).
+  first: Float
+     Fraction of the chains in the first segment.
+  last: Float
+     Fraction of the chains in the last segment.
+  nbatch: Integer
+     Number of batches per segment.
+
+  Returns:
+  --------
+  zscore: 1D float ndarray
+     The z-scores of the free parameters (combined over the chains),
+     or None if the chains are too short.
+  """
+  nchains, nfree, niter = np.shape(chains)
+  na = int(first*niter) / nbatch
+  nb = int(last *niter) / nbatch
+  if na < 1:
+    return None
+
+  # Segment means and variances of the means (nchains, nfree):
+  amean = np.reshape(chains[:,:,0:na*nbatch], (nchains, nfree, nbatch, na))
+  amean = np.mean(amean, axis=3)
+  bmean = np.reshape(chains[:,:,niter-nb*nbatch:], (nchains, nfree, nbatch,
+                                                    nb))
+  bmean = np.mean(bmean, axis=3)
+  var = (np.var(amean, axis=2, ddof=1) + np.var(bmean, axis=2, ddof=1))/nbatch
+  diff = np.mean(amean, axis=2) - np.mean(bmean, axis=2)
+
+  # Stuck (constant) parameters have zero variance:
+  zscore = np.zeros((nchains, nfree))
+  ivar = var > 0
+  zscore[ivar] = diff[ivar] / np.sqrt(var[ivar])
+  zscore[~ivar & (diff != 0)] = np.inf
+  # Combine the independent chains:
+  return np.sum(zscore, axis=0) / np.sqrt(nchains)
+
+
+def autoburn(chisq, chains, minburn=0, ncuts=20, zcrit=3.0):
+  """
+  Estimate the number of burn-in iterations of a set of chains.
+
+  Parameters:
+  -----------
+  chisq: 2D float ndarray
+     Chi-square of the chains state, of shape (nchains, niter).
+  chains: 3D float ndarray
+     Parameter chains of shape (nchains, nfree, niter).
+  minburn: Integer
+     Minimum number of burn-in iterations.
+  ncuts: Integer
+     Number of candidate cuts tested along the chains.
+  zcrit: Float
+     Critical Geweke z-score (the test is applied to every free
+     parameter, hence the conservative default).
+
+  Returns:
+  --------
+  burnin: Integer
+     Estimated number of burn-in iterations.
+  converged: Bool
+     Whether the chains after burnin pass the Geweke-style test.  If
+     False, burnin is the chi-square stabilization point.
+
+  Notes:
+  ------
+  The candidate cuts start where the chi-square stabilizes, and are
+  spaced by niter/ncuts iterations; the first candidate whose remaining
+  chains pass the Geweke-style test is the burn-in.  The cut leaves at
+  least half of the chains.
+  """
+  nchains, niter = np.shape(chisq)
+  start = int(np.amax((minburn, stabilize(chisq))))
+  step  = int(np.amax((niter/ncuts, 1)))
+  for cut in np.arange(start, niter/2+1, step):
+    zscore = geweke(chains[:,:,cut:niter])
+    if zscore is not None and np.all(np.abs(zscore) < zcrit):
+      return int(cut), True
+  return start, False
@@ -89,6 +89,8 @@ def main(comm):
                                            action="store",  default=None)
   parser.add_argument("-i", "--indparams", dest="indparams", type=mu.parray, 
                                            action="store",   default=[])
+  parser.add_argument("--coarsefunc",      dest="coarsefunc", type=mu.parray,
+                                           action="store",   default=None)
   parser.set_defaults(**defaults)
   args2, unknown = parser.parse_known_args(remaining_argv)
 
@@ -97,15 +99,23 @@ def main(comm):
     sys.path.append(args2.func[2])
 
   exec('from {:s} import {:s} as func'.format(args2.func[1], args2.func[0]))
+  # Coarse-resolution model function for the burn-in:
+  if args2.coarsefunc is not None:
+    if len(args2.coarsefunc) == 3:
+      sys.path.append(args2.coarsefunc[2])
+    exec('from {:s} import {:s} as coarsefunc'.format(args2.coarsefunc[1],
+                                                      args2.coarsefunc[0]))
   # Get indparams from configuration file:
   if args2.indparams != [] and os.path.isfile(args2.indparams[0]):
-    indparams = mu.readbin(args2.indparams[0])
+    indparams = mu.readbin(args2.indparams[0], mmap=True)
 
 
-  # Get the number of parameters and iterations from MPI:
-  array1 = np.zeros(2, np.int)
+  # Get the number of parameters, iterations, and the evaluation index
+  # to switch from the coarse to the full model from MPI:
+  array1 = np.zeros(3, np.int)
   mu.comm_bcast(comm, array1)
-  npars, niter = array1
+  npars, niter, iswitch = array1
+  ieval = 0  # Evaluation counter
 
   # Allocate array to receive parameters from MPI:
   params = np.zeros(npars, np.double)
@@ -115,9 +125,16 @@ def main(comm):
     # Receive parameters from MCMC:
     mu.comm_scatter(comm, params)
 
-    # Evaluate model:
-    fargs = [params] + indparams  # List of function's arguments
-    model = func(*fargs)
+    # Skip proposals screened out by the master (delayed acceptance),
+    # send back the previous model instead:
+    if not np.isnan(params[0]):
+      # Evaluate model:
+      fargs = [params] + indparams  # List of function's arguments
+      if ieval < iswitch:
+        model = coarsefunc(*fargs)
+      else:
+        model = func(*fargs)
+    ieval += 1
 
     # Send resutls:
     mu.comm_gather(comm, model, MPI.DOUBLE)
@@ -0,0 +1,287 @@
+# ******************************* START LICENSE *****************************
+# 
+# Multi-Core Markov-chain Monte Carlo (MC3), a code to estimate
+# model-parameter best-fitting values and Bayesian posterior
+# distributions.
+# 
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington.  Principal developers included graduate student
+# Patricio E. Cubillos and programmer Madison Stemm.  Statistical advice
+# came from Thomas J. Loredo and Nate B. Lust.
+# 
+# Copyright (C) 2014 University of Central Florida.  All rights reserved.
+# 
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+# 
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+# 
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+# 
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# 
+# or alternatively,
+# 
+# Joseph Harrington and Patricio Cubillos
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+# 
+# Thank you for using MC3!
+
+
+import os
+import numpy as np
+
+
+class ModelStore:
+  """
+  Compact store of the models evaluated along the MCMC chains.  A chain
+  only changes its model when it accepts a proposal, so the store keeps
+  a table with the unique models plus an index array of shape
+  (nchains, niter) pointing to the current model of each chain at each
+  iteration.  The full (nchains, ndata, niter) cube is reconstructed
+  only on request.
+
+  Parameters:
+  -----------
+  nchains: Integer
+     Number of chains.
+  ndata: Integer
+     Number of data points per model.
+  niter: Integer
+     Number of iterations per chain.
+
+  Examples:
+  ---------
+  >>> import numpy as np
+  >>> import modelstore as ms
+  >>> store = ms.ModelStore(2, 3, 4)
+  >>> store.update(np.zeros((2,3)))
+  >>> store.record(0, np.array([True, False]), np.ones((2,3)))
+  >>> store.save("models.npz", 1, compress=True)
+  >>> cube = ms.load("models.npz").cube()
+  """
+  def __init__(self, nchains, ndata, niter):
+    self.nchains = nchains
+    self.ndata   = ndata
+    self.index   = np.zeros((nchains, niter), np.int64)
+    self.current = np.zeros(nchains, np.int64)  # Current model of the chains
+    self.table   = np.zeros((nchains, ndata))   # Unique models
+    self.nunique = 0
+
+
+  def add(self, models):
+    """
+    Append models to the table (growing it as needed).
+
+    Parameters:
+    -----------
+    models: 2D ndarray
+       Models of shape (nmodels, ndata).
+
+    Returns:
+    --------
+    index: 1D integer ndarray
+       Table indices of the added models.
+    """
+    nmodels = len(models)
+    if self.nunique + nmodels > len(self.table):
+      nalloc = np.amax((2*len(self.table), self.nunique + nmodels))
+      table = np.zeros((nalloc, self.ndata))
+      table[0:self.nunique] = self.table[0:self.nunique]
+      self.table = table
+    index = np.arange(self.nunique, self.nunique + nmodels)
+    self.table[index] = models
+    self.nunique += nmodels
+    return index
+
+
+  def update(self, models):
+    """
+    Replace the current model of all the chains (e.g., at the initial
+    evaluation).
+
+    Parameters:
+    -----------
+    models: 2D ndarray
+       Models of shape (nchains, ndata).
+    """
+    self.current[:] = self.add(models)
+
+
+  def record(self, iteration, accepted, models):
+    """
+    Record the state of the chains at an iteration: the chains that
+    accepted their proposal store their new model, the others repeat
+    their current model.
+
+    Parameters:
+    -----------
+    iteration: Integer
+       Iteration index.
+    accepted: 1D bool ndarray
+       Flags of the chains that accepted their proposal.
+    models: 2D ndarray
+       Models of shape (nchains, ndata) (only the accepted are read).
+    """
+    if np.any(accepted):
+      self.current[accepted] = self.add(models[accepted])
+    self.index[:,iteration] = self.current
+
+
+  def copy(self, iteration, chain, donor):
+    """
+    Set a chain to the state of a donor chain at an iteration.
+    """
+    self.index[chain, iteration] = self.index[donor, iteration]
+    self.current[chain] = self.current[donor]
+
+
+  def resize(self, niter):
+    """
+    Change the number of iterations per chain (keeping the first ones).
+    """
+    index = np.zeros((self.nchains, niter), np.int64)
+    nkeep = np.amin((niter, np.shape(self.index)[1]))
+    index[:,0:nkeep] = self.index[:,0:nkeep]
+    self.index = index
+
+
+  def cube(self, start=0, end=None):
+    """
+    Reconstruct the models of the chains.
+
+    Parameters:
+    -----------
+    start: Integer
+       First iteration.
+    end: Integer
+       Last iteration (not included, default: all the iterations).
+
+    Returns:
+    --------
+    models: 3D ndarray
+       Models of shape (nchains, ndata, end-start).
+    """
+    return np.transpose(self.table[self.index[:,start:end]], (0,2,1))
+
+
+  def stack(self, start=0):
+    """
+    Stack together the chains models from the iteration start on.
+
+    Returns:
+    --------
+    models: 2D ndarray
+       Models of shape (ndata, nchains*(niter-start)).
+    """
+    return self.table[self.index[:,start:].flatten()].T
+
+
+  def save(self, filename, niter=None, compress=False):
+    """
+    Save the store into a .npz file (any other extension of filename is
+    replaced by .npz).
+
+    Parameters:
+    -----------
+    filename: String
+       Output file name.
+    niter: Integer
+       Number of iterations to save (default: all).
+    compress: Bool
+       If True, use lossless zip compression.
+
+    Returns:
+    --------
+    filename: String
+       Name of the saved file.
+    """
+    filename = npzname(filename)
+    if compress:
+      savez = np.savez_compressed
+    else:
+      savez = np.savez
+    with open(filename, "wb") as f:
+      savez(f, index=self.index[:,0:niter], table=self.table[0:self.nunique])
+    return filename
+
+
+def npzname(filename):
+  """
+  Name of the .npz file of a model store.
+
+  Parameters:
+  -----------
+  filename: String
+     Model file name.
+
+  Returns:
+  --------
+  npzfile: String
+     filename with its extension replaced by .npz.
+  """
+  return os.path.splitext(filename)[0] + ".npz"
+
+
+def load(filename):
+  """
+  Load a model store from file (the .npz file of filename if it exists,
+  see save).  A file with the full model cube of shape (nchains, ndata,
+  niter), as saved by previous versions of MC3, is converted into a
+  store.
+
+  Parameters:
+  -----------
+  filename: String
+     Model file name.
+
+  Returns:
+  --------
+  store: ModelStore instance
+  """
+  if os.path.isfile(npzname(filename)):
+    filename = npzname(filename)
+  data = np.load(filename)
+  if isinstance(data, np.ndarray):
+    nchains, ndata, niter = np.shape(data)
+    store = ModelStore(nchains, ndata, niter)
+    for i in np.arange(niter):
+      if i == 0:
+        changed = np.ones(nchains, bool)
+      else:
+        changed = np.any(data[:,:,i] != data[:,:,i-1], axis=1)
+      store.record(i, changed, data[:,:,i])
+    return store
+
+  index = data["index"]
+  table = data["table"]
+  store = ModelStore(np.shape(index)[0], np.shape(table)[1],
+                     np.shape(index)[1])
+  store.index[:] = index
+  store.table    = np.copy(table)
+  store.nunique  = len(table)
+  data.close()
+  # The chains continue from their last recorded model:
+  if np.shape(index)[1] > 0:
+    store.current[:] = index[:,-1]
+  return store
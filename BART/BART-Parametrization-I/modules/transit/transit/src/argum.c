@@ -145,6 +145,8 @@ processparameters(int argc,            /* Number of command-line args  */
     CLA_GSURF,
     CLA_OPABREAK,
     CLA_OPASHARE,
+    CLA_OPAKEY,
+    CLA_OPATHREADS,
     CLA_NDOP,
     CLA_NLOR,
     CLA_DMIN,
@@ -325,6 +327,13 @@ processparameters(int argc,            /* Number of command-line args  */
      "If set, End execution after the opacity-grid calculation."},
     {"shareOpacity",      CLA_OPASHARE,  no_argument, NULL, NULL,
      "If set, attempt to place the opacity grid into shared memory."},
+    {"opakey",   CLA_OPAKEY,   required_argument, "0",  "integer",
+     "Shared-memory key of the opacity grid (the hint and main segments "
+     "use opakey and opakey+1).  If zero, derive the keys from the opacity "
+     "file (ftok)."},
+    {"opathreads", CLA_OPATHREADS, required_argument, "0",  "integer",
+     "Number of OpenMP threads to compute the opacity grid.  If zero, use "
+     "the OpenMP default (OMP_NUM_THREADS)."},
 
     /* Resulting ray options:                 */
     {NULL,        0,            HELPTITLE,         NULL, NULL,
@@ -537,6 +546,12 @@ processparameters(int argc,            /* Number of command-line args  */
     case CLA_OPASHARE: /* Bool: Place opacity grid in shared memory         */
       hints->opashare = 1;
       break;
+    case CLA_OPAKEY:   /* Shared-memory key of the opacity grid             */
+      hints->opakey = atol(optarg);
+      break;
+    case CLA_OPATHREADS: /* Number of threads for the opacity grid          */
+      hints->opathreads = atoi(optarg);
+      break;
 
     /* Radius parameters:                                                   */
     case CLA_RADLOW:  /* Lower limit                                        */
@@ -803,6 +818,10 @@ acceptgenhints(struct transit *tr){
 
   /* Pass flag to place opacity grid in shared memory:                      */
   tr->opashare = th->opashare;
+  tr->opakey   = th->opakey;
+
+  /* Pass number of threads for the opacity-grid calculation:               */
+  tr->opathreads = th->opathreads;
 
   /* Set interpolation function flag:                                       */
   switch(tr->fl & TRU_SAMPBITS){
@@ -80,8 +80,16 @@ import reader as rd
      Generate an inverted PT profile.
   PT_NoInversion:
      Generate a non-inverted PT profile.
+  E2:
+     Fast tabulated E2 exponential integral (E2_deviation checks it).
+  PT_line_batch, PT_Inversion_batch, PT_NoInversion_batch:
+     Generate a set of PT profiles at once (one per row of parameters).
   PT_generator:
      Wrapper that calls either inverted or non-inverted generator.
+  PT_batch:
+     Vectorized PT_generator wrapper.
+  InversionPlan:
+     Inverted PT profile planned once for a fixed pressure grid.
   plot_PT:
      Plot the PT profile.
 
@@ -630,7 +638,7 @@ def PT_NoInversion(p, a1, a2, p1, p3, T3, verb=False):
      return PT_NoInver, T_smooth
 
 
-def PT_line(pressure, params, R_star, T_star, T_int, sma, grav):
+def PT_line(pressure, params, R_star, T_star, T_int, sma, grav, fast=False):
   '''
   Generats a PT profile based on input free parameters and pressure array.
   If no inputs are provided, it will run in demo mode, using free
@@ -659,6 +667,8 @@ def PT_line(pressure, params, R_star, T_star, T_int, sma, grav):
      Semi-major axis (in meters).
   grav:   Float
      Planetary surface gravity (at 1 bar) in cm/second^2.
+  fast:   Bool
+     If True, use the tabulated E2 exponential integral (see E2).
 
   Returns
   -------
@@ -725,8 +735,8 @@ def PT_line(pressure, params, R_star, T_star, T_int, sma, grav):
   # Gray IR optical depth:
   tau = kappa * (pressure*1e6) / grav # Convert bars to barye (CGS)
 
-  xi1 = xi(gamma1, tau)
-  xi2 = xi(gamma2, tau)
+  xi1 = xi(gamma1, tau, fast)
+  xi2 = xi(gamma2, tau, fast)
 
   # Temperature profile (Eq. 13 of Line et al. 2013):
   temperature = (0.75 * (T_int**4 * (2.0/3.0 + tau) +
@@ -736,7 +746,106 @@ def PT_line(pressure, params, R_star, T_star, T_int, sma, grav):
   return temperature
 
 
-def xi(gamma, tau):
+# Tabulated E2 exponential integral (see E2):
+E2_XMIN    = 1e-8    # Lower limit of the table (series expansion below)
+E2_XMAX    = 700.0   # Upper limit of the table (asymptotic expansion above)
+E2_NPOINTS = 100000  # Number of table samples
+_E2table   = None
+
+
+def E2_table(npoints=E2_NPOINTS):
+  """
+  Tabulate exp(x)*E2(x) on a uniform log(x) grid between E2_XMIN and
+  E2_XMAX.  The table is computed once (at the first call) and cached.
+
+  Returns:
+  --------
+  logx: 1D float ndarray
+     Natural log of the sampled x values.
+  h: 1D float ndarray
+     exp(x)*E2(x) at the sampled values.
+  """
+  global _E2table
+  if _E2table is None or len(_E2table[0]) != npoints:
+    logx = np.linspace(np.log(E2_XMIN), np.log(E2_XMAX), npoints)
+    x = np.exp(logx)
+    _E2table = logx, np.exp(x) * sp.expn(2, x)
+  return _E2table
+
+
+def E2(x):
+  """
+  Fast second-order exponential integral, equivalent to
+  scipy.special.expn(2, x) for x >= 0.
+
+  Linearly interpolate the E2_table of exp(x)*E2(x) (relative error
+  below 1e-8).  Use the series expansion below E2_XMIN and the
+  asymptotic expansion above E2_XMAX (relative errors below 1e-9).
+
+  Parameters:
+  -----------
+  x: Float or float ndarray
+     Argument of E2.
+
+  Returns:
+  --------
+  e2: Float or float ndarray
+     E2(x).
+  """
+  logx, h = E2_table()
+  x  = np.asarray(x, np.double)
+  xc = np.clip(x, E2_XMIN, E2_XMAX)
+
+  # Interpolate the table (uniform grid):
+  du = logx[1] - logx[0]
+  u  = (np.log(xc) - logx[0]) / du
+  i  = np.clip(u.astype(int), 0, len(logx)-2)
+  u -= i
+  e2 = (h[i] + u*(h[i+1] - h[i])) * np.exp(-x)
+
+  # Series expansion for small arguments (Euler-Mascheroni constant):
+  small = x < E2_XMIN
+  if np.any(small):
+    xs = np.maximum(x, 1e-300)
+    e2 = np.where(small, 1.0 + xs*(np.log(xs) + 0.5772156649015329 - 1.0), e2)
+  # Asymptotic expansion for large arguments:
+  large = x > E2_XMAX
+  if np.any(large):
+    xl = np.maximum(x, E2_XMAX)
+    e2 = np.where(large, np.exp(-xl)/xl * (1 - 2/xl + 6/xl**2 - 24/xl**3), e2)
+  return e2
+
+
+def E2_deviation(xmin=1e-10, xmax=750.0, npoints=100000):
+  """
+  Maximum relative deviation of E2 from scipy.special.expn(2, x) over a
+  log-spaced sample of x values.
+
+  Parameters:
+  -----------
+  xmin: Float
+     Lowest sampled argument.
+  xmax: Float
+     Highest sampled argument.
+  npoints: Integer
+     Number of samples.
+
+  Returns:
+  --------
+  maxdev: Float
+     Maximum of |E2(x)/expn(2,x) - 1| (where expn(2,x) is non-zero).
+  xdev: Float
+     Argument of the maximum deviation.
+  """
+  x = np.logspace(np.log10(xmin), np.log10(xmax), npoints)
+  exact = sp.expn(2, x)
+  good  = exact > 0
+  dev   = np.abs(E2(x[good])/exact[good] - 1.0)
+  imax  = np.argmax(dev)
+  return dev[imax], x[good][imax]
+
+
+def xi(gamma, tau, fast=False):
   """
   Calculate Equation (14) of Line et al. (2013) Apj 775, 137
 
@@ -746,13 +855,303 @@ def xi(gamma, tau):
      Visible-to-thermal stream Planck mean opacity ratio.
   tau: 1D float ndarray
      Gray IR optical depth.
+  fast: Bool
+     If True, use the tabulated E2 instead of scipy.special.expn.
 
   Modification History:
   ---------------------
   2014-12-10  patricio  Initial implemetation.
   """
+  if fast:
+    e2 = E2(gamma*tau)
+  else:
+    e2 = sp.expn(2, gamma*tau)
   return (2.0/3) * (1 + (1/gamma) * (1 + (0.5*gamma*tau-1)*np.exp(-gamma*tau)) +
-                    gamma*(1 - 0.5*tau**2) * sp.expn(2, gamma*tau)             )
+                    gamma*(1 - 0.5*tau**2) * e2                                 )
+
+
+def PT_line_batch(pressure, params, R_star, T_star, T_int, sma, grav,
+                  fast=False):
+  """
+  Vectorized PT_line: evaluate the Line et al. (2013) profile for a set
+  of parameters at once.
+
+  Parameters:
+  -----------
+  pressure: 1D float ndarray
+     Array of pressure values in bars.
+  params: 2D float ndarray
+     Free parameters (see PT_line) of shape (nsamples, 5).
+  R_star: Float
+     Stellar radius (in meters).
+  T_star: Float
+     Stellar effective temperature (in Kelvin degrees).
+  T_int:  Float
+     Planetary internal heat flux (in Kelvin degrees).
+  sma:    Float
+     Semi-major axis (in meters).
+  grav:   Float
+     Planetary surface gravity (at 1 bar) in cm/second^2.
+  fast:   Bool
+     If True, use the tabulated E2 exponential integral (see E2).
+
+  Returns:
+  --------
+  temperature: 2D float ndarray
+     Temperature profiles of shape (nsamples, nlayers).
+  good: 1D bool ndarray
+     Flags of the physical (finite-temperature) profiles.
+  """
+  params = np.atleast_2d(params)
+  # Unpack free parameters (as column vectors):
+  kappa  = 10**(params[:,0:1])
+  gamma1 = 10**(params[:,1:2])
+  gamma2 = 10**(params[:,2:3])
+  alpha, beta = params[:,3:4], params[:,4:5]
+
+  # Stellar input temperature (at top of atmosphere):
+  T_irr = beta * (R_star / (2.0*sma))**0.5 * T_star
+
+  # Gray IR optical depth:
+  tau = kappa * (pressure*1e6) / grav # Convert bars to barye (CGS)
+
+  xi1 = xi(gamma1, tau, fast)
+  xi2 = xi(gamma2, tau, fast)
+
+  # Temperature profile (Eq. 13 of Line et al. 2013):
+  temperature = (0.75 * (T_int**4 * (2.0/3.0 + tau) +
+                         T_irr**4 * (1-alpha) * xi1 +
+                         T_irr**4 * alpha     * xi2 ) )**0.25
+
+  good = np.all(np.isfinite(temperature), axis=1)
+  return temperature, good
+
+
+def PT_Inversion_batch(p, params):
+  """
+  Vectorized Madhusudhan & Seager (2009) inversion profile (see
+  PT_Inversion) for a set of parameters at once.
+
+  Parameters:
+  -----------
+  p: 1D float ndarray
+     Pressure array (in bars), equally spaced in log space, and sorted
+     from the top (low pressure) to the bottom of the atmosphere.
+  params: 2D float ndarray
+     Free parameters (a1, a2, p1, p2, p3, T3) of shape (nsamples, 6).
+
+  Returns:
+  --------
+  T_smooth: 2D float ndarray
+     Smoothed temperature profiles of shape (nsamples, nlayers).
+  good: 1D bool ndarray
+     Flags of the physical profiles: non-negative temperatures at the
+     layer boundaries, and layer boundaries that split the pressure
+     array into contiguous segments (where PT_Inversion returns nlayers
+     temperatures).
+  """
+  params = np.atleast_2d(params)
+  a1, a2, p1, p2, p3, T3 = [params[:,i:i+1] for i in np.arange(6)]
+
+  # Top of the atmosphere:
+  p0 = np.amin(p)
+
+  # Temperatures at the layer boundaries:
+  T2 = T3 - (np.log(p3/p2) / a2)**2
+  T0 = T2 + (np.log(p1/p2) / -a2)**2 - (np.log(p1/p0) / a1)**2
+  T1 = T0 + (np.log(p1/p0) / a1)**2
+
+  # Number of levels of the layer segments:
+  nlevels = (np.sum(p < p1, axis=1) + np.sum((p >= p1) & (p < p2), axis=1) +
+             np.sum((p >= p2) & (p < p3), axis=1) + np.sum(p >= p3, axis=1))
+  good = ((nlevels == len(p)) &
+          np.all(np.hstack((T0, T1, T2, T3)) >= 0, axis=1))
+
+  # Layer 1, layer 2 (both parts share the same expression), and layer 3:
+  T_conc = np.where(p < p1, (np.log(p/p0) / a1)**2 + T0,
+           np.where(p < p3, (np.log(p/p2) / a2)**2 + T2, T3))
+
+  # Smoothing with Gaussian_filter1d:
+  sigma = 4
+  T_smooth = gaussian_filter1d(T_conc, sigma, axis=1, mode='nearest')
+  return T_smooth, good
+
+
+def PT_NoInversion_batch(p, params):
+  """
+  Vectorized Madhusudhan & Seager (2009) non-inversion profile (see
+  PT_NoInversion) for a set of parameters at once.
+
+  Parameters:
+  -----------
+  p: 1D float ndarray
+     Pressure array (in bars), equally spaced in log space, and sorted
+     from the top (low pressure) to the bottom of the atmosphere.
+  params: 2D float ndarray
+     Free parameters (a1, a2, p1, p3, T3) of shape (nsamples, 5).
+
+  Returns:
+  --------
+  T_smooth: 2D float ndarray
+     Smoothed temperature profiles of shape (nsamples, nlayers).
+  good: 1D bool ndarray
+     Flags of the physical profiles (see PT_Inversion_batch).
+  """
+  params = np.atleast_2d(params)
+  a1, a2, p1, p3, T3 = [params[:,i:i+1] for i in np.arange(5)]
+
+  # Top of the atmosphere:
+  p0 = np.amin(p)
+
+  # Temperatures at the layer boundaries:
+  T1 = T3 - (np.log(p3/p1) / a2)**2.0
+  T0 = T1 - (np.log(p1/p0) / a1)**2.0
+
+  # Number of levels of the layer segments:
+  nlevels = (np.sum(p < p1, axis=1) + np.sum((p >= p1) & (p < p3), axis=1) +
+             np.sum(p >= p3, axis=1))
+  good = ((nlevels == len(p)) &
+          np.all(np.hstack((T0, T1, T3)) >= 0, axis=1))
+
+  T_conc = np.where(p < p1, (np.log(p/p0) / a1)**2 + T0,
+           np.where(p < p3, (np.log(p/p1) / a2)**2 + T1, T3))
+
+  # Smoothing with Gaussian_filter1d:
+  sigma = 4
+  T_smooth = gaussian_filter1d(T_conc, sigma, axis=1, mode='nearest')
+  return T_smooth, good
+
+
+def PT_batch(p, params, args):
+  """
+  Vectorized PT_generator: temperature profiles for a set of parameters.
+
+  Parameters:
+  -----------
+  p: 1D float ndarray
+     Atmospheric pressure profile (in bar), from low to high pressure
+     for the 'madhu' profiles.
+  params: 2D float ndarray
+     PT parameters of shape (nsamples, nPT).
+  args: List
+     PT type ('line' or 'madhu') followed by the PT_line arguments.
+
+  Returns:
+  --------
+  temperature: 2D float ndarray
+     Temperature profiles of shape (nsamples, nlayers).
+  good: 1D bool ndarray
+     Flags of the physical profiles.
+  """
+  params = np.atleast_2d(params)
+  if   args[0] == "line":
+    return PT_line_batch(p, params, *args[1:])
+  elif args[0] == "madhu":
+    if np.shape(params)[1] == 5:
+      return PT_NoInversion_batch(p, params)
+    return PT_Inversion_batch(p, params)
+  raise ValueError("Unknown T profile type: '{:s}'".format(args[0]))
+
+
+class InversionPlan(object):
+  """
+  Madhusudhan & Seager (2009) inversion profile (see PT_Inversion),
+  planned once for a fixed pressure grid.
+
+  The log-pressures and the Gaussian smoothing operator are computed at
+  initialization.  Each call locates the layer boundaries with
+  searchsorted and fills preallocated temperature arrays, so the output
+  always has one temperature per pressure layer.
+
+  Example:
+  --------
+  >>> plan = InversionPlan(pressure)
+  >>> T_smooth = plan([a1, a2, p1, p2, p3, T3])
+  """
+  def __init__(self, p, sigma=4, truncate=4.0):
+    """
+    Parameters:
+    -----------
+    p: 1D float ndarray
+       Pressure array (in bars), equally spaced in log space.  It can be
+       sorted in either direction, the output follows the same order.
+    sigma: Float
+       Standard deviation of the Gaussian smoothing (in layers).
+    truncate: Float
+       Truncate the Gaussian kernel at this many standard deviations
+       (as in scipy's gaussian_filter1d).
+    """
+    p = np.asarray(p, np.double)
+    # Work from low to high pressure, flip the output if needed:
+    self.flip = p[0] > p[-1]
+    if self.flip:
+      p = p[::-1]
+    self.p       = np.copy(p)
+    self.nlayers = len(p)
+    self.logp    = np.log(self.p)
+    self.logp0   = self.logp[0]   # Top of the atmosphere
+
+    # Gaussian kernel (same weights as gaussian_filter1d):
+    radius = int(truncate*sigma + 0.5)
+    x = np.arange(-radius, radius+1)
+    kernel = np.exp(-0.5 * x**2 / sigma**2)
+    kernel /= np.sum(kernel)
+
+    # Smoothing operator with 'nearest' boundary mode:
+    ilayer = np.arange(self.nlayers)
+    index  = np.clip(ilayer[:,np.newaxis] + x, 0, self.nlayers-1)
+    self.smooth = np.zeros((self.nlayers, self.nlayers), np.double)
+    for k in np.arange(len(x)):
+      self.smooth[ilayer, index[:,k]] += kernel[k]
+
+    # Preallocated raw and smoothed temperature arrays:
+    self.T_conc   = np.zeros(self.nlayers, np.double)
+    self.T_smooth = np.zeros(self.nlayers, np.double)
+
+
+  def __call__(self, params):
+    """
+    Compute the smoothed temperature profile.  Raise ValueError for
+    unordered layer pressures (as PT_Inversion, the profile requires
+    p1 <= p2 <= p3) or negative temperatures.
+
+    Parameters:
+    -----------
+    params: 1D float ndarray
+       Free parameters (a1, a2, p1, p2, p3, T3), see PT_Inversion.
+
+    Returns:
+    --------
+    T_smooth: 1D float ndarray
+       Smoothed temperature profile.  This array is overwritten by the
+       next call, copy it to keep it.
+    """
+    a1, a2, p1, p2, p3, T3 = params
+    if not p1 <= p2 <= p3:
+      raise ValueError('Input parameters give non-physical profile.')
+    logp1, logp2, logp3 = np.log([p1, p2, p3])
+
+    # Temperatures at the layer boundaries:
+    T2 = T3 - ((logp3-logp2) / a2)**2
+    T0 = T2 + ((logp1-logp2) / a2)**2 - ((logp1-self.logp0) / a1)**2
+    T1 = T0 + ((logp1-self.logp0) / a1)**2
+    if T0<0 or T1<0 or T2<0 or T3<0:
+      raise ValueError('Input parameters give non-physical profile.')
+
+    # Layer boundaries (first layer at or below p1 and p3):
+    i1, i3 = np.searchsorted(self.p, [p1, p3])
+
+    # Layer 1, layer 2 (both parts share the same expression), and layer 3:
+    T = self.T_conc
+    T[  :i1] = ((self.logp[:i1]   - self.logp0) / a1)**2 + T0
+    T[i1:i3] = ((self.logp[i1:i3] - logp2)      / a2)**2 + T2
+    T[i3:  ] = T3
+
+    # Smoothing:
+    np.dot(self.smooth, T, out=self.T_smooth)
+    if self.flip:
+      return self.T_smooth[::-1]
+    return self.T_smooth
 
 
 def PT_generator(p, free_params, args):
@@ -770,6 +1169,8 @@ def PT_generator(p, free_params, args):
   args: List
      Boolean that determines inversion (True) or non-inversion (False)
      temperature profile case.
+     For 'madhu' profiles, args[1] can be an InversionPlan of p, which
+     replaces the PT_Inversion call.
 
   Returns
   -------
@@ -792,7 +1193,10 @@ def PT_generator(p, free_params, args):
     #  PT, Temp = PT_NoInversion(p, *free_params)
     #elif len(free_params) == 6: # With inversion layer
     # Jasmina commented above
-    Temp = PT_Inversion(p, free_params)
+    if len(args) > 1:  # Precomputed InversionPlan
+      Temp = args[1](free_params)
+    else:
+      Temp = PT_Inversion(p, free_params)
   else:
     print("Unknown T profile type: '{:s}'".format(args[0]))
     # FINDME: throw error and stop.
@@ -60,6 +60,8 @@
     ---------
     read_MCMC_out:
           Read the MCMC output log file. Extract the best fitting parameters.
+    read_burnin:
+          Read the MCMC output log file. Extract the burned-in iterations.
     get_params:
 	      Get correct number of all parameters from stepsize
     get_starData:
@@ -126,6 +128,21 @@ def read_MCMC_out(MCfile):
     return bestP, uncer, SN, mean
 
 
+def read_burnin(MCfile):
+    """
+    Read the MCMC output log file. Extract the number of burned-in
+    iterations per chain (set by MC3, possibly estimated automatically).
+    """
+    f = open(MCfile, 'r')
+    lines = f.readlines()
+    f.close()
+
+    for line in lines:
+        if line.startswith(' Burned in iterations'):
+            return int(line.split()[-1])
+    return None
+
+
 def get_params(bestP, stepsize, params):
     """
     Get correct number of all parameters from stepsize
@@ -183,44 +200,24 @@ def write_atmfile(atmfile, molfit, rad, T_line, allParams, date_dir):
     date_dir: String
       Directory where to store the best-fit atmospheric file.
     """
-    # Open atmfile to read
+    # Read the atmospheric data (binary companion file, if available):
+    molecules, pressure, temp, abundances = mat.readatm(atmfile)
+    ndata = len(pressure)
+    # Abundances array of shape (nspecies, nlayers):
+    abundances = np.array(abundances.T)
+
+    # Read the header lines (up to the column names):
+    lines = []
     f = open(atmfile, 'r')
-    lines = np.asarray(f.readlines())
+    line = f.readline()
+    while line != "":
+        lines.append(line)
+        if line == "#TEADATA\n":
+            lines.append(f.readline())
+            break
+        line = f.readline()
     f.close()
-
-    # Get the molecules
-    imol = np.where(lines == "#SPECIES\n")[0][0] + 1
-    molecules = lines[imol].split()
-
-    # Find the line where the layers info begins
-    start = np.where(lines == "#TEADATA\n")[0][0] + 2 
-    headers = lines[start-1].split()
-    datalines = lines[start:]
-
-    # Number of columns
-    ncol = len(lines[start].split())
-
-    # Number of layers
-    ndata = len(datalines)  
-
-    # Allocate space for pressure:
-    pressure = np.zeros(ndata, np.double) 
-
-    # Number of abundances (elements per line except Radius, Press and T) 
-    nabun = len(lines[start].split()) - 3  
-
-    data = np.zeros((ndata, len(headers)))
-    for i in np.arange(ndata):
-        data[i] = datalines[i].split()
-
-    # Extract pressure data -- large to small:
-    pressure = data[:,1]
-
-    # Fill out the abundances array:
-    abundances = np.zeros((len(molecules), ndata))
-    for i in np.arange(len(molecules)):
-        for j in np.arange(ndata):
-            abundances[i] = data[:, i+3]
+    start = len(lines)
 
     # recognize which columns to take from the atmospheric file
     headers = lines[start-1].split()
@@ -251,33 +248,17 @@ def write_atmfile(atmfile, molfit, rad, T_line, allParams, date_dir):
     q = np.sum(abundances, axis=0) - 1
 
     # Correct H2, and He abundances conserving their ratio:
-    for i in np.arange(ndata):
-    #    if q[i]>0:
-            abundances[iH2, i] -= ratio[i] * q[i] / (1.0 + ratio[i])
-            abundances[iHe, i] -=            q[i] / (1.0 + ratio[i])
+    abundances[iH2] -= ratio * q / (1.0 + ratio)
+    abundances[iHe] -=         q / (1.0 + ratio)
 
     # open best fit atmospheric file
     fout = open(date_dir + 'bestFit.atm', 'w')
     fout.writelines(lines[:start])
 
-    # Write atm file for each run
-    for i in np.arange(ndata): 
-        # Radius, pressure, and temp for the current line
-        radi = str('%10.3f'%rad[i])
-        presi = str('%10.4e'%pressure[i])
-        tempi = str('%7.2f'%T_line[i])
-
-        # Insert radii array
-        fout.write(radi.ljust(10) + ' ')
-
-        # Insert results from the current line (T-P) to atm file
-        fout.write(presi.ljust(10) + ' ')
-        fout.write(tempi.ljust(7) + ' ')
-
-        # Write current abundances
-        for j in np.arange(len(headers) - 3):
-            fout.write('%1.4e'%abundances[j][i] + ' ')
-        fout.write('\n')
+    # Write atm file (radius, pressure, temperature, and abundances):
+    data = np.column_stack((rad, pressure, T_line, abundances.T))
+    np.savetxt(fout, data,
+               fmt="%10.3f %10.4e %7.2f " + "%1.4e " * (len(headers) - 3))
 
     # Close atm file
     fout.close()
@@ -449,57 +430,32 @@ def callTransit(atmfile, tepfile, MCfile, stepsize, molfit, solution,
     for c in np.arange(1, nchains):
         data_stack = np.hstack((data_stack, data[c, :, burnin:]))
 
-    # create array of PT profiles
-    PTprofiles = np.zeros((np.shape(data_stack)[1], len(pressure)))
-
-    # current PT parameters for each chain, iteration
-    curr_PTparams = PTparams
+    # PT parameters for each chain, iteration (one sample per row):
+    PTsamples = np.tile(PTparams, (np.shape(data_stack)[1], 1))
+    ifree = np.where(stepsize[0:len(PTparams)] != 0.0)[0]
+    PTsamples[:,ifree] = data_stack[0:len(ifree)].T
 
     # fill-in PT profiles array
     print("  Plotting MCMC PT profile figure.")
+    ###### ONLY FOR LINE Jasmina
+    #PTprofiles, good = pt.PT_line_batch(pressure, PTsamples, R_star, T_star,
+    #                                    T_int, sma, grav*1e2, fast=True)
 
-    # open list for skipped profiles
-    skipped = []
-    for k in np.arange(0, np.shape(data_stack)[1]):
-        j = 0
-        for i in np.arange(len(PTparams)):
-            if stepsize[i] != 0.0:
-                curr_PTparams[i] = data_stack[j,k]
-                j +=1
-            else:
-                pass
-        ###### ONLY FOR LINE Jasmina
-        #PTprofiles[k] = pt.PT_line(pressure, curr_PTparams, R_star, T_star,
-        #                           T_int, sma, grav*1e2)
-
-        ###### Jasmina ONLY FOR MADHU, pressure must be decreasing so PT_inversion works!!!!!
-        # othervise all the P-T profiles will be wrong and the code will not break!!!!
-        if pressure[0]>pressure[1]:
-            # write into a temporary variable so you can catch skipped onse with
-            # more layers than 100
-            # must use increasing order to properly calculate PT inversion Jasmina Madhu -- small to large
-            temp = pt.PT_Inversion(pressure[::-1], curr_PTparams)
-            if len(temp) !=100:
-                skipped = np.append(skipped, k)
-                pass
-            else:
-                PTprofiles[k] = temp
-                # must return to the decreasing order (large to small) so it can calculate fill_betweenx
-                PTprofiles[k] = PTprofiles[k][::-1]
-        else:
-            # write into a temporary variable so you can catch skipped ones with
-            # more layers than 100
-            # already the array in in increasing order to properly calculate PT inversion Jasmina Madhu -- small to large
-            temp = pt.PT_Inversion(pressure, curr_PTparams)
-            if len(temp) !=100:
-                skipped = np.append(skipped, k)
-                pass
-            else:
-                PTprofiles[k] = temp
-                # must return to the decreasing order (large to small) so it can calculate fill_betweenx
-                PTprofiles[k] = PTprofiles[k][::-1]
+    ###### Jasmina ONLY FOR MADHU, pressure must be increasing so PT_inversion works!!!!!
+    # othervise all the P-T profiles will be wrong and the code will not break!!!!
+    if pressure[0]>pressure[1]:
+        # must use increasing order to properly calculate PT inversion Jasmina Madhu -- small to large
+        PTprofiles, good = pt.PT_Inversion_batch(pressure[::-1], PTsamples)
+    else:
+        # already the array in in increasing order to properly calculate PT inversion Jasmina Madhu -- small to large
+        PTprofiles, good = pt.PT_Inversion_batch(pressure, PTsamples)
+    # must return to the decreasing order (large to small) so it can calculate fill_betweenx
+    PTprofiles = PTprofiles[:,::-1]
 
+    # skipped (non-physical) profiles are left out of the percentiles:
+    skipped = np.where(~good)[0]
     print 'Skipped profiles are: ', skipped
+    PTprofiles = PTprofiles[good]
 
     # get percentiles (for 1,2-sigma boundaries):
     low1 = np.percentile(PTprofiles, 16.0, axis=0)
@@ -0,0 +1,551 @@
+#! /usr/bin/env python
+
+# ****************************** START LICENSE *******************************
+# Bayesian Atmospheric Radiative Transfer (BART), a code to infer
+# properties of planetary atmospheres based on observed spectroscopic
+# information.
+# 
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington. Principal developers included graduate students
+# Patricio E. Cubillos and Jasmina Blecic, programmer Madison Stemm, and
+# undergraduates M. Oliver Bowman and Andrew S. D. Foster.  The included
+# 'transit' radiative transfer code is based on an earlier program of
+# the same name written by Patricio Rojo (Univ. de Chile, Santiago) when
+# he was a graduate student at Cornell University under Joseph
+# Harrington.  Statistical advice came from Thomas J. Loredo and Nate
+# B. Lust.
+# 
+# Copyright (C) 2015 University of Central Florida.  All rights reserved.
+# 
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+# 
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+# 
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+# 
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# Jasmina Blecic <jasmina@physics.ucf.edu>
+# 
+# or alternatively,
+# 
+# Joseph Harrington, Patricio Cubillos, and Jasmina Blecic
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+# 
+# Thank you for testing BART!
+# ******************************* END LICENSE *******************************
+
+"""
+    Campaign runner: run many BART retrievals (planets, PT
+    parametrizations, data sets) from a manifest, without user
+    interaction.  Runs that share an atmosphere (same TEA inputs) or an
+    opacity grid compute it once, and the MCMC runs are queued onto a
+    fixed pool of processor slots.
+
+    The manifest is a configuration file with an optional [campaign]
+    section and one section per run:
+
+      [campaign]
+      slots         = 24                 # Processor (MPI) slots in the pool
+      opacity_store = ./opacity_store    # Shared opacity-grid store
+      summary       = campaign_summary.txt
+      timeout       = 48                 # Default wall-time limit (hours)
+      memory        = 16                 # Default memory limit (GB)
+
+      [WASP12b_line]
+      config  = WASP12b/BART_line.cfg    # BART configuration file
+      slots   = 11                       # Default: nchains + 1
+      timeout = 12
+
+    Each run executes in the folder of its configuration file.  The runs
+    go through three phases, each one scheduled on the pool:
+    atmospheres (one run per distinct atmosphere), opacity grids (one run
+    per distinct grid), and the full retrievals (the runs sharing an
+    atmosphere take it from the run that made it, and the opacity grids
+    come from the store).
+
+    Functions
+    ---------
+    readmanifest:
+          Read the runs of a campaign manifest.
+    planjob:
+          Get the pipeline-stage keys of a run.
+    runpool:
+          Run a list of tasks on a fixed pool of slots.
+    readlog:
+          Read the fit statistics of an MC3 log file.
+    summary:
+          Write the campaign summary table.
+    main:
+          Run a campaign.
+
+    Usage
+    -----
+    campaign.py manifest_file [--dry-run]
+"""
+
+import sys, os, time, signal, subprocess, tempfile, json
+import argparse, ConfigParser
+
+BARTdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(BARTdir + "/../modules/MCcubed/src/")
+import mcutils as mu
+
+BARTcall = os.path.realpath(BARTdir + "/../BART.py")
+
+# Pipeline stages that make the atmospheric file:
+ATMSTAGES = ["TEA", "atmosphere"]
+# Status of the runs that did not complete:
+FAILED = ["failed", "timeout", "memory", "skipped"]
+
+
+class Job(object):
+  """
+  A run of the campaign.
+  """
+  def __init__(self, name, config, slots, timeout, memory):
+    """
+    Parameters:
+    -----------
+    name: String
+       Run name (manifest section).
+    config: String
+       BART configuration file.
+    slots: Integer
+       Processor slots taken by the MCMC.
+    timeout: Float
+       Wall-time limit of each phase in hours (None for no limit).
+    memory: Float
+       Memory limit in GB of all the processes of each phase (None for
+       no limit).
+    """
+    self.name    = name
+    self.config  = config
+    self.cwd     = os.path.dirname(config)
+    self.slots   = slots
+    self.timeout = timeout
+    self.memory  = memory
+    self.plan    = None    # Stage keys and output files (see planjob)
+    self.atmfrom = None    # Run that makes the atmosphere of this run
+    self.opafrom = None    # Run that makes the opacity grid of this run
+    self.status  = "queued"
+    self.walltime = 0.0
+
+
+class Task(object):
+  """
+  One BART call of a run (a campaign phase).
+  """
+  def __init__(self, job, phase, args, slots):
+    self.job   = job
+    self.phase = phase
+    self.args  = args
+    self.slots = slots
+    self.proc  = None
+    self.start = None
+    self.returncode = None
+
+
+def readmanifest(manifest):
+  """
+  Read the runs of a campaign manifest.
+
+  Parameters:
+  -----------
+  manifest: String
+     Campaign manifest file.
+
+  Returns:
+  --------
+  campaign: Dictionary
+     The [campaign] section options.
+  jobs: List of Job
+     The runs, in manifest order.
+  """
+  config = ConfigParser.SafeConfigParser()
+  config.optionxform = str
+  config.read([manifest])
+  mandir = os.path.dirname(os.path.realpath(manifest))
+
+  campaign = {"slots":"1", "opacity_store":"./opacity_store",
+              "summary":"campaign_summary.txt", "timeout":"", "memory":""}
+  if config.has_section("campaign"):
+    campaign.update(config.items("campaign"))
+  for key in ["opacity_store", "summary"]:
+    campaign[key] = os.path.realpath(os.path.join(mandir, campaign[key]))
+  campaign["slots"] = int(campaign["slots"])
+
+  jobs = []
+  for name in config.sections():
+    if name == "campaign":
+      continue
+    if not config.has_option(name, "config"):
+      mu.error("Run '{:s}' of the manifest has no 'config' file.".
+               format(name))
+    options = dict(campaign)
+    options.update(config.items(name))
+    cfile = os.path.realpath(os.path.join(mandir, options["config"]))
+    if not os.path.isfile(cfile):
+      mu.error("Configuration file of run '{:s}' ('{:s}') not found.".
+               format(name, cfile))
+
+    # The MCMC takes one slot per chain plus the master:
+    if config.has_option(name, "slots"):
+      slots = int(options["slots"])
+    else:
+      bart = ConfigParser.SafeConfigParser()
+      bart.read([cfile])
+      nchains = 10
+      if bart.has_option("MCMC", "nchains"):
+        nchains = bart.getint("MCMC", "nchains")
+      slots = nchains + 1
+
+    timeout = memory = None
+    if options["timeout"] != "":
+      timeout = float(options["timeout"])
+    if options["memory"] != "":
+      memory = float(options["memory"])
+    jobs.append(Job(name, cfile, slots, timeout, memory))
+
+  return campaign, jobs
+
+
+def planjob(job):
+  """
+  Get the pipeline-stage keys of a run (from a BART dry run).
+
+  Parameters:
+  -----------
+  job: Job
+     A campaign run.  Sets its plan attribute (None if the dry run
+     failed).
+  """
+  fd, planfile = tempfile.mkstemp(suffix=".json")
+  os.close(fd)
+  devnull = open(os.devnull, "w")
+  returncode = subprocess.call([sys.executable, BARTcall, "-c", job.config,
+                                "--dry-run", "--plan", planfile],
+                               cwd=job.cwd, stdout=devnull, stderr=devnull)
+  devnull.close()
+  if returncode == 0 and os.path.getsize(planfile) > 0:
+    f = open(planfile, "r")
+    job.plan = json.load(f)
+    f.close()
+  os.remove(planfile)
+
+
+def _groupmemory(pgid):
+  """
+  Memory used by the processes of a process group, in bytes (Linux
+  /proc).  Each process counts its proportional set size, so the pages
+  shared among the MPI processes (e.g., the opacity grid) count once.
+  Without smaps_rollup, count the resident set size instead.
+  """
+  total = 0
+  if not os.path.isdir("/proc"):
+    return total
+  pagesize = os.sysconf("SC_PAGE_SIZE")
+  for pid in os.listdir("/proc"):
+    if not pid.isdigit():
+      continue
+    try:
+      f = open("/proc/{:s}/stat".format(pid), "r")
+      stat = f.read()
+      f.close()
+      # Fields after the command name (state, ppid, pgrp, ...):
+      if int(stat[stat.rfind(")")+2:].split()[2]) != pgid:
+        continue
+      if os.path.isfile("/proc/{:s}/smaps_rollup".format(pid)):
+        f = open("/proc/{:s}/smaps_rollup".format(pid), "r")
+        for line in f:
+          if line.startswith("Pss:"):
+            total += int(line.split()[1]) * 1024
+        f.close()
+      else:
+        f = open("/proc/{:s}/statm".format(pid), "r")
+        total += int(f.read().split()[1]) * pagesize
+        f.close()
+    except (IOError, OSError, ValueError, IndexError):
+      # The process ended meanwhile:
+      continue
+  return total
+
+
+def _stop(proc, grace=30.0):
+  """
+  Stop the process group of a task: send SIGTERM, and SIGKILL if it is
+  still running after grace seconds.
+  """
+  try:
+    os.killpg(proc.pid, signal.SIGTERM)
+  except OSError:
+    pass
+  tend = time.time() + grace
+  while proc.poll() is None and time.time() < tend:
+    time.sleep(0.5)
+  # Also kill the remaining MPI processes of the group:
+  try:
+    os.killpg(proc.pid, signal.SIGKILL)
+  except OSError:
+    pass
+  proc.wait()
+
+
+def runpool(tasks, slots, poll=5.0):
+  """
+  Run a list of tasks on a fixed pool of slots.  Tasks start in list
+  order as slots become free (a smaller task may start ahead of a larger
+  one waiting for slots).  A task that takes more slots than the pool
+  runs alone.  Each task runs in its own process group, which is
+  stopped if it exceeds the time limit or if its total memory exceeds
+  the memory limit of the run.
+
+  Parameters:
+  -----------
+  tasks: List of Task
+     Tasks to run.  Sets their returncode attribute (-1 for a timeout,
+     -2 for exceeding the memory limit).
+  slots: Integer
+     Number of slots in the pool.
+  poll: Float
+     Seconds between checks of the running tasks.
+  """
+  queue   = list(tasks)
+  running = []
+  while len(queue) > 0 or len(running) > 0:
+    # Start the tasks that fit in the free slots:
+    free = slots - sum([min(task.slots, slots) for task in running])
+    for task in list(queue):
+      need = min(task.slots, slots)
+      if need > free:
+        continue
+      job = task.job
+      logfile = open(os.path.join(job.cwd,
+                     "campaign_{:s}_{:s}.log".format(job.name, task.phase)),
+                     "w")
+      # Own process group, so the limits also cover the MPI processes:
+      task.proc = subprocess.Popen([sys.executable, BARTcall, "-c",
+                                    job.config] + task.args, cwd=job.cwd,
+                                   stdout=logfile, stderr=subprocess.STDOUT,
+                                   preexec_fn=os.setsid)
+      logfile.close()
+      task.start = time.time()
+      mu.msg(1, "Started {:<10s} {:s} ({:d} slots).".format(task.phase,
+                job.name, need), indent=2)
+      free -= need
+      queue.remove(task)
+      running.append(task)
+
+    time.sleep(poll)
+
+    # Collect finished tasks and stop the ones beyond their time or
+    # memory limits:
+    for task in list(running):
+      job = task.job
+      elapsed = time.time() - task.start
+      if task.proc.poll() is not None:
+        task.returncode = task.proc.returncode
+      elif job.timeout is not None and elapsed > 3600.0*job.timeout:
+        _stop(task.proc)
+        task.returncode = -1
+      elif (job.memory is not None and
+            _groupmemory(task.proc.pid) > job.memory * 1024**3):
+        mu.warning("{:s} {:s} exceeded the memory limit ({:.1f} GB).".
+                   format(task.phase, job.name, job.memory))
+        _stop(task.proc)
+        task.returncode = -2
+      else:
+        continue
+      job.walltime += elapsed
+      running.remove(task)
+      mu.msg(1, "Finished {:<9s} {:s} (return code {:d}, {:.2f} h).".
+                format(task.phase, job.name, task.returncode,
+                       elapsed/3600.0), indent=2)
+
+
+def readlog(logfile):
+  """
+  Read the fit statistics of an MC3 log file.
+
+  Returns:
+  --------
+  stats: Dictionary
+     Best-fit chi-squared ('chisq'), Bayesian Information Criterion
+     ('BIC'), and reduced chi-squared ('redchisq'), if found.
+  """
+  labels = {"Best-parameter's chi-squared:":"chisq",
+            "Bayesian Information Criterion:":"BIC",
+            "Reduced chi-squared:":"redchisq"}
+  stats = {}
+  if logfile is None or not os.path.isfile(logfile):
+    return stats
+  f = open(logfile, "r")
+  for line in f:
+    for label in labels:
+      if line.strip().startswith(label):
+        stats[labels[label]] = float(line.split()[-1])
+  f.close()
+  return stats
+
+
+def summary(jobs, sumfile):
+  """
+  Write the campaign summary table (one line per run: status, wall
+  time, fit statistics, and the runs it took the atmosphere and the
+  opacity grid from).
+  """
+  header = ("# {:<22s} {:<9s} {:>8s} {:>12s} {:>12s} {:>9s}  {:<22s} "
+            "{:s}\n".format("run", "status", "time(h)", "chisq", "BIC",
+                               "redchisq", "atmosphere", "opacity"))
+  f = open(sumfile, "w")
+  f.write(header)
+  for job in jobs:
+    logfile = None
+    if job.plan is not None:
+      logfile = job.plan["files"]["logfile"]
+    stats = readlog(logfile)
+    values = []
+    for stat, fmt in [("chisq", "{:12.4f}"), ("BIC", "{:12.4f}"),
+                      ("redchisq", "{:9.4f}")]:
+      if stat in stats:
+        values.append(fmt.format(stats[stat]))
+      else:
+        values.append(fmt.replace(":", ":>").replace(".4f", "s").format("-"))
+    f.write("  {:<22s} {:<9s} {:8.2f} {:s} {:s} {:s}  {:<22s} {:s}\n".
+            format(job.name, job.status, job.walltime/3600.0, values[0],
+                   values[1], values[2], job.atmfrom or "-",
+                   job.opafrom or "-"))
+  f.close()
+  mu.msg(1, "\nCampaign summary ('{:s}'):".format(sumfile))
+  f = open(sumfile, "r")
+  mu.msg(1, f.read())
+  f.close()
+
+
+def main():
+  """
+  Run a campaign of BART retrievals.
+  """
+  parser = argparse.ArgumentParser(description=__doc__,
+                         formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("manifest", help="Campaign manifest file")
+  parser.add_argument("--dry-run", dest="dry_run", action="store_true",
+                      help="Print the shared stages of the runs, and exit.")
+  parser.add_argument("--poll", dest="poll", type=float, default=5.0,
+                      help="Seconds between checks of the running jobs "
+                           "[default: %(default)s]")
+  args = parser.parse_args()
+
+  if not os.path.isfile(args.manifest):
+    mu.error("Manifest file '{:s}' not found.".format(args.manifest))
+  campaign, jobs = readmanifest(args.manifest)
+  slots = campaign["slots"]
+  mu.msg(1, "Campaign of {:d} runs on {:d} slots.".format(len(jobs), slots))
+
+  # Get the stage keys of each run:
+  for job in jobs:
+    planjob(job)
+    if job.plan is None:
+      job.status = "failed"
+      mu.warning("Cannot plan the stages of run '{:s}' (see 'BART.py -c "
+                 "{:s} --dry-run').".format(job.name, job.config))
+  planned = [job for job in jobs if job.plan is not None]
+
+  # The output folders must be distinct:
+  dirs = [job.plan["files"]["date_dir"] for job in planned]
+  for job in planned:
+    if dirs.count(job.plan["files"]["date_dir"]) > 1:
+      mu.error("Run '{:s}' shares its output folder ('{:s}') with another "
+               "run.".format(job.name, job.plan["files"]["date_dir"]))
+
+  # Group the runs by atmosphere and by opacity grid (the first run of
+  # each group makes it):
+  atmleaders, opaleaders = {}, {}
+  for job in planned:
+    stages = job.plan["stages"]
+    atmkey = [stages[stage]["key"] for stage in ATMSTAGES
+              if stage in stages][0]
+    if atmkey in atmleaders:
+      job.atmfrom = atmleaders[atmkey].name
+    else:
+      atmleaders[atmkey] = job
+    if stages["opacity"]["status"] == "provided":
+      continue
+    opakey = stages["opacity"]["key"]
+    if opakey in opaleaders:
+      job.opafrom = opaleaders[opakey].name
+    else:
+      opaleaders[opakey] = job
+
+  mu.msg(1, "\n{:d} distinct atmospheres, {:d} distinct opacity grids:".
+            format(len(atmleaders), len(opaleaders)))
+  for job in planned:
+    mu.msg(1, "{:<22s} atmosphere from: {:<22s} opacity from: {:s}".
+              format(job.name, job.atmfrom or "(self)",
+                     job.opafrom or "(self)"), indent=2)
+  if args.dry_run:
+    return
+
+  byname = dict([(job.name, job) for job in planned])
+  common = ["--batch", "--opacity_store", campaign["opacity_store"]]
+  def jobargs(job):
+    # Take the atmosphere from the run that makes it:
+    if job.atmfrom is None:
+      return list(common)
+    return common + ["--atmfile", byname[job.atmfrom].plan["files"]["atmfile"]]
+
+  # Atmospheres, opacity grids, and retrievals:
+  phases = [("atmosphere", atmleaders.values(), ["--justTEA"], 1),
+            ("opacity",    opaleaders.values(), ["--justOpacity"], 1),
+            ("retrieval",  planned,             [], None)]
+  for phase, leaders, phaseargs, nslots in phases:
+    mu.msg(1, "\nCampaign phase: {:s}.".format(phase))
+    tasks = []
+    for job in sorted(leaders, key=planned.index):
+      # Skip runs whose atmosphere or grid could not be made:
+      if job.status in FAILED:
+        continue
+      if ((job.atmfrom is not None and
+           byname[job.atmfrom].status in FAILED) or
+          (phase == "retrieval" and job.opafrom is not None and
+           byname[job.opafrom].status in FAILED)):
+        job.status = "skipped"
+        continue
+      tasks.append(Task(job, phase, jobargs(job) + phaseargs,
+                        nslots or job.slots))
+    runpool(tasks, slots, args.poll)
+    for task in tasks:
+      if task.returncode == -1:
+        task.job.status = "timeout"
+      elif task.returncode == -2:
+        task.job.status = "memory"
+      elif task.returncode != 0:
+        task.job.status = "failed"
+      elif phase == "retrieval":
+        task.job.status = "done"
+
+  summary(jobs, campaign["summary"])
+
+
+if __name__ == "__main__":
+  main()
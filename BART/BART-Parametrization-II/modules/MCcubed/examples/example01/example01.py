@@ -69,7 +69,7 @@ grtest  = True
 burnin  = 100
 plots   = True
 savefile  = 'output_ex1.npy'
-savemodel = 'output_model.npy'
+savemodel = 'output_model.npz'
 
 # Run the MCMC:
 allp, bp = mc3.mcmc(data, uncert, func, indparams,
@@ -77,6 +77,11 @@ allp, bp = mc3.mcmc(data, uncert, func, indparams,
             numit=numit, nchains=nchains, walk=walk, grtest=grtest,
             burnin=burnin, plots=plots, savefile=savefile, savemodel=savemodel)
 
+# The evaluated models are saved as a compact store, the module
+# modelstore reconstructs the (nchains, ndata, niter) array of models:
+import modelstore as ms
+models = ms.load(savemodel).cube()
+
 
 # Evaluate and plot:
 y0 = quad(params, x)  # Initial guess values
@@ -115,6 +120,21 @@ allp, bp = mc3.mcmc(data, uncert, func, indparams,
             burnin=burnin, plots=plots, savefile=savefile, mpi=mpi)
 
 
+# ::::: Delayed-acceptance MCMC :::::::::::::::::::::::::::::::::::::
+# For expensive models, a cheap surrogate model can screen the proposals
+# first, so that func is evaluated only for the proposals that pass.
+# The surrogate takes the same arguments as func.  Alternatively, set
+# surrogate=['emulator'] to let MC3 train a quadratic emulator from the
+# models evaluated during the burn-in:
+surrogate = ['emulator']
+allp, bp = mc3.mcmc(data, uncert, func, indparams,
+            params, pmin, pmax, stepsize,
+            numit=numit, nchains=nchains, walk=walk, grtest=grtest,
+            burnin=burnin, plots=plots, savefile=savefile, mpi=mpi,
+            surrogate=surrogate)
+# The MCMC summary reports the fraction of full-model evaluations avoided.
+
+
 # ::::::: Arguments as files ::::::::::::::::::::::::::::::::::::::::
 # As said in the help description, the data, uncert, indparams, params, 
 # pmin, pmax, stepsize, prior, priorlow, and priorup arrays can be
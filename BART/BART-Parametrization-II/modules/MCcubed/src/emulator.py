@@ -0,0 +1,163 @@
+# ******************************* START LICENSE *****************************
+# 
+# Multi-Core Markov-chain Monte Carlo (MC3), a code to estimate
+# model-parameter best-fitting values and Bayesian posterior
+# distributions.
+# 
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington.  Principal developers included graduate student
+# Patricio E. Cubillos and programmer Madison Stemm.  Statistical advice
+# came from Thomas J. Loredo and Nate B. Lust.
+# 
+# Copyright (C) 2014 University of Central Florida.  All rights reserved.
+# 
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+# 
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+# 
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+# 
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# 
+# or alternatively,
+# 
+# Joseph Harrington and Patricio Cubillos
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+# 
+# Thank you for using MC3!
+
+import numpy as np
+
+
+class Emulator:
+  """
+  Quadratic-polynomial emulator of a model function.  The emulator is
+  trained through linear least squares over the (params, model) pairs
+  evaluated during the MCMC, and it is intended as a cheap surrogate
+  model for the first stage of the delayed-acceptance MCMC.
+
+  Parameters:
+  -----------
+  pcenter: 1D ndarray
+     Reference values of the free parameters (center of the expansion).
+  pscale: 1D ndarray
+     Scale of the free parameters (used to normalize the expansion).
+  ifree: 1D integer ndarray
+     Indices of the free parameters in the params array.
+  ridge: Float
+     Relative ridge-regularization factor for the least-squares fit.
+
+  Examples:
+  ---------
+  >>> import numpy as np
+  >>> import emulator as em
+  >>> x = np.linspace(0, 10, 100)
+  >>> emul = em.Emulator(np.array([0.0, 0.0]), np.array([1.0, 1.0]), [0, 1])
+  >>> p = np.random.normal(0, 1, (50, 2))
+  >>> emul.update(p, p[:,0:1] + p[:,1:2]*x)
+  >>> emul.fit()
+  True
+  >>> model = emul(np.array([1.0, 2.0]))
+  """
+  def __init__(self, pcenter, pscale, ifree, ridge=1e-8):
+    self.pcenter = np.asarray(pcenter, np.double)
+    self.pscale  = np.asarray(pscale,  np.double)
+    self.ifree   = np.asarray(ifree)
+    self.ridge   = ridge
+    # Indices of the quadratic cross terms:
+    self.iquad   = np.triu_indices(len(self.ifree))
+    # Number of terms: constant + linear + quadratic:
+    self.nterms  = 1 + len(self.ifree) + len(self.iquad[0])
+    # Normal-equation accumulators:
+    self.XtX     = np.zeros((self.nterms, self.nterms))
+    self.XtY     = None
+    self.ntrain  = 0     # Number of training samples
+    self.coeffs  = None  # Fitted coefficients
+
+
+  def features(self, params):
+    """
+    Compute the design matrix of the quadratic expansion.
+
+    Parameters:
+    -----------
+    params: 1D or 2D ndarray
+       Parameter set(s), of shape (nparams) or (nsets, nparams).
+
+    Returns:
+    --------
+    X: 2D ndarray
+       Design matrix of shape (nsets, nterms).
+    """
+    x = (np.atleast_2d(params)[:,self.ifree] - self.pcenter) / self.pscale
+    quad = (x[:,:,np.newaxis] * x[:,np.newaxis,:])[:,self.iquad[0],
+                                                     self.iquad[1]]
+    return np.hstack((np.ones((len(x), 1)), x, quad))
+
+
+  def update(self, params, models):
+    """
+    Add evaluated (params, models) pairs to the training set.
+
+    Parameters:
+    -----------
+    params: 2D ndarray
+       Evaluated parameter sets, of shape (nsets, nparams).
+    models: 2D ndarray
+       Evaluated models, of shape (nsets, ndata).
+    """
+    if len(params) == 0:
+      return
+    X = self.features(params)
+    if self.XtY is None:
+      self.XtY = np.zeros((self.nterms, np.shape(models)[1]))
+    self.XtX += np.dot(X.T, X)
+    self.XtY += np.dot(X.T, models)
+    self.ntrain += len(X)
+
+
+  def fit(self):
+    """
+    Solve the (regularized) normal equations for the emulator coefficients.
+
+    Returns:
+    --------
+    trained: Boolean
+       True if there were enough training samples to fit the emulator.
+    """
+    if self.ntrain < 2*self.nterms:
+      return False
+    reg = self.ridge * np.trace(self.XtX)/self.nterms * np.eye(self.nterms)
+    try:
+      self.coeffs = np.linalg.solve(self.XtX + reg, self.XtY)
+    except np.linalg.LinAlgError:
+      return self.coeffs is not None
+    return True
+
+
+  def __call__(self, params, *indparams):
+    """
+    Evaluate the emulator with the same calling signature as func.
+    """
+    return np.dot(self.features(params), self.coeffs)[0]
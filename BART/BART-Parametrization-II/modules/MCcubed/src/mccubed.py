@@ -56,6 +56,7 @@ import timeit
 import numpy as np
 
 import mcmc    as mc
+import nested  as ns
 import mcutils as mu
 start = timeit.default_timer()
 
@@ -123,7 +124,60 @@ def main():
                      dest="walk",
                      help="Random walk algorithm [default: %(default)s]",
                      type=str,   action="store", default="demc",
-                     choices=('demc', 'mrw'))
+                     choices=('demc', 'mrw', 'stretch', 'nested'))
+  group.add_argument(      "--adaptive",
+                     dest="adaptive",
+                     help="Adapt the proposal covariance of the Metropolis "
+                     "random walk during burn-in [default: %(default)s]",
+                     type=eval,  action="store", default=False)
+  group.add_argument(      "--accrate",
+                     dest="accrate",
+                     help="Target acceptance rate for the adaptive proposal "
+                     "[default: %(default)s]",
+                     type=float, action="store", default=0.234)
+  group.add_argument(      "--reseed",
+                     dest="reseed",
+                     help="Reseed stuck chains during burn-in "
+                     "[default: %(default)s]",
+                     type=eval,  action="store", default=False)
+  group.add_argument(      "--reseed_thresh",
+                     dest="reseedthresh",
+                     help="Chi-square threshold (in robust standard "
+                     "deviations above the median) to flag a stuck chain "
+                     "[default: %(default)s]",
+                     type=float, action="store", default=5.0)
+  group.add_argument(      "--nlive",
+                     dest="nlive",
+                     help="Number of live points for the nested sampling "
+                     "(walk='nested') [default: %(default)s]",
+                     type=int,   action="store", default=400)
+  group.add_argument(      "--dlogz",
+                     dest="dlogz",
+                     help="Nested-sampling stopping criterion, remaining "
+                     "log-evidence [default: %(default)s]",
+                     type=float, action="store", default=0.1)
+  group.add_argument(      "--metrics",
+                     dest="metrics",
+                     help="File where to write the run metrics at each "
+                     "intermediate step (JSON lines, or Prometheus textfile "
+                     "if the extension is .prom) [default: %(default)s]",
+                     type=str,   action="store", default=None)
+  group.add_argument(      "--blocks",
+                     dest="blocks",
+                     help="Block label of each parameter, propose jumps "
+                     "for one block at a time [default: %(default)s]",
+                     type=mu.parray, action="store", default=None)
+  group.add_argument(      "--blockscale",
+                     dest="blockscale",
+                     help="Jump scale factor of each block "
+                     "[default: %(default)s]",
+                     type=mu.parray, action="store", default=None)
+  group.add_argument(      "--ntry",
+                     dest="ntry",
+                     help="Number of candidate proposals per chain for a "
+                     "multiple-try walk (uses nchains*ntry processes) "
+                     "[default: %(default)s]",
+                     type=int,   action="store", default=1)
   group.add_argument(      "--wlikelihood",
                      dest="wlike",
                      help="Calculate the likelihood in a wavelet base "
@@ -148,6 +202,12 @@ def main():
                      "[default: %(default)s]",
                      dest="burnin",
                      type=eval,   action="store", default=0)
+  group.add_argument(      "--autoburn",
+                     dest="autoburn",
+                     help="Estimate the burn-in iterations from the chains "
+                     "(chi-square stabilization and Geweke-style test), "
+                     "burnin is the lower limit [default: %(default)s]",
+                     type=eval,   action="store", default=False)
   group.add_argument("-t", "--thinning",
                      dest="thinning",
                      help="Chains thinning factor (use every thinning-th "
@@ -165,9 +225,14 @@ def main():
                      type=str,     action="store",  default="output.npy")
   group.add_argument(      "--savemodel",
                      dest="savemodel",
-                     help="Output filename to store the evaluated models  "
-                     "[default: %(default)s]",
+                     help="Output filename to store the evaluated models "
+                     "(saved with a .npz extension)  [default: %(default)s]",
                      type=str,     action="store",  default=None)
+  group.add_argument(      "--compressmodel",
+                     dest="compressmodel",
+                     help="Compress (lossless) the savemodel file "
+                     "[default: %(default)s]",
+                     type=eval,    action="store",  default=False)
   group.add_argument(       "--mpi",
                      dest="mpi",
                      help="Run under MPI multiprocessing [default: "
@@ -195,6 +260,18 @@ def main():
                      help="List of strings with the function name, module "
                      "name, and path-to-module [required]",
                      type=mu.parray,  action="store", default=None)
+  group.add_argument(      "--surrogate",
+                     dest="surrogate",
+                     help="Surrogate model (function name, module name, and "
+                     "path-to-module, or 'emulator') to screen proposals in "
+                     "a delayed-acceptance MCMC [default: %(default)s]",
+                     type=mu.parray,  action="store", default=None)
+  group.add_argument(      "--coarsefunc",
+                     dest="coarsefunc",
+                     help="Reduced-resolution model function (function "
+                     "name, module name, and path-to-module) to evaluate "
+                     "during burn-in [default: %(default)s]",
+                     type=mu.parray,  action="store", default=None)
   group.add_argument("-p", "--params",
                      dest="params",
                      help="Filename or list of initial-guess model-fitting "
@@ -271,8 +348,22 @@ def main():
   tracktime  = args2.tractime
   logfile    = args2.logfile
   rms        = args2.rms
+  adaptive   = args2.adaptive
+  accrate    = args2.accrate
+  reseed     = args2.reseed
+  reseedthresh = args2.reseedthresh
+  ntry       = args2.ntry
+  nlive      = args2.nlive
+  metrics    = args2.metrics
+  autoburn   = args2.autoburn
+  compressmodel = args2.compressmodel
+  blocks     = args2.blocks
+  blockscale = args2.blockscale
+  dlogz      = args2.dlogz
 
   func      = args2.func
+  surrogate = args2.surrogate
+  coarsefunc = args2.coarsefunc
   params    = args2.params
   pmin      = args2.pmin
   pmax      = args2.pmax
@@ -285,7 +376,15 @@ def main():
   priorup  = args2.priorup
   priorlow = args2.priorlow
 
-  nprocs   = nchains
+  # The nested sampling evaluates one batch of nchains models at a time:
+  if walk == "nested" and ntry > 1:
+    mu.warning("The nested sampling does not use multiple-try proposals, "
+               "setting ntry=1.")
+    ntry = 1
+  nprocs   = nchains * ntry  # One process per candidate proposal
+  # The stretch walk evaluates half of the chains at a time:
+  if walk == "stretch":
+    nprocs = nchains/2
 
   # Open a log FILE if requested:
   if logfile is not None:
@@ -368,7 +467,7 @@ def main():
   if indparams != [] and isinstance(indparams[0], str):
     if not os.path.isfile(indparams[0]):
       mu.error("'indparams' file not found.", log)
-    indparams = mu.readbin(indparams[0])
+    indparams = mu.readbin(indparams[0], mmap=True)
 
   if tracktime:
     start_mpi = timeit.default_timer()
@@ -407,14 +506,28 @@ def main():
 
   if tracktime:
     start_loop = timeit.default_timer()
+  # Run the nested sampling:
+  if walk == "nested":
+    allp, bp = ns.nested(data, unc, func, indparams,
+                         params, pmin, pmax, stepsize,
+                         prior, priorlow, priorup,
+                         numit, nchains, nlive, dlogz,
+                         plots=plots, savefile=savefile, comm=comm, log=log)
   # Run the MCMC:
-  allp, bp = mc.mcmc(data, unc, func, indparams,
-                     params, pmin, pmax, stepsize,
-                     prior, priorlow, priorup,
-                     numit, nchains, walk, wlike,
-                     leastsq, chisqscale, grtest, burnin,
-                     thinning, plots, savefile, savemodel,
-                     comm, resume, log, rms)
+  else:
+    allp, bp = mc.mcmc(data, unc, func, indparams,
+                       params, pmin, pmax, stepsize,
+                       prior, priorlow, priorup,
+                       numit, nchains, walk, wlike,
+                       leastsq, chisqscale, grtest, burnin,
+                       thinning, plots, savefile, savemodel,
+                       comm, resume, log, rms,
+                       adaptive=adaptive, accrate=accrate,
+                       reseed=reseed, reseedthresh=reseedthresh,
+                       surrogate=surrogate, coarsefunc=coarsefunc, ntry=ntry,
+                       metrics=metrics, autoburn=autoburn,
+                       compressmodel=compressmodel, blocks=blocks,
+                       blockscale=blockscale)
 
   if tracktime:
     stop = timeit.default_timer()
@@ -437,7 +550,10 @@ def mcmc(data=None,     uncert=None,     func=None,     indparams=None,
          leastsq=None,  chisqscale=None, grtest=None,   burnin=None,
          thinning=None, plots=None,      savefile=None, savemodel=None,
          mpi=None,      resume=None,     logfile=None,  rms=None,
-         cfile=False):
+         adaptive=None, accrate=None,    reseed=None,   reseedthresh=None,
+         surrogate=None, coarsefunc=None, ntry=None,     nlive=None,
+         dlogz=None,    metrics=None,    autoburn=None, compressmodel=None,
+         blocks=None,   blockscale=None, cfile=False):
   """
   MCMC wrapper for interactive session.
 
@@ -489,6 +605,8 @@ def mcmc(data=None,     uncert=None,     func=None,     indparams=None,
      Random walk algorithm:
      - 'mrw':  Metropolis random walk.
      - 'demc': Differential Evolution Markov chain.
+     - 'stretch': Affine-invariant ensemble sampler (stretch move).
+     - 'nested': Nested sampling (computes the Bayesian evidence).
   wlike: Boolean
      Calculate the likelihood in a wavelet base.
   leastsq: Boolean
@@ -510,7 +628,7 @@ def mcmc(data=None,     uncert=None,     func=None,     indparams=None,
      If not None, filename to store allparams (with np.save).
   savemodel: String
      If not None, filename to store the values of the evaluated function
-     (with np.save).
+     (as a .npz model store, see mcmc).
   mpi: Boolean
      If True run under MPI multiprocessing protocol.
   resume: Boolean
@@ -519,6 +637,39 @@ def mcmc(data=None,     uncert=None,     func=None,     indparams=None,
      Filename to write log.
   rms: Boolean
      If True, calculate the RMS of data-bestmodel.
+  adaptive: Boolean
+     If True (and walk='mrw'), adapt the proposal covariance during burn-in.
+  accrate: Float
+     Target acceptance rate for the adaptive proposal.
+  reseed: Boolean
+     If True, reseed stuck chains during burn-in.
+  reseedthresh: Float
+     Threshold (in robust standard deviations above the median chi-square)
+     to flag a stuck chain.
+  surrogate: Callable or string-iterable
+     Cheap surrogate model to screen the proposals in a delayed-acceptance
+     MCMC.  Same specification as func, or ['emulator'] to use a quadratic
+     emulator trained during burn-in.
+  coarsefunc: Callable or string-iterable
+     Reduced-resolution version of func to evaluate during burn-in.
+  ntry: Integer
+     Number of candidate proposals per chain (multiple-try walk if > 1).
+  nlive: Integer
+     Number of live points of the nested sampling.
+  dlogz: Float
+     Nested-sampling stopping criterion (remaining log-evidence).
+  metrics: String
+     File where to write the run metrics (JSON lines, or a Prometheus
+     textfile if the extension is '.prom').
+  autoburn: Boolean
+     If True, estimate the burn-in iterations from the chains (burnin
+     is the lower limit).
+  compressmodel: Boolean
+     If True, compress (lossless) the savemodel file.
+  blocks: 1D integer ndarray
+     Block label of each parameter for block-wise proposals.
+  blockscale: 1D float ndarray
+     Jump scale factor of each block.
   cfile: String
      Configuration file name.
 
@@ -604,6 +755,20 @@ def mcmc(data=None,     uncert=None,     func=None,     indparams=None,
     piargs.update({'resume':   resume})
     piargs.update({'logfile':  logfile})
     piargs.update({'rms':      rms})
+    piargs.update({'adaptive': adaptive})
+    piargs.update({'accrate':  accrate})
+    piargs.update({'reseed':   reseed})
+    piargs.update({'reseedthresh': reseedthresh})
+    piargs.update({'surrogate': surrogate})
+    piargs.update({'coarsefunc': coarsefunc})
+    piargs.update({'ntry':     ntry})
+    piargs.update({'nlive':    nlive})
+    piargs.update({'dlogz':    dlogz})
+    piargs.update({'metrics':  metrics})
+    piargs.update({'autoburn': autoburn})
+    piargs.update({'compressmodel': compressmodel})
+    piargs.update({'blocks':   blocks})
+    piargs.update({'blockscale': blockscale})
 
     # Remove None values:
     for key in piargs.keys():
@@ -623,14 +788,14 @@ def mcmc(data=None,     uncert=None,     func=None,     indparams=None,
     for key in piargs.keys():
       value = piargs[key]
       # Func:
-      if   key == 'func':
-        if callable(func):
-          funcfile = func.__globals__['__file__']
+      if   key in ['func', 'surrogate', 'coarsefunc']:
+        if callable(value):
+          funcfile = value.__globals__['__file__']
           funcpath = funcfile[:funcfile.rfind('/')]
-          config.set('MCMC', key, "%s %s %s"%(func.__name__,
-                                              func.__module__, funcpath))
+          config.set('MCMC', key, "%s %s %s"%(value.__name__,
+                                              value.__module__, funcpath))
         else:
-          config.set('MCMC', key, " ".join(func))
+          config.set('MCMC', key, " ".join(value))
       # Arrays:
       elif key in ['data', 'uncert', 'indparams', 'params', 'pmin', 'pmax',
                    'stepsize', 'prior', 'priorlow', 'priorup']:
@@ -646,6 +811,9 @@ def mcmc(data=None,     uncert=None,     func=None,     indparams=None,
             mu.writedata(value, arrfile)
           config.set('MCMC', key, arrfile)     # Set filename in config
           tmpfiles.append(arrfile)
+      # Short arrays (written in-line):
+      elif key in ['blocks', 'blockscale']:
+        config.set('MCMC', key, " ".join([str(v) for v in value]))
       # Everything else:
       else:
         config.set('MCMC', key, str(value))
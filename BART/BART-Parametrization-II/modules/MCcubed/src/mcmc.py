@@ -61,6 +61,164 @@ import mcplots  as mp
 import dwt      as dwt
 import chisq    as cs
 import timeavg  as ta
+import emulator as em
+import autoburn as ab
+import modelstore as ms
+
+def mpieval(comm, sets, nwork, ndata):
+  """
+  Evaluate sets of model parameters on the MPI workers, in batches of
+  nwork sets (one set per worker).
+
+  Parameters:
+  -----------
+  comm: MPI Communicator
+     A communicator object to transfer data through MPI.
+  sets: 2D ndarray
+     Model parameters of shape (nsets, mpars), nsets a multiple of nwork.
+  nwork: Integer
+     Number of MPI workers.
+  ndata: Integer
+     Number of data values returned by the model.
+
+  Returns:
+  --------
+  models: 2D ndarray
+     Evaluated models of shape (nsets, ndata).
+  """
+  from mpi4py import MPI
+  nsets  = len(sets)
+  models = np.zeros((nsets, ndata))
+  mpimodels = np.zeros(nwork*ndata, np.double)
+  for start in np.arange(0, nsets, nwork):
+    mu.comm_scatter(comm, sets[start:start+nwork].flatten(), MPI.DOUBLE)
+    mu.comm_gather(comm, mpimodels)
+    models[start:start+nwork] = np.reshape(mpimodels, (nwork, ndata))
+  return models
+
+
+def mtmjumps(walk, params, ntry, ifree, stepsize, gamma, gamma2,
+             propchol=None):
+  """
+  Draw ntry proposal jumps for each chain of a multiple-try step.
+
+  Parameters:
+  -----------
+  walk: String
+     Random walk algorithm ('mrw' or 'demc').
+  params: 2D ndarray
+     Current state of the chains, of shape (nchains, nparams).
+  ntry: Integer
+     Number of jumps per chain.
+  ifree: 1D integer ndarray
+     Indices of the free parameters.
+  stepsize: 1D ndarray
+     Proposal (or DEMC support) standard deviation of the parameters.
+  gamma: Float
+     DEMC jump scale factor.
+  gamma2: Float
+     DEMC support-distribution scale factor.
+  propchol: 2D ndarray
+     If not None, scaled Cholesky factor of the (adaptive) proposal
+     covariance for the 'mrw' walk.
+
+  Returns:
+  --------
+  jumps: 3D ndarray
+     Proposal jumps of shape (nchains, ntry, nfree).
+  """
+  nchains = len(params)
+  nfree   = len(ifree)
+  if walk == "mrw":
+    jumps = np.random.normal(0, stepsize[ifree], (nchains, ntry, nfree))
+    if propchol is not None:
+      jumps = np.dot(jumps/stepsize[ifree], propchol.T)
+  elif walk == "demc":
+    # Random pairs of chains different from the current chain:
+    ichain = np.arange(nchains)[:,np.newaxis]
+    r1 = np.random.randint(0, nchains-1, (nchains, ntry))
+    r2 = np.random.randint(0, nchains-1, (nchains, ntry))
+    r1 += r1 >= ichain
+    r2 += r2 >= ichain
+    jumps = (gamma  * (params[r1]-params[r2])[:,:,ifree] +
+             gamma2 * np.random.normal(0, stepsize[ifree], (nchains,ntry,nfree)))
+  return jumps
+
+
+def mtmeval(tries, outbounds, pmin, pmax, ifree, ishare, stepsize, mpars,
+            usecoarse, func, coarsefunc, indparams, data, uncert, prior,
+            priorlow, iprior, wlike, comm=None, skiplast=False):
+  """
+  Evaluate the chi-square of the candidates of a multiple-try step.
+  Under MPI, each worker evaluates one candidate.
+
+  Parameters:
+  -----------
+  tries: 3D ndarray
+     Candidate parameters of shape (nchains, ntry, nparams).  The
+     out-of-bound values are clipped in place.
+  outbounds: 2D ndarray
+     If not None, out-of-bound counter (updated in place).
+  usecoarse: Boolean
+     If True, evaluate coarsefunc instead of func (non-MPI runs).
+  skiplast: Boolean
+     If True, do not evaluate the last candidate of each chain.
+  (See mcmc() for the rest of the parameters.)
+
+  Returns:
+  --------
+  chisq: 2D ndarray
+     Chi-square (including priors) of the candidates, inf if out of bounds.
+  c2: 2D ndarray
+     Chi-square without the Jeffrey's term.
+  models: 3D ndarray
+     Evaluated models of shape (nchains, ntry, ndata).
+  """
+  nchains, ntry, nparams = np.shape(tries)
+  ndata = len(data)
+
+  # Check they are within boundaries:
+  outflag = np.any(((tries < pmin) | (tries > pmax))[:,:,ifree], axis=2)
+  if outbounds is not None:
+    outbounds += np.sum(((tries < pmin) | (tries > pmax))[:,:,ifree], axis=1)
+  tries[:,:,ifree] = np.clip(tries[:,:,ifree], pmin[ifree], pmax[ifree])
+  # Update shared parameters:
+  for s in ishare:
+    tries[:,:,s] = tries[:,:,-int(stepsize[s])-1]
+
+  skip = np.copy(outflag)
+  if skiplast:
+    skip[:,-1] = True
+
+  models = np.zeros((nchains, ntry, ndata))
+  if comm is not None:
+    from mpi4py import MPI
+    sendp = np.copy(tries[:,:,0:mpars])
+    sendp[skip] = np.nan  # Flag the workers to skip these
+    mu.comm_scatter(comm, sendp.flatten(), MPI.DOUBLE)
+    mpimodels = np.zeros(nchains*ntry*ndata, np.double)
+    mu.comm_gather(comm, mpimodels)
+    models = np.reshape(mpimodels, (nchains, ntry, ndata))
+  else:
+    for c, j in zip(*np.where(~skip)):
+      fargs = [tries[c, j, 0:mpars]] + indparams
+      if usecoarse:
+        models[c,j] = coarsefunc(*fargs)
+      else:
+        models[c,j] = func(*fargs)
+
+  chisq = np.tile(np.inf, (nchains, ntry))
+  c2    = np.tile(np.inf, (nchains, ntry))
+  for c, j in zip(*np.where(~skip)):
+    if wlike:
+      chisq[c,j], c2[c,j] = dwt.wlikelihood(tries[c,j,mpars:],
+                 models[c,j]-data, (tries[c,j]-prior)[iprior],
+                 priorlow[iprior], priorlow[iprior])
+    else:
+      chisq[c,j], c2[c,j] = cs.chisq(models[c,j], data, uncert,
+                 (tries[c,j]-prior)[iprior], priorlow[iprior], priorlow[iprior])
+  return chisq, c2, models
+
 
 def mcmc(data,         uncert=None,      func=None,     indparams=[],
          params=None,  pmin=None,        pmax=None,     stepsize=None,
@@ -68,7 +226,10 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
          numit=10,     nchains=10,       walk='demc',   wlike=False,
          leastsq=True, chisqscale=False, grtest=True,   burnin=0,
          thinning=1,   plots=False,      savefile=None, savemodel=None,
-         comm=None,    resume=False,     log=None,      rms=False):
+         comm=None,    resume=False,     log=None,      rms=False,
+         adaptive=False, accrate=0.234, reseed=False, reseedthresh=5.0,
+         surrogate=None, coarsefunc=None, ntry=1, metrics=None,
+         autoburn=False, compressmodel=False, blocks=None, blockscale=None):
   """
   This beautiful piece of code runs a Markov-chain Monte Carlo algoritm.
 
@@ -111,6 +272,7 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
      Random walk algorithm:
      - 'mrw':  Metropolis random walk.
      - 'demc': Differential Evolution Markov chain.
+     - 'stretch': Affine-invariant ensemble sampler (See Note 9).
   wlike: Boolean
      If True, calculate the likelihood in a wavelet-base.  This requires
      three additional parameters (See Note 3).
@@ -133,13 +295,54 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
      If not None, filename to store allparams (with np.save).
   savemodel: String
      If not None, filename to store the values of the evaluated function
-     (with np.save).
+     (as a compact .npz model store, See Note 12).
   comm: MPI Communicator
      A communicator object to transfer data through MPI.
   resume: Boolean
      If True resume a previous run.
   log: FILE pointer
      File object to write log into.
+  rms: Boolean
+     If True, calculate the RMS of data-bestmodel.
+  adaptive: Boolean
+     If True (and walk='mrw'), learn the proposal covariance from the
+     running chain statistics during the burn-in iterations (See Note 4).
+  accrate: Float
+     Target acceptance rate of the adaptive Metropolis proposal.
+  reseed: Boolean
+     If True, reseed stuck chains during the burn-in iterations
+     (See Note 5).
+  reseedthresh: Float
+     Number of robust standard deviations above the median chi-square
+     for a chain to be flagged as stuck.
+  surrogate: callable or string-iterable
+     If not None, run a delayed-acceptance MCMC that screens the proposals
+     with this cheap surrogate model before evaluating func (See Note 6).
+     Same calling signature and specification as func.  Set to
+     ['emulator'] to use a quadratic emulator trained on the evaluated
+     models during the burn-in.
+  coarsefunc: callable or string-iterable
+     If not None, a reduced-resolution version of func (same calling
+     signature and specification as func) to evaluate during the burn-in
+     (See Note 7).
+  ntry: Integer
+     Number of candidate proposals per chain and iteration.  If ntry > 1,
+     run a multiple-try Metropolis (or DEMC) walk (See Note 8).
+  metrics: String
+     If not None, file where to write the run metrics at each
+     intermediate step (See Note 10).
+  autoburn: Boolean
+     If True, estimate the burn-in iterations from the chains (See
+     Note 11).
+  compressmodel: Boolean
+     If True, compress (lossless) the savemodel file.
+  blocks: 1D integer ndarray
+     If not None, the block label of each parameter.  Each iteration
+     proposes a jump for the free parameters of a single block (See
+     Note 13).
+  blockscale: 1D float ndarray
+     Jump scale factor of each block (in order of the sorted block
+     labels, default: ones).
 
   Returns:
   --------
@@ -164,6 +367,68 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
       All three: prior, priorup, and priorlow must be set and, furthermore,
       priorup and priorlow must be > 0 to be considered as prior.
   3.- FINDME WAVELET LIKELIHOOD
+  4.- The adaptive Metropolis walk (Haario et al. 2001) draws correlated
+      proposal jumps from the covariance of the (pooled) chain samples,
+      scaled by 2.38**2/nfree, and tunes a global scale factor toward
+      accrate.  The proposal is frozen at the end of the burn-in, so only
+      the burned-in samples come from a non-Markovian kernel.
+  5.- At each intermediate step of the burn-in, a chain is flagged as
+      stuck if its chi-square exceeds the population median by more than
+      reseedthresh times the median absolute deviation (scaled to a
+      standard deviation).  Stuck chains are moved to the current state
+      of a randomly chosen non-stuck chain.
+  6.- The delayed-acceptance MCMC (Christen & Fox 2005) first accepts
+      or rejects a proposal using the surrogate chi-square.  Only the
+      proposals that pass are evaluated with func, and then accepted
+      with the probability that corrects for the surrogate screening,
+      so the chains still sample the func posterior.  Under MPI, the
+      workers skip the proposals that carry NaN parameters.  The
+      built-in emulator is refitted only during burn-in (it requires
+      burnin > 0).  With coarsefunc, the emulator is reset at the end of
+      the burn-in and retrained with func until its first fit.
+  7.- With coarsefunc, the chi-squares of the chains are re-evaluated
+      with func at the end of the burn-in, before the first post-burn-in
+      proposal.  Under MPI, the workers receive the evaluation index at
+      which to switch from the coarse to the full model (with 'hack'
+      functions, the worker sets up the coarse model itself).
+  8.- The multiple-try Metropolis (Liu et al. 2000) draws ntry candidates
+      per chain, selects one with probability proportional to its
+      posterior, and accepts it with the ratio of the candidates summed
+      posteriors to the summed posteriors of a reference set drawn about
+      the selected candidate.  Each iteration evaluates 2*ntry-1 models
+      per chain in two parallel batches, so under MPI it uses
+      nchains*ntry workers.
+  9.- The stretch walk (Goodman & Weare 2010) splits the chains in two
+      halves, and updates each chain of one half along the line to a
+      random chain of the other half, scaled by z ~ 1/sqrt(z) in [1/2, 2].
+      The two halves are updated in turn, so each half-step is one
+      parallel batch; under MPI it uses nchains/2 workers (nchains must
+      be even).
+  10.- The metrics (iterations per second, model evaluations per second
+      per worker, acceptance rate, best chi-square, Gelman-Rubin
+      statistic, and checkpoint latency) are appended as JSON lines, or
+      written as a Prometheus textfile if the file extension is '.prom'
+      (see mcutils.writemetrics).
+  11.- With autoburn, the burn-in is estimated from the chains at each
+      intermediate step: the chi-square stabilization point, moved forward
+      until the remaining chains pass a Geweke-style test (see autoburn.py).
+      burnin still sets the burn-in schedule (coarse model, adaptive
+      proposal, reseeding, surrogate training) and is the lower limit of
+      the estimate.  The estimate sets the iterations used in the
+      Gelman-Rubin test, and the final estimate is the iterations trimmed
+      from the posterior (reported in the summary and the metrics).
+  12.- The savemodel file stores each model only when a chain accepts a
+      proposal: a table of unique models plus an index array of shape
+      (nchains, niter) into the table (see modelstore.py), saved with
+      a .npz extension (replacing the extension of savemodel).  Use
+      modelstore.load(savemodel).cube() to reconstruct the full
+      (nchains, ndata, niter) array of models.
+  13.- The block-wise proposals (for walk='mrw' or 'demc') pick a random
+      block at each iteration (the same for all chains), and only move
+      the free parameters of that block.  The DEMC jump scale uses the
+      number of free parameters in the block.  Since a block step only
+      changes part of the model parameters, the model function can cache
+      the products that depend on the other blocks.
 
   Examples:
   ---------
@@ -216,6 +481,33 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
              "tuple, or ndarray) of strings with the model function, file, "
              "and path names.", log)
 
+  # Import the coarse-resolution model function:
+  if type(coarsefunc) in [list, tuple, np.ndarray]:
+    if coarsefunc[0] != 'hack':
+      if len(coarsefunc) == 3:
+        sys.path.append(coarsefunc[2])
+      exec('from %s import %s as coarsefunc'%(coarsefunc[1], coarsefunc[0]))
+  elif coarsefunc is not None and not callable(coarsefunc):
+    mu.error("'coarsefunc' must be either, a callable, or an iterable (list, "
+             "tuple, or ndarray) of strings with the model function, file, "
+             "and path names.", log)
+
+  # Multiple-try proposals:
+  ntry = int(ntry)
+  mtm  = ntry > 1
+  if mtm and surrogate is not None:
+    mu.error("The multiple-try proposals cannot be combined with the "
+             "surrogate screening.", log)
+  # Affine-invariant (stretch) ensemble walk:
+  stretch = walk == "stretch"
+  if stretch:
+    if nchains % 2 != 0 or nchains < 4:
+      mu.error("The stretch walk requires an even number of chains "
+               "(nchains >= 4).", log)
+    if mtm or surrogate is not None:
+      mu.error("The stretch walk cannot be combined with the multiple-try "
+               "proposals or the surrogate screening.", log)
+
   if np.ndim(params) == 1:  # Force it to be 2D (one for each chain)
     params  = np.atleast_2d(params)
   nparams = len(params[0])  # Number of model params
@@ -252,35 +544,69 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
 
   # Allocate arrays with variables:
   numaccept  = np.zeros(nchains)          # Number of accepted proposal jumps
+  nreseed    = 0                          # Number of reseeded chains
   outbounds  = np.zeros((nchains, nfree), np.int)   # Out of bounds proposals
   allparams  = np.zeros((nchains, nfree, chainlen)) # Parameter's record
   if savemodel is not None:
-    allmodel = np.zeros((nchains, ndata, chainlen)) # Fit model
+    allmodel = ms.ModelStore(nchains, ndata, chainlen) # Fit model
 
   if resume:
     oldparams = np.load(savefile)
     nold = np.shape(oldparams)[2] # Number of old-run iterations
     allparams = np.dstack((oldparams, allparams))
     if savemodel is not None:
-      allmodel  = np.dstack((np.load(savemodel), allmodel))
+      allmodel = ms.load(savemodel)
+      allmodel.resize(nold+chainlen)
     # Set params to the last-iteration state of the previous run:
     params = np.repeat(params, nchains, 0)
     params[:,ifree] = oldparams[:,:,-1]
   else:
     nold = 0
 
+  # Chi-square record for the automatic burn-in:
+  if autoburn and resume:
+    mu.warning("The automatic burn-in is not available when resuming a "
+               "run, using burnin={:d}.".format(burnin), log)
+    autoburn = False
+  if autoburn:
+    allchisq = np.zeros((nchains, chainlen))
+  burncut = burnin  # Iterations trimmed from the posterior
+
   # Set MPI flag:
   mpi = comm is not None
 
+  # Number of MPI workers, and number of batches to evaluate all the
+  # chains, and per iteration (the multiple-try and stretch walks
+  # evaluate two batches per iteration):
+  if stretch:
+    nwork = nchains/2
+    nfull = 2
+  else:
+    nwork = nchains*ntry
+    nfull = 1
+  nrep = nwork*nfull/nchains  # Workers per chain in a full evaluation
+  niterbatch = 1 + (mtm or stretch)
+
+  # Coarse-model burn-in (switch to func at the end of burn-in):
+  coarse = coarsefunc is not None and 0 < burnin < chainlen
+  if coarse:
+    # Evaluation index of the full-model re-evaluation:
+    iswitch = nfull + niterbatch*burnin
+  else:
+    iswitch = -1
+
   if mpi:
     from mpi4py import MPI
-    # Send sizes info to other processes:
-    array1 = np.asarray([mpars, chainlen], np.int)
+    # Send sizes info to other processes (number of batches - 1):
+    array1 = np.asarray([mpars, nfull*(1+coarse) + niterbatch*chainlen - 1,
+                         iswitch], np.int)
     mu.comm_bcast(comm, array1, MPI.INT)
 
   # DEMC parameters:
   gamma  = 2.4 / np.sqrt(2*nfree)
   gamma2 = 0.001  # Jump scale factor of support distribution
+  # Stretch-move scale parameter:
+  stretchscale = 2.0
 
   # Least-squares minimization:
   if leastsq:
@@ -309,17 +635,18 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
   # Calculate chi-squared for model using current params:
   models = np.zeros((nchains, ndata))
   if mpi:
-    # Scatter (send) parameters to func:
-    mu.comm_scatter(comm, params[:,0:mpars].flatten(), MPI.DOUBLE)
-    # Gather (receive) evaluated models:
+    # Scatter (send) parameters to func and gather (receive) the evaluated
+    # models (with nrep workers per chain):
+    models = mpieval(comm, np.repeat(params[:,0:mpars], nrep, 0), nwork,
+                     ndata)[::nrep]
     mpimodels = np.zeros(nchains*ndata, np.double)
-    mu.comm_gather(comm, mpimodels)
-    # Store them in models variable:
-    models = np.reshape(mpimodels, (nchains, ndata))
   else:
     for c in np.arange(nchains):
       fargs = [params[c, 0:mpars]] + indparams  # List of function's arguments
-      models[c] = func(*fargs)
+      if coarse:
+        models[c] = coarsefunc(*fargs)
+      else:
+        models[c] = func(*fargs)
 
   # Calculate chi-squared for each chain:
   currchisq = np.zeros(nchains)
@@ -353,7 +680,42 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
   bestmodel = np.copy(models[np.argmin(c2)])
 
   if savemodel is not None:
-    allmodel[:,:,0] = models
+    allmodel.update(models)
+
+  # Set up the delayed-acceptance surrogate model:
+  if surrogate is not None:
+    strain = (type(surrogate) in [list, tuple, np.ndarray] and
+              surrogate[0] == 'emulator')
+    if strain and burnin == 0:
+      mu.warning("The emulator surrogate is trained during the burn-in, and "
+                 "requires burnin > 0, running without the surrogate "
+                 "screening.", log)
+      surrogate = None
+  if surrogate is not None:
+    if strain:
+      imodel = ifree[ifree < mpars]  # Free model parameters
+      surrogate = em.Emulator(params[0,imodel], stepsize[imodel], imodel)
+      surrogate.update(params[:,0:mpars], models)
+    elif type(surrogate) in [list, tuple, np.ndarray]:
+      if len(surrogate) == 3:
+        sys.path.append(surrogate[2])
+      exec('from %s import %s as surrogate'%(surrogate[1], surrogate[0]))
+    elif not callable(surrogate):
+      mu.error("'surrogate' must be either, a callable, or an iterable "
+               "(list, tuple, or ndarray) of strings with the model "
+               "function, file, and path names.", log)
+    strained   = not strain  # Surrogate ready to screen proposals
+    scurrchisq = np.zeros(nchains)  # Surrogate chi-square of params
+    snextchisq = np.zeros(nchains)  # Surrogate chi-square of nextp
+    sunif      = np.random.uniform(0, 1, (chainlen, nchains))
+    nscreened  = 0  # Number of proposals rejected by the surrogate
+    nproposed  = 0  # Number of in-bound proposals
+    if strained:
+      for c in np.arange(nchains):
+        smodel = surrogate(*([params[c, 0:mpars]] + indparams))
+        scurrchisq[c] = cs.chisq(smodel, data, uncert,
+                                 (params[c]-prior)[iprior],
+                                 priorlow[iprior], priorlow[iprior])[0]
 
   # Set up the random walks:
   if   walk == "mrw":
@@ -369,6 +731,50 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
       r1[c][np.where(r1[c]==c)] = nchains-1
       r2[c][np.where(r2[c]==c)] = nchains-1
 
+  # Block-wise proposals:
+  blockwise = blocks is not None
+  if blockwise:
+    if mtm or stretch:
+      mu.error("The block-wise proposals cannot be combined with the "
+               "multiple-try or stretch walks.", log)
+    blocks = np.asarray(blocks, np.int)
+    if len(blocks) != nparams:
+      mu.error("The number of block labels ({:d}) does not match the number "
+               "of parameters ({:d}).".format(len(blocks), nparams), log)
+    labels = np.unique(blocks)
+    if blockscale is None:
+      blockscale = np.ones(len(labels))
+    if len(blockscale) != len(labels):
+      mu.error("The number of block scale factors ({:d}) does not match the "
+               "number of blocks ({:d}).".format(len(blockscale),
+                                                 len(labels)), log)
+    # Jump factors of the free parameters for each (non-fixed) block:
+    blockjump = []
+    for b in np.arange(len(labels)):
+      inblock = blocks[ifree] == labels[b]
+      if np.sum(inblock) == 0:
+        continue
+      factor = inblock * blockscale[b]
+      if walk == "demc":
+        factor *= np.sqrt(nfree/float(np.sum(inblock)))
+      blockjump.append(factor)
+    blockjump = np.asarray(blockjump)
+    iblock = np.random.randint(0, len(blockjump), chainlen)
+    mu.msg(1, "Block-wise proposals over {:d} blocks.".format(len(blockjump)),
+           log)
+
+  # Adaptive Metropolis: proposal covariance learned during burn-in:
+  adapt = adaptive and walk == "mrw" and burnin > 0
+  if adaptive and not adapt:
+    mu.warning("The adaptive proposal requires walk='mrw' and burnin > 0, "
+               "using the fixed stepsize instead.", log)
+  if adapt:
+    propchol  = np.diag(stepsize[ifree])  # Cholesky factor of the proposal
+    propscale = 1.0                       # Global proposal scale factor
+    nadapt    = 0                         # Number of pooled samples
+    asum      = np.zeros(nfree)           # Sum of the samples
+    asumsq    = np.zeros((nfree, nfree))  # Sum of the samples outer products
+
   # Uniform random distribution for the Metropolis acceptance rule:
   unif = np.random.uniform(0, 1, (chainlen, nchains))
 
@@ -376,59 +782,271 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
   nextp     = np.copy(params)    # Proposed parameters
   nextchisq = np.zeros(nchains)  # Chi square of nextp 
 
+  # Metrics since the last intermediate step:
+  nevals     = 0            # Number of model evaluations
+  naccepted  = 0            # Number of accepted proposals
+  tinterval  = time.time()  # Starting time
+  if mpi:
+    nworkers = nwork
+  else:
+    nworkers = 1
+
   # Start loop:
   mu.msg(1, "Start MCMC chains  ({:s})".format(time.ctime()), log)
   for i in np.arange(chainlen):
-    # Proposal jump:
-    if   walk == "mrw":
-      jump = mstep[i]
-    elif walk == "demc":
-      jump = (gamma  * (params[r1[:,i]]-params[r2[:,i]])[:,ifree] +
-              gamma2 * support[i]                                 )
-    # Propose next point:
-    nextp[:,ifree] = params[:,ifree] + jump
-
-    # Check it's within boundaries: 
-    outpars = np.asarray(((nextp < pmin) | (nextp > pmax))[:,ifree])
-    outflag  = np.any(outpars, axis=1)
-    outbounds += ((nextp < pmin) | (nextp > pmax))[:,ifree]
-    for p in ifree:
-      nextp[np.where(nextp[:, p] < pmin[p]), p] = pmin[p]
-      nextp[np.where(nextp[:, p] > pmax[p]), p] = pmax[p]
+    # End of the coarse burn-in, re-evaluate the chains with func:
+    if coarse and i == burnin:
+      mu.msg(1, "Re-evaluate the chains chi-square with the full-resolution "
+                "model.", log)
+      if mpi:
+        models = mpieval(comm, np.repeat(params[:,0:mpars], nrep, 0), nwork,
+                         ndata)[::nrep]
+      else:
+        for c in np.arange(nchains):
+          fargs = [params[c, 0:mpars]] + indparams
+          models[c] = func(*fargs)
+      for c in np.arange(nchains):
+        if wlike:
+          currchisq[c], c2[c] = dwt.wlikelihood(params[c,mpars:],
+                 models[c]-data, (params[c]-prior)[iprior],
+                 priorlow[iprior], priorlow[iprior])
+        else:
+          currchisq[c], c2[c] = cs.chisq(models[c], data, uncert,
+                 (params[c]-prior)[iprior], priorlow[iprior], priorlow[iprior])
+      # The coarse-model best fit is not comparable, reset it:
+      bestchisq = np.amin(c2)
+      bestp     = np.copy(params[np.argmin(c2)])
+      bestmodel = np.copy(models[np.argmin(c2)])
+      if savemodel is not None:
+        allmodel.update(models)
+      # The emulator learned coarsefunc, retrain it with func:
+      if surrogate is not None and strain:
+        surrogate = em.Emulator(params[0,imodel], stepsize[imodel], imodel)
+        surrogate.update(params[:,0:mpars], models)
+        strained = False
 
-    # Update shared parameters:
-    for s in ishare:
-      nextp[:, s] = nextp[:, -int(stepsize[s])-1]
+    if mtm:
+      # Multiple-try step, draw ntry candidates about each chain:
+      if adapt:
+        mchol = propscale * propchol
+      else:
+        mchol = None
+      tries = np.repeat(params[:,np.newaxis], ntry, 1)
+      tries[:,:,ifree] += mtmjumps(walk, params, ntry, ifree, stepsize,
+                                   gamma, gamma2, mchol)
+      tchisq, tc2, tmodels = mtmeval(tries, outbounds, pmin, pmax, ifree,
+               ishare, stepsize, mpars, (coarse and i < burnin), func,
+               coarsefunc, indparams, data, uncert, prior, priorlow, iprior,
+               wlike, comm)
+      # Select one candidate with probability proportional to its posterior:
+      tmin  = np.amin(tchisq, axis=1)
+      valid = np.isfinite(tmin)  # At least one in-bound candidate
+      tmin[~valid] = 0.0
+      tweight = np.exp(-0.5*(tchisq - tmin[:,np.newaxis]))
+      tsum = np.sum(tweight, axis=1)
+      tcum = np.cumsum(tweight, axis=1) / np.amax((tsum, np.ones(nchains)), 0)
+      isel = np.amin((np.sum(tcum < np.random.uniform(0, 1, (nchains,1)), 1),
+                      np.tile(ntry-1, nchains)), 0)
+      ichain = np.arange(nchains)
+      nextp     = np.copy(tries  [ichain, isel])
+      nextchisq = np.copy(tchisq [ichain, isel])
+      c2        = np.copy(tc2    [ichain, isel])
+      models    = np.copy(tmodels[ichain, isel])
 
-    # Evaluate the models for the proposed parameters:
-    if mpi:
-      mu.comm_scatter(comm, nextp[:,0:mpars].flatten(), MPI.DOUBLE)
-      mu.comm_gather(comm, mpimodels)
-      models = np.reshape(mpimodels, (nchains, ndata))
+      # Reference set about the selected candidates (the last one is the
+      # current state of the chain):
+      refs = np.repeat(nextp[:,np.newaxis], ntry, 1)
+      refs[:,:-1][:,:,ifree] += mtmjumps(walk, params, ntry-1, ifree,
+                                         stepsize, gamma, gamma2, mchol)
+      refs[:,-1] = params
+      rchisq = mtmeval(refs, None, pmin, pmax, ifree, ishare, stepsize,
+               mpars, (coarse and i < burnin), func, coarsefunc, indparams,
+               data, uncert, prior, priorlow, iprior, wlike, comm,
+               skiplast=True)[0]
+      nevals += np.sum(np.isfinite(tchisq)) + np.sum(np.isfinite(rchisq[:,:-1]))
+      rchisq[:,-1] = currchisq
+
+      # Acceptance ratio of the multiple-try Metropolis (normalize the
+      # weights by the lowest chi-square of both sets):
+      cmin = np.amin(np.hstack((tchisq, rchisq)), axis=1)[:,np.newaxis]
+      accept = np.zeros(nchains)
+      accept[valid] = (np.sum(np.exp(-0.5*(tchisq-cmin)), axis=1)[valid] /
+                       np.sum(np.exp(-0.5*(rchisq-cmin)), axis=1)[valid])
+      nextchisq[~valid] = np.inf
+      c2       [~valid] = np.inf
+    elif stretch:
+      # Stretch move, update each half of the ensemble against the other:
+      sacc = np.zeros(nchains, bool)
+      for h in np.arange(2):
+        iupd = np.arange(h*nwork, (h+1)*nwork)
+        ioth = np.arange((1-h)*nwork, (2-h)*nwork)
+        partner = ioth[np.random.randint(0, nwork, nwork)]
+        z = ((stretchscale-1.0)*np.random.uniform(0, 1, nwork) + 1)**2 / \
+            stretchscale
+        prop = np.copy(params[iupd])
+        prop[:,ifree] = (params[partner][:,ifree] + z[:,np.newaxis] *
+                         (params[iupd][:,ifree] - params[partner][:,ifree]))
+        # Check it's within boundaries:
+        outflag = np.any(((prop < pmin) | (prop > pmax))[:,ifree], axis=1)
+        outbounds[iupd] += ((prop < pmin) | (prop > pmax))[:,ifree]
+        for s in ishare:
+          prop[:, s] = prop[:, -int(stepsize[s])-1]
+
+        # Evaluate the models for the proposed parameters (one batch):
+        if mpi:
+          sendp = np.copy(prop[:,0:mpars])
+          sendp[outflag] = np.nan  # Flag the workers to skip these
+          pmodels = mpieval(comm, sendp, nwork, ndata)
+        else:
+          pmodels = np.zeros((nwork, ndata))
+          for k in np.where(~outflag)[0]:
+            fargs = [prop[k, 0:mpars]] + indparams
+            if coarse and i < burnin:
+              pmodels[k] = coarsefunc(*fargs)
+            else:
+              pmodels[k] = func(*fargs)
+        pchisq = np.tile(np.inf, nwork)
+        pc2    = np.tile(np.inf, nwork)
+        for k in np.where(~outflag)[0]:
+          if wlike:
+            pchisq[k], pc2[k] = dwt.wlikelihood(prop[k,mpars:],
+                 pmodels[k]-data, (prop[k]-prior)[iprior], priorlow[iprior],
+                 priorlow[iprior])
+          else:
+            pchisq[k], pc2[k] = cs.chisq(pmodels[k], data, uncert,
+                 (prop[k]-prior)[iprior], priorlow[iprior], priorlow[iprior])
+
+        nevals += np.sum(~outflag)
+        # Acceptance rule of the stretch move:
+        hacc = (z**(nfree-1) * np.exp(0.5*(currchisq[iupd] - pchisq)) >=
+                unif[i, iupd])
+        params   [iupd[hacc]] = prop   [hacc]
+        currchisq[iupd[hacc]] = pchisq [hacc]
+        models   [iupd[hacc]] = pmodels[hacc]
+        c2[iupd] = np.where(hacc, pc2, np.inf)
+        sacc[iupd] = hacc
+      # The chains are already updated:
+      nextp     = np.copy(params)
+      nextchisq = np.copy(currchisq)
+      accept    = np.where(sacc, np.inf, -1.0)
     else:
-      for c in np.where(~outflag)[0]:
-        fargs = [nextp[c, 0:mpars]] + indparams  # List of function's arguments
-        models[c] = func(*fargs)
+      # Proposal jump:
+      if   walk == "mrw":
+        if adapt:  # Correlated jump (normalize mstep to a standard normal):
+          jump = propscale * np.dot(mstep[i]/stepsize[ifree], propchol.T)
+        else:
+          jump = mstep[i]
+      elif walk == "demc":
+        jump = (gamma  * (params[r1[:,i]]-params[r2[:,i]])[:,ifree] +
+                gamma2 * support[i]                                 )
+      # Move only the parameters of one block:
+      if blockwise:
+        jump = jump * blockjump[iblock[i]]
+      # Propose next point:
+      nextp[:,ifree] = params[:,ifree] + jump
 
-    # Calculate chisq:
-    for c in np.where(~outflag)[0]:
-      if wlike: # Wavelet-based likelihood (chi-squared, actually)
-        nextchisq[c], c2[c] = dwt.wlikelihood(nextp[c,mpars:], models[c]-data,
-                 (nextp[c]-prior)[iprior], priorlow[iprior], priorlow[iprior])
+      # Check it's within boundaries: 
+      outpars = np.asarray(((nextp < pmin) | (nextp > pmax))[:,ifree])
+      outflag  = np.any(outpars, axis=1)
+      outbounds += ((nextp < pmin) | (nextp > pmax))[:,ifree]
+      for p in ifree:
+        nextp[np.where(nextp[:, p] < pmin[p]), p] = pmin[p]
+        nextp[np.where(nextp[:, p] > pmax[p]), p] = pmax[p]
+
+      # Update shared parameters:
+      for s in ishare:
+        nextp[:, s] = nextp[:, -int(stepsize[s])-1]
+
+      # First stage of the delayed acceptance, screen with the surrogate:
+      screened = np.copy(outflag)
+      if surrogate is not None and strained:
+        for c in np.where(~outflag)[0]:
+          smodel = surrogate(*([nextp[c, 0:mpars]] + indparams))
+          snextchisq[c] = cs.chisq(smodel, data, uncert,
+              (nextp[c]-prior)[iprior], priorlow[iprior], priorlow[iprior])[0]
+        saccept = np.exp(0.5 * (scurrchisq - snextchisq))
+        screened |= saccept < sunif[i]
+        nscreened += np.sum(screened & ~outflag)
+        nproposed += np.sum(~outflag)
+
+      # Evaluate the models for the proposed parameters:
+      if mpi:
+        sendp = np.copy(nextp[:,0:mpars])
+        if surrogate is not None:
+          sendp[screened] = np.nan  # Flag the workers to skip these
+        mu.comm_scatter(comm, sendp.flatten(), MPI.DOUBLE)
+        mu.comm_gather(comm, mpimodels)
+        models = np.reshape(mpimodels, (nchains, ndata))
       else:
-        nextchisq[c], c2[c] = cs.chisq(models[c], data, uncert,
-                 (nextp[c]-prior)[iprior], priorlow[iprior], priorlow[iprior])
+        for c in np.where(~screened)[0]:
+          fargs = [nextp[c, 0:mpars]] + indparams  # List of function's arguments
+          if coarse and i < burnin:
+            models[c] = coarsefunc(*fargs)
+          else:
+            models[c] = func(*fargs)
+
+      # Calculate chisq:
+      nevals += np.sum(~screened)
+      for c in np.where(~screened)[0]:
+        if wlike: # Wavelet-based likelihood (chi-squared, actually)
+          nextchisq[c], c2[c] = dwt.wlikelihood(nextp[c,mpars:], models[c]-data,
+                   (nextp[c]-prior)[iprior], priorlow[iprior], priorlow[iprior])
+        else:
+          nextchisq[c], c2[c] = cs.chisq(models[c], data, uncert,
+                   (nextp[c]-prior)[iprior], priorlow[iprior], priorlow[iprior])
 
-    # Reject out-of-bound jumps:
-    nextchisq[np.where(outflag)] = np.inf
-    # Evaluate which steps are accepted and update values:
-    accept = np.exp(0.5 * (currchisq - nextchisq))
+      # Reject out-of-bound jumps:
+      nextchisq[np.where(outflag)] = np.inf
+      # Evaluate which steps are accepted and update values:
+      accept = np.exp(0.5 * (currchisq - nextchisq))
+      if surrogate is not None:
+        # Second stage, correct for the surrogate screening:
+        if strained:
+          accept *= np.exp(0.5 * (snextchisq - scurrchisq))
+        accept[screened] = 0.0
+        c2    [screened] = np.inf
     accepted = accept >= unif[i]
+    naccepted += np.sum(accepted)
     if i >= burnin:
       numaccept += accepted
     # Update params and chi square:
     params   [accepted] = nextp    [accepted]
     currchisq[accepted] = nextchisq[accepted]
+    if surrogate is not None:
+      scurrchisq[accepted] = snextchisq[accepted]
+      # Train the emulator with the full-model evaluations (after the
+      # burn-in, only until its first fit):
+      if strain and (i < burnin or not strained):
+        surrogate.update(nextp[~screened, 0:mpars], models[~screened])
+        if (i+1) % intsteps == 0 or not strained:
+          strained = surrogate.fit()
+          # Re-evaluate the surrogate chi-square with the updated emulator:
+          if strained:
+            for c in np.arange(nchains):
+              smodel = surrogate(params[c, 0:mpars])
+              scurrchisq[c] = cs.chisq(smodel, data, uncert,
+                                       (params[c]-prior)[iprior],
+                                       priorlow[iprior], priorlow[iprior])[0]
+
+    # Update the adaptive proposal with the current state of the chains:
+    if adapt and i < burnin:
+      asum   += np.sum(params[:,ifree], axis=0)
+      asumsq += np.dot(params[:,ifree].T, params[:,ifree])
+      nadapt += nchains
+      # Robbins-Monro update of the scale toward the target acceptance rate:
+      propscale *= np.exp((np.mean(accepted) - accrate) / np.sqrt(i+1.0))
+      if nadapt > 2*nfree:
+        amean = asum/nadapt
+        acov  = (asumsq - nadapt*np.outer(amean, amean)) / (nadapt-1.0)
+        # Optimal scaling, plus a small term to keep it positive definite:
+        propcov = (2.38**2/nfree) * acov + 1e-10*np.diag(stepsize[ifree]**2)
+        try:
+          propchol = np.linalg.cholesky(propcov)
+        except np.linalg.LinAlgError:
+          pass  # Keep the previous proposal
+      if i == burnin-1:
+        mu.msg(1, "Adaptive proposal frozen after burn-in (scale factor: "
+                  "{:.4g}).".format(propscale), log)
 
     # Check lowest chi-square:
     if np.amin(c2) < bestchisq:
@@ -438,10 +1056,35 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
 
     # Store current iteration values:
     allparams[:,:,i+nold] = params[:, ifree]
+    if autoburn:
+      allchisq[:,i] = currchisq
     if savemodel is not None:
-      models[~accepted] = allmodel[~accepted,:,i+nold-1]
-      allmodel[:,:,i+nold] = models
-  
+      allmodel.record(i+nold, accepted, models)
+
+    # Reseed stuck chains during burn-in:
+    if reseed and i < burnin and ((i+1) % intsteps == 0) and nchains > 2:
+      medchisq = np.median(currchisq)
+      madchisq = 1.4826 * np.median(np.abs(currchisq - medchisq))
+      stuck = currchisq - medchisq > reseedthresh * np.amax((madchisq, 1.0))
+      good  = np.where(~stuck)[0]
+      for c in np.where(stuck)[0]:
+        donor = good[np.random.randint(len(good))]
+        mu.msg(1, "Reseeding stuck chain {:d} (chisq={:.4f}) from chain {:d} "
+                  "(chisq={:.4f}).".format(c, currchisq[c], donor,
+                                           currchisq[donor]), log)
+        params   [c] = params   [donor]
+        currchisq[c] = currchisq[donor]
+        allparams[c,:,i+nold] = allparams[donor,:,i+nold]
+        models   [c] = models   [donor]
+        c2       [c] = c2       [donor]
+        if surrogate is not None:
+          scurrchisq[c] = scurrchisq[donor]
+        if autoburn:
+          allchisq[c,i] = allchisq[donor,i]
+        if savemodel is not None:
+          allmodel.copy(i+nold, c, donor)
+        nreseed += 1
+
     # Print intermediate info:
     if ((i+1) % intsteps == 0) and (i > 0):
       mu.progressbar((i+1.0)/chainlen, log)
@@ -450,52 +1093,90 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
       mu.msg(1, "Best Parameters:   (chisq={:.4f})\n{:s}".
                  format(bestchisq, str(bestp)), log)
 
+      # Automatic burn-in estimate:
+      if autoburn:
+        burncut, burned = ab.autoburn(allchisq[:,0:i+1],
+                                      allparams[:,:,0:i+1], minburn=burnin)
+        mu.msg(1, "Automatic burn-in estimate: {:d} iterations{:s}.".
+                  format(burncut, [" (chains not stationary yet)", ""][burned]),
+               log)
+
       # Gelman-Rubin statistic:
-      if grtest and (i+nold) > burnin:
-        psrf = gr.convergetest(allparams[:, :, burnin:i+nold+1:thinning])
+      psrf = None
+      if grtest and (i+nold) > burncut:
+        psrf = gr.convergetest(allparams[:, :, burncut:i+nold+1:thinning])
         mu.msg(1, "Gelman-Rubin statistic for free parameters:\n{:s}".
                   format(psrf), log)
         if np.all(psrf < 1.01):
           mu.msg(1, "All parameters have converged to within 1% of unity.", log)
       # Save current results:
+      tsave = time.time()
       if savefile is not None:
         np.save(savefile, allparams[:,:,0:i+nold])
       if savemodel is not None:
-        np.save(savemodel, allmodel[:,:,0:i+nold])
+        allmodel.save(savemodel, i+nold, compressmodel)
+      tsave = time.time() - tsave
 
-  # Stack together the chains:
-  allstack = allparams[0, :, burnin:]
-  for c in np.arange(1, nchains):
-    allstack = np.hstack((allstack, allparams[c, :, burnin:]))
-  # And the models:
-  if savemodel is not None:
-    modelstack = allmodel[0,:,burnin:]
-    for c in np.arange(1, nchains):
-      modelstack = np.hstack((modelstack, allmodel[c, :, burnin:]))
+      # Write the run metrics:
+      if metrics is not None:
+        elapsed = np.amax((time.time() - tinterval, 1e-12))
+        mu.writemetrics(metrics,
+            {"iteration":             int(i+1),
+             "chainlen":              int(chainlen),
+             "burnin":                bool(i < burnin),
+             "burnin_cut":            int(burncut),
+             "iterations_per_second": intsteps/elapsed,
+             "evaluations_per_second_per_worker":
+                                      nevals/(elapsed*nworkers),
+             "workers":               int(nworkers),
+             "acceptance_rate":       naccepted/float(intsteps*nchains),
+             "best_chisq":            float(bestchisq),
+             "psrf":                  psrf,
+             "checkpoint_latency":    tsave})
+      nevals, naccepted = 0, 0
+      tinterval = time.time()
+
+  # Final automatic burn-in estimate:
+  if autoburn:
+    burncut, burned = ab.autoburn(allchisq, allparams, minburn=burnin)
+    if not burned:
+      mu.warning("The chains did not pass the Geweke-style test, trimming "
+                 "the {:d} iterations before the chi-square stabilized.".
+                 format(burncut), log)
+
+  # Post-burn-in sample of each chain (a view of allparams):
+  posterior = allparams[:, :, burncut:]
 
   # Print out Summary:
   mu.msg(1, "\nFin, MCMC Summary:\n------------------", log)
 
-  nsample   = (chainlen-burnin)*nchains # This sample
-  ntotal    = (nold+chainlen-burnin)*nchains
+  nsample   = (chainlen-burncut)*nchains # This sample
+  ntotal    = (nold+chainlen-burncut)*nchains
   BIC       = bestchisq + nfree*np.log(ndata)
   redchisq  = bestchisq/(ndata-nfree)
   sdr       = np.std(bestmodel-data)
 
   fmtlen = len(str(ntotal))
   mu.msg(1, "Burned in iterations per chain: {:{}d}".
-             format(burnin,   fmtlen), log, 1)
+             format(burncut,  fmtlen), log, 1)
   mu.msg(1, "Number of iterations per chain: {:{}d}".
              format(chainlen, fmtlen), log, 1)
   mu.msg(1, "MCMC sample size:               {:{}d}".
              format(nsample,  fmtlen), log, 1)
   mu.msg(resume, "Total MCMC sample size:         {:{}d}".
              format(ntotal, fmtlen), log, 1)
+  mu.msg(reseed, "Number of reseeded chains:      {:{}d}".
+             format(nreseed, fmtlen), log, 1)
+  if surrogate is not None:
+    mu.msg(1, "Surrogate-screened proposals:   {:{}d} of {:d} ({:.2f}% of "
+              "the full-model evaluations avoided)".format(nscreened, fmtlen,
+               nproposed, nscreened*100.0/np.amax((nproposed,1))), log, 1)
   mu.msg(1, "Acceptance rate:   {:.2f}%\n ".
-             format(np.sum(numaccept)*100.0/nsample), log, 1)
+             format(np.sum(numaccept)*100.0/((chainlen-burnin)*nchains)),
+         log, 1)
 
-  meanp   = np.mean(allstack, axis=1) # Parameters mean
-  uncertp = np.std(allstack,  axis=1) # Parameter standard deviation
+  meanp   = np.mean(posterior, axis=(0,2)) # Parameters mean
+  uncertp = np.std(posterior,  axis=(0,2)) # Parameter standard deviation
   mu.msg(1, "Best-fit params    Uncertainties   Signal/Noise       Sample "
             "Mean", log, 1)
   for i in np.arange(nfree):
@@ -538,13 +1219,16 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
         fname = savefile[savefile.rfind("/")+1:savefile.rfind(".")]
     else:
       fname = "MCMC"
-    # Trace plot:
-    mp.trace(allstack,     thinning=thinning, savefile=fname+"_trace.png",
-             sep=np.size(allstack[0])/nchains)
-    # Pairwise posteriors:
-    mp.pairwise(allstack,  thinning=thinning, savefile=fname+"_pairwise.png")
-    # Histograms:
-    mp.histogram(allstack, thinning=thinning, savefile=fname+"_posterior.png")
+    # Trace plot, pairwise posteriors, and histograms (from the reduced
+    # sample, cached next to the plots):
+    # (do not fork processes from an MPI master):
+    if mpi:
+      nplot = 1
+    else:
+      nplot = 3
+    mp.plots(posterior, fname, thinning=thinning,
+             sep=np.shape(posterior)[2], nproc=nplot,
+             cachefile=fname+"_plotdata.npz")
     # RMS vs bin size:
     if rms:
       mp.RMS(bs, rms, stderr, rmse, binstep=len(bs)/500+1,
@@ -557,6 +1241,11 @@ def mcmc(data,         uncert=None,      func=None,     indparams=[],
   if savefile is not None:
     np.save(savefile,  allparams)
   if savemodel is not None:
-    np.save(savemodel, allmodel)
+    allmodel.save(savemodel, compress=compressmodel)
+
+  # Stack together the chains:
+  allstack = posterior[0]
+  for c in np.arange(1, nchains):
+    allstack = np.hstack((allstack, posterior[c]))
 
   return allstack, bestp
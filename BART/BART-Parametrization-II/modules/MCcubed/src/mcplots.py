@@ -57,8 +57,187 @@ sys.path.append(os.path.dirname(os.path.realpath(__file__))+'/cfuncs/lib')
 import binarray as ba
 
 
+def _chunks(blocks, step, chunksize):
+  """
+  Iterate over every step-th sample of the blocks (stacked one after
+  another along the sampling axis), in chunks of up to chunksize samples.
+  """
+  offset = 0  # Index in the stacked sample of the first block sample
+  for block in blocks:
+    niter = np.shape(block)[1]
+    first = (-offset) % step
+    for start in np.arange(first, niter, chunksize*step):
+      yield np.asarray(block[:, start:start+chunksize*step:step])
+    offset += niter
+
+
+def reducesample(allparams, thinning=1, nbins=20, maxpoints=20000,
+                 chunksize=100000, cachefile=None):
+  """
+  Reduce an MCMC sample into the 1D and 2D histograms and the decimated
+  traces plotted by trace, pairwise, and histogram.  The sample is
+  processed in chunks (two streaming passes), so it can be a
+  memory-mapped array (e.g., np.load(savefile, mmap_mode='r')).
+
+  Parameters:
+  -----------
+  allparams: 2D or 3D ndarray
+     An MCMC sampling array with dimension (number of parameters,
+     sampling length), or the per-chain array with dimension (number of
+     chains, number of parameters, chain length), processed as if the
+     chains were stacked one after another (without copying them).
+  thinning: Integer
+     Thinning factor (use every thinning-th value).
+  nbins: Integer
+     Number of histogram bins per parameter.
+  maxpoints: Integer
+     Maximum number of points of the decimated traces.
+  chunksize: Integer
+     Number of (thinned) samples processed at a time.
+  cachefile: String
+     If not None, .npz file where to store the reduced data.  If the file
+     exists and matches the sample (size, thinning, nbins, and decimated
+     trace), load the reduced data from it instead.
+
+  Returns:
+  --------
+  pdata: Dictionary
+     The reduced data: 'edges' (npars, nbins+1) histogram bin edges,
+     'hist1d' (npars, nbins) and 'hist2d' (npars, npars, nbins, nbins)
+     histogram counts, 'trace' (npars, ntrace) decimated sample with
+     'tstep' the decimation step, and 'niter', 'thinning', and 'nbins'.
+  """
+  if np.ndim(allparams) == 3:
+    blocks = [allparams[c] for c in np.arange(np.shape(allparams)[0])]
+  else:
+    blocks = [allparams]
+  npars = np.shape(allparams)[-2]
+  niter = int(np.sum([np.shape(block)[1] for block in blocks]))
+  nthin = (niter - 1)/thinning + 1  # Number of thinned samples
+
+  # Decimated traces:
+  tstep = thinning * int(np.ceil(nthin/float(maxpoints)))
+  trace = np.hstack(list(_chunks(blocks, tstep, chunksize)))
+
+  # Load the reduced data from the cache file:
+  if cachefile is not None and os.path.isfile(cachefile):
+    cache = np.load(cachefile)
+    pdata = dict([(key, cache[key]) for key in cache.files])
+    cache.close()
+    if (pdata['niter'] == niter and pdata['thinning'] == thinning and
+        pdata['nbins'] == nbins and np.array_equal(pdata['trace'], trace)):
+      return pdata
+
+  # First pass, the parameter ranges:
+  pmin = np.tile( np.inf, npars)
+  pmax = np.tile(-np.inf, npars)
+  for chunk in _chunks(blocks, thinning, chunksize):
+    pmin = np.amin((pmin, np.amin(chunk, axis=1)), axis=0)
+    pmax = np.amax((pmax, np.amax(chunk, axis=1)), axis=0)
+  flat = pmax <= pmin
+  pmin[flat] -= 0.5
+  pmax[flat] += 0.5
+  edges = np.zeros((npars, nbins+1))
+  for i in np.arange(npars):
+    edges[i] = np.linspace(pmin[i], pmax[i], nbins+1)
+
+  # Second pass, accumulate the histograms:
+  hist1d = np.zeros((npars, nbins))
+  hist2d = np.zeros((npars, npars, nbins, nbins))
+  for chunk in _chunks(blocks, thinning, chunksize):
+    for i in np.arange(npars):
+      hist1d[i] += np.histogram(chunk[i], edges[i])[0]
+      for j in np.arange(i+1, npars):
+        hist2d[i,j] += np.histogram2d(chunk[i], chunk[j],
+                                      [edges[i], edges[j]])[0]
+
+  pdata = {'edges':edges, 'hist1d':hist1d, 'hist2d':hist2d, 'trace':trace,
+           'tstep':tstep, 'niter':niter, 'thinning':thinning, 'nbins':nbins}
+  if cachefile is not None:
+    np.savez(cachefile, **pdata)
+  return pdata
+
+
+def render(plotname, pdata, savefile, kwargs):
+  """
+  Render one of the trace, pairwise, or histogram figures from reduced
+  data into a file (non-interactive backend).  Used by plots to render
+  the figures in parallel processes.
+
+  Parameters:
+  -----------
+  plotname: String
+     Name of the plotting function ('trace', 'pairwise', or 'histogram').
+  pdata: Dictionary
+     Reduced data (see reducesample).
+  savefile: String
+     Name of file to save the plot.
+  kwargs: Dictionary
+     Additional arguments of the plotting function.
+  """
+  plt.switch_backend("Agg")
+  plotfunc = {'trace':trace, 'pairwise':pairwise,
+              'histogram':histogram}[plotname]
+  plotfunc(None, savefile=savefile, pdata=pdata, **kwargs)
+  plt.close("all")
+
+
+def plots(allparams, fname, thinning=1, parname=None, sep=None, nproc=1,
+          cachefile=None):
+  """
+  Reduce an MCMC sample once, and make the trace, pairwise, and marginal
+  posterior figures.
+
+  Parameters:
+  -----------
+  allparams: 2D or 3D ndarray
+     An MCMC sampling array with dimension (number of parameters,
+     sampling length), or the per-chain array (see reducesample).
+  fname: String
+     Root name of the output files (fname+'_trace.png',
+     fname+'_pairwise.png', fname+'_posterior.png').
+  thinning: Integer
+     Thinning factor for plotting (plot every thinning-th value).
+  parname: Iterable (strings)
+     List of label names for parameters.  If None use ['P0', 'P1', ...].
+  sep: Integer
+     Number of samples per chain (see trace).
+  nproc: Integer
+     Number of processes to render the figures in parallel.
+  cachefile: String
+     File to cache the reduced data (see reducesample).
+
+  Returns:
+  --------
+  pdata: Dictionary
+     Reduced data (see reducesample).
+  """
+  pdata = reducesample(allparams, thinning, cachefile=cachefile)
+  jobs = [("trace",     fname+"_trace.png",     {'sep':sep}),
+          ("pairwise",  fname+"_pairwise.png",  {}),
+          ("histogram", fname+"_posterior.png", {})]
+  for job in jobs:
+    job[2].update({'thinning':thinning, 'parname':parname})
+
+  if nproc > 1:
+    import multiprocessing as mpr
+    pool = mpr.Pool(np.amin((nproc, len(jobs))))
+    results = [pool.apply_async(render, (plotname, pdata, savefile, kwargs))
+               for plotname, savefile, kwargs in jobs]
+    for result in results:
+      result.get()
+    pool.close()
+    pool.join()
+  else:
+    for plotname, savefile, kwargs in jobs:
+      plotfunc = {'trace':trace, 'pairwise':pairwise,
+                  'histogram':histogram}[plotname]
+      plotfunc(None, savefile=savefile, pdata=pdata, **kwargs)
+  return pdata
+
+
 def trace(allparams, title=None, parname=None, thinning=1,
-          fignum=-10, savefile=None, fmt=".", sep=None):
+          fignum=-10, savefile=None, fmt=".", sep=None, pdata=None):
   """
   Plot parameter trace MCMC sampling
 
@@ -82,13 +261,18 @@ def trace(allparams, title=None, parname=None, thinning=1,
   sep: Integer
      Number of samples per chain. If not None, draw a vertical line
      to mark the separation between the chains.
+  pdata: Dictionary
+     Reduced data (see reducesample).  If not None, allparams is ignored.
 
   Uncredited Developers:
   ----------------------
   - Kevin Stevenson (UCF)
   """
+  # Reduce the sample (decimated traces):
+  if pdata is None:
+    pdata = reducesample(allparams, thinning)
   # Get number of parameters and length of chain:
-  npars, niter = np.shape(allparams)
+  npars, niter = len(pdata['trace']), int(pdata['niter'])
   fs = 14
 
   # Set default parameter names:
@@ -99,7 +283,9 @@ def trace(allparams, title=None, parname=None, thinning=1,
       parname[i] = "P" + str(i).zfill(namelen-1)
 
   # Get location for chains separations:
-  xmax = len(allparams[0,0::thinning])
+  xmax = (niter - 1)/thinning + 1
+  # Location of the decimated-trace points (in thinned iterations):
+  xtrace = np.arange(len(pdata['trace'][0])) * pdata['tstep']/float(thinning)
   if sep is not None:
     xsep = np.arange(sep/thinning, xmax, sep/thinning)
 
@@ -114,7 +300,7 @@ def trace(allparams, title=None, parname=None, thinning=1,
 
   for i in np.arange(npars):
     a = plt.subplot(npars, 1, i+1)
-    plt.plot(allparams[i, 0::thinning], fmt)
+    plt.plot(xtrace, pdata['trace'][i], fmt)
     yran = a.get_ylim()
     if sep is not None:
       plt.vlines(xsep, yran[0], yran[1], "0.3")
@@ -136,7 +322,7 @@ def trace(allparams, title=None, parname=None, thinning=1,
 
 
 def pairwise(allparams, title=None, parname=None, thinning=1,
-             fignum=-11, savefile=None, style="hist"):
+             fignum=-11, savefile=None, style="hist", pdata=None):
   """
   Plot parameter pairwise posterior distributions
 
@@ -157,15 +343,20 @@ def pairwise(allparams, title=None, parname=None, thinning=1,
      If not None, name of file to save the plot.
   style: String
      Choose between 'hist' to plot as histogram, or 'points' to plot
-     the individual points.
+     the individual points (of the decimated sample).
+  pdata: Dictionary
+     Reduced data (see reducesample).  If not None, allparams is ignored.
  
   Uncredited Developers:
   ----------------------
   - Kevin Stevenson (UCF)
   - Ryan Hardy (UCF)
   """
-  # Get number of parameters and length of chain:
-  npars, niter = np.shape(allparams)
+  # Reduce the sample (2D histograms):
+  if pdata is None:
+    pdata = reducesample(allparams, thinning)
+  # Get number of parameters:
+  npars = len(pdata['trace'])
 
   # Don't plot if there are no pairs:
   if npars == 1:
@@ -212,15 +403,15 @@ def pairwise(allparams, title=None, parname=None, thinning=1,
           a = plt.xticks(visible=False)
         # The plot:
         if style=="hist":
-          hist2d, xedges, yedges = np.histogram2d(allparams[i, 0::thinning],
-                                   allparams[j, 0::thinning], 20, normed=False)
+          hist2d = np.copy(pdata['hist2d'][i,j])
+          xedges, yedges = pdata['edges'][i], pdata['edges'][j]
           vmin = 0.0
           hist2d[np.where(hist2d == 0)] = np.nan
           a = plt.imshow(hist2d.T, extent=(xedges[0], xedges[-1], yedges[0],
                          yedges[-1]), cmap=palette, vmin=vmin, aspect='auto',
                          origin='lower', interpolation='bilinear')
         elif style=="points":
-          a = plt.plot(allparams[i], allparams[j], ",")
+          a = plt.plot(pdata['trace'][i], pdata['trace'][j], ",")
       h += 1
   # The colorbar:
   if style == "hist":
@@ -243,7 +434,7 @@ def pairwise(allparams, title=None, parname=None, thinning=1,
 
 
 def histogram(allparams, title=None, parname=None, thinning=1,
-              fignum=-12, savefile=None):
+              fignum=-12, savefile=None, pdata=None):
   """
   Plot parameter marginal posterior distributions
 
@@ -262,13 +453,18 @@ def histogram(allparams, title=None, parname=None, thinning=1,
      The figure number.
   savefile: Boolean
      If not None, name of file to save the plot.
+  pdata: Dictionary
+     Reduced data (see reducesample).  If not None, allparams is ignored.
 
   Uncredited Developers:
   ----------------------
   - Kevin Stevenson (UCF)
   """
-  # Get number of parameters and length of chain:
-  npars, niter = np.shape(allparams)
+  # Reduce the sample (1D histograms):
+  if pdata is None:
+    pdata = reducesample(allparams, thinning)
+  # Get number of parameters:
+  npars = len(pdata['trace'])
   fs = 14  # Fontsize
 
   # Set default parameter names:
@@ -314,7 +510,8 @@ def histogram(allparams, title=None, parname=None, thinning=1,
     else:
       a = plt.yticks(visible=False)      
     plt.xlabel(parname[i], size=fs)
-    a = plt.hist(allparams[i,0::thinning], 20, normed=False)
+    edges = pdata['edges'][i]
+    a = plt.hist(edges[:-1], edges, weights=pdata['hist1d'][i])
     maxylim = np.amax((maxylim, ax.get_ylim()[1]))
 
   # Set uniform height:
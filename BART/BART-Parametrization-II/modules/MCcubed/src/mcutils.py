@@ -48,7 +48,7 @@
 # Thank you for using MC3!
 # ******************************* END LICENSE *******************************
 
-import os, sys, time, traceback, textwrap, struct
+import os, sys, time, traceback, textwrap, struct, json
 import numpy as np
 from numpy import array
 
@@ -60,6 +60,10 @@ except:
 # Warning separator:
 sep = 70*":"
 
+# Parsed text files (see read2array), keyed by path, modification time,
+# size, and shape mode:
+readcache = {}
+
 def parray(string):
   """
   Convert a string containin a list of white-space-separated (and/or
@@ -166,45 +170,66 @@ def read2array(filename, square=True):
   array: 2D ndarray or list
      See parameters description.
 
+  Notes:
+  ------
+  The parsed values are cached (see readcache) until the file is
+  modified, so that reading again the same file (e.g., for the params,
+  pmin, pmax, stepsize, and prior arrays) does not parse it again.
+  The function returns copies of the cached arrays.
+
   Modification History:
   ---------------------
   2014-04-17  patricio  Initial implementation.
   """
+  stat = os.stat(filename)
+  key  = (os.path.realpath(filename), stat.st_mtime, stat.st_size, square)
+
+  if key not in readcache:
+    # Open and read the file:
+    f = open(filename, "r")
+    lines = f.readlines()
+    f.close()
+
+    # Remove comments and empty lines:
+    lines = [line for line in lines
+             if not (line.strip().startswith('#') or line.strip() == '')]
+    nlines = len(lines)
+
+    # Extract values:
+    if square:
+      # Parse all values at once:
+      ncolumns = len(lines[0].split())
+      values = np.fromstring(" ".join(lines), np.double, sep=" ")
+      if np.size(values) != nlines*ncolumns:
+        error("Not all lines in file '{:s}' have {:d} values.".
+               format(filename, ncolumns))
+      array = np.transpose(np.reshape(values, (nlines, ncolumns)))
+
+    else:
+      array = []
+      for i in np.arange(nlines):
+        values = lines[i].strip().split()
+        if len(values) > 1:
+          array.append(np.asarray(values, np.double))
+        else:
+          array.append(np.double(values[0]))
+
+    # Keep only the latest version of each file:
+    for oldkey in list(readcache.keys()):
+      if oldkey[0] == key[0] and oldkey[3] == square:
+        del readcache[oldkey]
+    readcache[key] = array
 
-  # Open and read the file:
-  f = open(filename, "r")
-  lines = f.readlines()
-  f.close()
-
-  # Remove comments and empty lines:
-  nlines = len(lines)
-  for i in np.arange(nlines, 0, -1):
-    line = lines[i-1].strip()
-    if line.startswith('#') or line == '':
-      dummy = lines.pop(i-1)
-
-  # Re-count number of lines:
-  nlines = len(lines)
-
-  # Extract values:
   if square:
-    ncolumns = len(lines[0].split())
-    array = np.zeros((nlines, ncolumns), np.double)
-    for i in np.arange(nlines):
-      array[i] = lines[i].strip().split()
-    array = np.transpose(array)
-
-  else:
-    array = []
-    for i in np.arange(nlines):
-      values = lines[i].strip().split()
-      if len(values) > 1:
-        array.append(np.asarray(lines[i].strip().split(), np.double))
-      else:
-        array.append(np.double(values[0]))
+    return np.copy(readcache[key])
+  return [np.copy(value) if isinstance(value, np.ndarray) else value
+          for value in readcache[key]]
 
-  return array
 
+# Binary-container signature, version, and data alignment (bytes):
+binmagic   = "MC3BIN"
+binversion = 1
+binalign   = 64
 
 def writebin(data, filename):
   """
@@ -220,10 +245,12 @@ def writebin(data, filename):
 
   Notes:
   ------
-  - Known to work for multi-dimensional ndarrays, scalars, and booleans
-    (at least).
-  - Floating values are stored with double precision, integers are stored
-    as long-integers.
+  - Known to work for multi-dimensional ndarrays, scalars, strings,
+    and booleans.
+  - The file starts with a signature, the format version, and a header
+    with the object type, data type, shape, and offset of each object.
+    The arrays are written as raw (C-ordered) buffers aligned to binalign
+    bytes, such that readbin can memory-map them.
 
   Examples:
   ---------
@@ -238,24 +265,12 @@ def writebin(data, filename):
   ---------------------
   2014-09-12  patricio  Initial implementation.
   """
-
-  f = open(filename, "wb")
   # Number of data structures:
   ndata = len(data)
   # Object type:
   otype = np.zeros(ndata, np.int)
-  # Data type:
-  dtype = np.zeros(ndata, str)
-  # Number of dimensions:
-  ndim  = np.zeros(ndata, np.int)
-  # List of data sizes:
-  dsize = []
-
-  # Storage data-type format:
-  fmt = ["", "d", "l", "s", "?"]
-
-  info  = struct.pack("h", ndata)
-  # Read objects types and dimensions:
+  # Data arrays:
+  arrays = []
   for i in np.arange(ndata):
     # Determine the object type:
     otype[i] = (1*(type(data[i]) is float) + 2*(type(data[i]) is int  ) +
@@ -265,54 +280,35 @@ def writebin(data, filename):
     # TBD: add NoneType
     if otype[i] == 0:
       error("Object type not understood in file: '{:s}'".format(filename))
-    info += struct.pack("h", otype[i])
+    arrays.append(np.asarray(data[i]))
+    if arrays[i].dtype.hasobject:
+      error("Object arrays cannot be stored in file: '{:s}'".format(filename))
 
-    # Determine data dimensions:
-    if   otype[i] < 5:
-      ndim[i] = 1
-    elif otype[i] == 5:
-      ndim[i] = 1  # FIX-ME
-    elif otype[i] == 6:
-      ndim[i] = data[i].ndim
-    info += struct.pack("h", ndim[i])
-
-    # Determine the data type:
-    if otype[i] < 5:
-      dtype[i] = fmt[otype[i]]
-    elif otype[i] ==6:
-      dtype[i] = fmt[1*isinstance(data[i].flat[0], float) +
-                     2*isinstance(data[i].flat[0], int)   +
-                     3*isinstance(data[i].flat[0], str)   +
-                     4*isinstance(data[i].flat[0], bool)  ]
-    info += struct.pack("c", dtype[i])
-
-    # Determine the dimension lengths (shape):
-    if otype[i] < 5:
-      dsize.append([1,])
-    elif otype[i] == 5:
-      shape = []
-      for j in np.arange(ndim[i]):
-        shape.append(len(data[i]))
-      dsize.append(shape)
-    elif otype[i] == 6:
-      dsize.append(np.shape(data[i]))
-    info += struct.pack("{}i".format(ndim[i]), *dsize[i])
+  # Header size and offset of each (aligned) array:
+  offset = []
+  hsize  = struct.calcsize("<6sHI")
+  for i in np.arange(ndata):
+    hsize += struct.calcsize("<hh16s{:d}qq".format(arrays[i].ndim))
+  position = hsize
+  for i in np.arange(ndata):
+    position += (-position) % binalign
+    offset.append(int(position))
+    position += arrays[i].nbytes
 
+  f = open(filename, "wb")
+  f.write(struct.pack("<6sHI", binmagic, binversion, ndata))
+  for i in np.arange(ndata):
+    ndim = arrays[i].ndim
+    f.write(struct.pack("<hh16s{:d}qq".format(ndim), otype[i], ndim,
+                        arrays[i].dtype.str, *(arrays[i].shape+(offset[i],))))
   # Write the data:
   for i in np.arange(ndata):
-    if   otype[i] < 5:
-      info += struct.pack(dtype[i], data[i])
-    elif otype[i] == 5:
-      info += struct.pack("{}{}".format(len(data), dtype[i]), *data[i])
-    elif otype[i] == 6:
-      info += struct.pack("{}{}".format(data[i].size, dtype[i]),
-                                        *list(data[i].flat))
-
-  f.write(info)
+    f.write("\0" * int(offset[i] - f.tell()))
+    arrays[i].tofile(f)
   f.close()
 
 
-def readbin(filename):
+def readbin(filename, mmap=False):
   """
   Read a binary file and extract the data objects.
 
@@ -320,19 +316,93 @@ def readbin(filename):
   -----------
   filename: String
      Path to file containing the data to be read.
+  mmap: Boolean
+     If True, memory-map the arrays instead of reading them (copy-on-write,
+     the file is never modified).
 
   Return:
   -------
   data:  List
      List of objects stored in the file.
 
+  Notes:
+  ------
+  Files written by the first (unversioned) writebin format are read
+  with readbin0.
+
   Example:
   --------
-  >>> import mutils as mu
+  >>> import mcutils as mu
   >>> # Continue example from writebin():
-  >>> v = mu.read2list("delete.me")
+  >>> v = mu.readbin("delete.me")
       [array([0, 1, 2, 3]), array([[ 1.,  1.], [ 1.,  1.]]), True, 42]
 
+  Modification History:
+  ---------------------
+  2014-09-12  patricio  Initial implementation.
+  """
+  f = open(filename, "rb")
+  hsize = struct.calcsize("<6sHI")
+  head  = f.read(hsize)
+  if len(head) < hsize or head[0:len(binmagic)] != binmagic:
+    f.close()
+    return readbin0(filename)
+  magic, version, ndata = struct.unpack("<6sHI", head)
+  if version > binversion:
+    f.close()
+    error("File '{:s}' has binary-format version {:d}, newer than the "
+          "supported version ({:d}).".format(filename, version, binversion))
+
+  # Read the header:
+  otype, dtype, shape, offset = [], [], [], []
+  for i in np.arange(ndata):
+    otype.append(struct.unpack("<h", f.read(2))[0])
+    ndim = struct.unpack("<h", f.read(2))[0]
+    dtype.append(np.dtype(struct.unpack("<16s", f.read(16))[0].rstrip("\0")))
+    values = struct.unpack("<{:d}qq".format(ndim), f.read(8*(ndim+1)))
+    shape.append(tuple(values[0:ndim]))
+    offset.append(values[ndim])
+
+  # Read data:
+  data = []
+  for i in np.arange(ndata):
+    size = int(np.prod(shape[i]))
+    if mmap and otype[i] == 6 and size > 0:
+      d = np.memmap(filename, dtype[i], "c", offset[i], shape[i])
+    else:
+      f.seek(offset[i])
+      d = np.reshape(np.fromfile(f, dtype[i], size), shape[i])
+    if   otype[i] <  5:
+      data.append(d.item())
+    elif otype[i] == 5:
+      data.append(d.tolist())
+    elif otype[i] == 6:
+      data.append(d)
+  f.close()
+
+  return data
+
+
+def readbin0(filename):
+  """
+  Read a binary file written by the first (unversioned) writebin format
+  and extract the data objects.
+
+  Parameters:
+  -----------
+  filename: String
+     Path to file containing the data to be read.
+
+  Return:
+  -------
+  data:  List
+     List of objects stored in the file.
+
+  Example:
+  --------
+  >>> import mcutils as mu
+  >>> v = mu.readbin0("old_file.dat")
+
   Modification History:
   ---------------------
   2014-09-12  patricio  Initial implementation.
@@ -376,6 +446,55 @@ def readbin(filename):
   return data
 
 
+def writemetrics(filename, metrics):
+  """
+  Write a set of run metrics into a machine-readable file.
+
+  Parameters:
+  -----------
+  filename: String
+     Output file.  If the extension is '.prom', (re)write a Prometheus
+     textfile (one gauge per metric, prefixed with 'mc3_', array metrics
+     labeled by index); otherwise append the metrics as one JSON line.
+  metrics: Dictionary
+     Metrics names and values (scalars, booleans, 1D arrays, or None).
+
+  Notes:
+  ------
+  The Prometheus textfile is written to a temporary file and renamed,
+  such that a collector never reads a partially written file.
+  """
+  # Add a time stamp:
+  metrics = dict(metrics)
+  metrics["timestamp"] = time.time()
+  for key in metrics:
+    if isinstance(metrics[key], np.ndarray):
+      metrics[key] = metrics[key].tolist()
+
+  if filename.endswith(".prom"):
+    lines = []
+    for key in sorted(metrics):
+      value = metrics[key]
+      if value is None:
+        continue
+      name = "mc3_" + key
+      lines.append("# TYPE {:s} gauge\n".format(name))
+      if isinstance(value, list):
+        for j in np.arange(len(value)):
+          lines.append('{:s}{{index="{:d}"}} {:.10g}\n'.format(name, j,
+                                                            float(value[j])))
+      else:
+        lines.append("{:s} {:.10g}\n".format(name, float(value)))
+    f = open(filename + ".tmp", "w")
+    f.writelines(lines)
+    f.close()
+    os.rename(filename + ".tmp", filename)
+  else:
+    f = open(filename, "a")
+    f.write(json.dumps(metrics, sort_keys=True) + "\n")
+    f.close()
+
+
 def comm_spawn(worker, nprocs, cfile, rargs=[], path=None):
   """
   Spawns
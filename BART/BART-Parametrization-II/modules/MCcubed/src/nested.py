@@ -0,0 +1,389 @@
+# ******************************* START LICENSE *****************************
+# 
+# Multi-Core Markov-chain Monte Carlo (MC3), a code to estimate
+# model-parameter best-fitting values and Bayesian posterior
+# distributions.
+# 
+# This project was completed with the support of the NASA Planetary
+# Atmospheres Program, grant NNX12AI69G, held by Principal Investigator
+# Joseph Harrington.  Principal developers included graduate student
+# Patricio E. Cubillos and programmer Madison Stemm.  Statistical advice
+# came from Thomas J. Loredo and Nate B. Lust.
+# 
+# Copyright (C) 2014 University of Central Florida.  All rights reserved.
+# 
+# This is a test version only, and may not be redistributed to any third
+# party.  Please refer such requests to us.  This program is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.
+# 
+# Our intent is to release this software under an open-source,
+# reproducible-research license, once the code is mature and the first
+# research paper describing the code has been accepted for publication
+# in a peer-reviewed journal.  We are committed to development in the
+# open, and have posted this code on github.com so that others can test
+# it and give us feedback.  However, until its first publication and
+# first stable release, we do not permit others to redistribute the code
+# in either original or modified form, nor to publish work based in
+# whole or in part on the output of this code.  By downloading, running,
+# or modifying this code, you agree to these conditions.  We do
+# encourage sharing any modifications with us and discussing them
+# openly.
+# 
+# We welcome your feedback, but do not guarantee support.  Please send
+# feedback or inquiries to:
+# 
+# Joseph Harrington <jh@physics.ucf.edu>
+# Patricio Cubillos <pcubillos@fulbrightmail.org>
+# 
+# or alternatively,
+# 
+# Joseph Harrington and Patricio Cubillos
+# UCF PSB 441
+# 4111 Libra Drive
+# Orlando, FL 32816-2385
+# USA
+# 
+# Thank you for using MC3!
+
+
+import os, sys
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__))+'/cfuncs/lib')
+import mcutils as mu
+import mcplots as mp
+import chisq   as cs
+
+
+def batchchisq(points, nbatch, func, indparams, data, uncert, prior,
+               priorlow, iprior, mpars, comm=None):
+  """
+  Evaluate the chi-square of a batch of parameter sets, one set per
+  worker under MPI.  Sets with NaN values are not evaluated.
+
+  Parameters:
+  -----------
+  points: 2D ndarray
+     Parameter sets of shape (npoints, nparams), with npoints <= nbatch.
+  nbatch: Integer
+     Number of sets per batch (number of MPI workers).
+  (See nested() for the rest of the parameters.)
+
+  Returns:
+  --------
+  chisq: 1D ndarray
+     Chi-square of each set (inf for the skipped sets).
+  """
+  npoints = len(points)
+  ndata   = len(data)
+  skip    = np.isnan(points[:,0])
+  models  = np.zeros((npoints, ndata))
+  if comm is not None:
+    from mpi4py import MPI
+    # Pad the batch with skipped sets:
+    sendp = np.tile(np.nan, (nbatch, mpars))
+    sendp[0:npoints] = points[:,0:mpars]
+    mu.comm_scatter(comm, sendp.flatten(), MPI.DOUBLE)
+    mpimodels = np.zeros(nbatch*ndata, np.double)
+    mu.comm_gather(comm, mpimodels)
+    models = np.reshape(mpimodels, (nbatch, ndata))[0:npoints]
+  else:
+    for k in np.where(~skip)[0]:
+      models[k] = func(*([points[k, 0:mpars]] + indparams))
+
+  chisq = np.tile(np.inf, npoints)
+  for k in np.where(~skip)[0]:
+    chisq[k] = cs.chisq(models[k], data, uncert, (points[k]-prior)[iprior],
+                        priorlow[iprior], priorlow[iprior])[0]
+  return chisq
+
+
+def nested(data,         uncert=None,   func=None,     indparams=[],
+           params=None,  pmin=None,     pmax=None,     stepsize=None,
+           prior=None,   priorlow=None, priorup=None,
+           numit=1e5,    nchains=10,    nlive=400,     dlogz=0.1,
+           nsteps=20,    plots=False,   savefile=None, comm=None,
+           log=None):
+  """
+  Nested sampling (Skilling 2004) of the posterior distribution and
+  Bayesian evidence of a model, with the same inputs as mcmc().
+
+  Parameters:
+  -----------
+  data: 1D ndarray
+     Dependent data fitted by func.
+  uncert: 1D ndarray
+     Uncertainty of data.
+  func: Callable or string-iterable
+     The callable function that models data (see mcmc()).
+  indparams: List
+     List of additional arguments of func (if necessary).
+  params: 1D ndarray
+     Initial guess of the fitting parameters (values of the fixed
+     parameters).
+  pmin: 1D ndarray
+     Lower boundaries of the (uniform) prior of the fitting parameters.
+  pmax: 1D ndarray
+     Upper boundaries of the (uniform) prior of the fitting parameters.
+  stepsize: 1D ndarray
+     Free (> 0), fixed (0), or shared (< 0) parameters flag (see mcmc()).
+  prior: 1D ndarray
+     Gaussian prior central values (see mcmc()).
+  priorlow: 1D ndarray
+     Gaussian prior lower uncertainties.
+  priorup: 1D ndarray
+     Gaussian prior upper uncertainties.
+  numit: Scalar
+     Maximum number of model evaluations.
+  nchains: Integer
+     Number of parallel model evaluations per batch (number of MPI
+     workers).
+  nlive: Integer
+     Number of live points.
+  dlogz: Float
+     Stop when the estimated remaining evidence (in log) falls below
+     this value.
+  nsteps: Integer
+     Number of constrained random-walk steps per live-point replacement.
+  plots: Boolean
+     If True plot the posterior distributions.
+  savefile: String
+     If not None, filename to store the posterior sample (in the same
+     format as the MCMC chains, with a single chain).  The evidence,
+     dead points, and their weights are stored in a '_nested.npz' file
+     with the same root name.
+  comm: MPI Communicator
+     A communicator object to transfer data through MPI.
+  log: FILE pointer
+     File object to write log into.
+
+  Returns:
+  --------
+  posterior: 2D ndarray
+     Equally-weighted posterior sample of the free parameters, of shape
+     (nfree, nsamples).
+  bestp: 1D ndarray
+     Array of the best fitting parameters.
+
+  Notes:
+  ------
+  1.- Each iteration removes the nchains lowest-likelihood live points
+      (shrinking the prior volume accordingly) and replaces them with
+      nchains constrained random walks started from the surviving live
+      points, such that each walk step is one parallel batch of model
+      evaluations.
+  2.- The likelihood is the Gaussian likelihood of the data (including
+      its normalization) times the Gaussian priors (without their
+      normalization), and the prior is uniform between pmin and pmax.
+      Hence, the evidences are comparable only between models fitted
+      to the same data with the same priors.
+  """
+  mu.msg(1, "{:s}\n  Nested sampling for the Bayesian evidence.\n{:s}".
+             format(mu.sep, mu.sep), log)
+
+  # Import the model function:
+  if type(func) in [list, tuple, np.ndarray]:
+    if func[0] != 'hack':
+      if len(func) == 3:
+        sys.path.append(func[2])
+      exec('from %s import %s as func'%(func[1], func[0]))
+  elif not callable(func):
+    mu.error("'func' must be either, a callable, or an iterable (list, "
+             "tuple, or ndarray) of strings with the model function, file, "
+             "and path names.", log)
+
+  params  = np.atleast_2d(params)
+  nparams = len(params[0])
+  mpars   = nparams
+  ndata   = len(data)
+  if uncert is None:
+    uncert = np.ones(ndata)
+  if stepsize is None:
+    stepsize = 0.1 * np.abs(params[0])
+  if (prior is None) or (priorup is None) or (priorlow is None):
+    prior   = priorup = priorlow = np.zeros(nparams)
+  iprior = np.where(priorlow != 0)[0]
+  ifree  = np.where(stepsize > 0)[0]
+  ishare = np.where(stepsize < 0)[0]
+  nfree  = len(ifree)
+  if (pmin is None or pmax is None or
+      np.any(~np.isfinite(pmin[ifree])) or np.any(~np.isfinite(pmax[ifree]))):
+    mu.error("Nested sampling requires finite pmin and pmax boundaries for "
+             "the free parameters.", log)
+  nlive  = int(nlive)
+  nbatch = int(nchains)
+  if nlive <= 2*nbatch:
+    mu.error("The number of live points (nlive={:d}) must be larger than "
+             "twice the batch size (nchains={:d}).".format(nlive, nbatch), log)
+
+  # Number of batches to evaluate the initial live points, and number of
+  # nested-sampling iterations within the evaluation budget:
+  ninit = int(np.ceil(nlive/float(nbatch)))
+  niter = int((numit - ninit*nbatch) / (nbatch*nsteps))
+  if niter < 1:
+    mu.error("numit is too small for the initial live points and one "
+             "nested-sampling iteration.", log)
+
+  mpi = comm is not None
+  if mpi:
+    from mpi4py import MPI
+    # Send sizes info to other processes (number of batches - 1):
+    array1 = np.asarray([mpars, ninit + niter*nsteps - 1, -1], np.int)
+    mu.comm_bcast(comm, array1, MPI.INT)
+
+  fargs = (func, indparams, data, uncert, prior, priorlow, iprior, mpars, comm)
+  # Gaussian-likelihood normalization:
+  lognorm = -0.5*np.sum(np.log(2*np.pi*uncert**2))
+
+  # Draw the initial live points from the prior:
+  live = np.repeat(params[0:1], nlive, 0)
+  live[:,ifree] = np.random.uniform(pmin[ifree], pmax[ifree], (nlive, nfree))
+  for s in ishare:
+    live[:,s] = live[:,-int(stepsize[s])-1]
+  livechisq = np.zeros(nlive)
+  for b in np.arange(ninit):
+    livechisq[b*nbatch:(b+1)*nbatch] = batchchisq(
+                                     live[b*nbatch:(b+1)*nbatch], nbatch, *fargs)
+  logl = lognorm - 0.5*livechisq
+  neval = nlive
+
+  # Dead points:
+  deadp, deadlogl, deadlogwt = [], [], []
+  logz  = -np.inf  # Log of the evidence
+  info  = 0.0      # Information (negative relative entropy)
+  logx  = 0.0      # Log of the remaining prior volume
+  scale = 1.0      # Random-walk scale factor (relative to the live spread)
+
+  intsteps = np.amax((niter/10, 1))
+  mu.msg(1, "Start nested sampling  ({:d} live points).".format(nlive), log)
+  for i in np.arange(niter):
+    # Remove the nbatch lowest-likelihood points (in order):
+    iworst = np.argsort(logl)[0:nbatch]
+    for j in np.arange(nbatch):
+      k = iworst[j]
+      logxnew = logx - 1.0/(nlive-j)
+      logwt   = logl[k] + logx + np.log(1.0 - np.exp(logxnew-logx))
+      logznew = np.logaddexp(logz, logwt)
+      if np.isfinite(logz):
+        info = (np.exp(logwt-logznew)*logl[k] +
+                np.exp(logz-logznew)*(info+logz) - logznew)
+      else:
+        info = np.exp(logwt-logznew)*logl[k] - logznew
+      logz, logx = logznew, logxnew
+      deadp.append(np.copy(live[k]))
+      deadlogl.append(logl[k])
+      deadlogwt.append(logwt)
+    loglmin = logl[iworst[-1]]
+
+    # Constrained random walks from randomly-chosen surviving points (a
+    # walker that never moves keeps a copy of its seed point):
+    alive   = np.setdiff1d(np.arange(nlive), iworst)
+    iseed   = alive[np.random.randint(0, len(alive), nbatch)]
+    walkers = np.copy(live[iseed])
+    wlogl   = np.copy(logl[iseed])
+    pscale  = scale * np.std(live[alive][:,ifree], axis=0)
+    naccept = 0
+    for s in np.arange(nsteps):
+      trial = np.copy(walkers)
+      trial[:,ifree] += np.random.normal(0, 1, (nbatch, nfree)) * pscale
+      for p in ishare:
+        trial[:,p] = trial[:,-int(stepsize[p])-1]
+      out = np.any((trial < pmin) | (trial > pmax), axis=1)
+      sendp = np.copy(trial)
+      sendp[out] = np.nan
+      tlogl = lognorm - 0.5*batchchisq(sendp, nbatch, *fargs)
+      neval += np.sum(~out)
+      accept = tlogl > loglmin
+      walkers[accept] = trial[accept]
+      wlogl  [accept] = tlogl[accept]
+      naccept += np.sum(accept)
+    # Tune the step scale toward a 50% acceptance:
+    scale *= np.exp(naccept/float(nsteps*nbatch) - 0.5)
+    live[iworst] = walkers
+    logl[iworst] = wlogl
+
+    # Stop when the remaining evidence is negligible:
+    dlz = np.logaddexp(logz, np.amax(logl) + logx) - logz
+    if ((i+1) % intsteps == 0):
+      mu.progressbar((i+1.0)/niter, log)
+      mu.msg(1, "log(Z) = {:.4f},  remaining log(Z) fraction = {:.4g}".
+                format(logz, dlz), log)
+    if dlz < dlogz:
+      break
+
+  # Flush the unused batches of the workers:
+  if mpi:
+    for s in np.arange((niter-i-1)*nsteps):
+      batchchisq(np.tile(np.nan, (nbatch, nparams)), nbatch, *fargs)
+
+  # Add the remaining live points:
+  for k in np.argsort(logl):
+    logwt   = logx - np.log(nlive) + logl[k]
+    logznew = np.logaddexp(logz, logwt)
+    info = (np.exp(logwt-logznew)*logl[k] +
+            np.exp(logz-logznew)*(info+logz) - logznew)
+    logz = logznew
+    deadp.append(np.copy(live[k]))
+    deadlogl.append(logl[k])
+    deadlogwt.append(logwt)
+  logzerr = np.sqrt(np.amax((info, 0.0))/nlive)
+
+  deadp     = np.asarray(deadp)
+  deadlogl  = np.asarray(deadlogl)
+  deadlogwt = np.asarray(deadlogwt)
+  weights   = np.exp(deadlogwt - logz)
+  weights  /= np.sum(weights)
+  ess = 1.0/np.sum(weights**2)  # Effective sample size
+
+  # Equally-weighted posterior sample (systematic resampling):
+  nsample = len(deadp)
+  cumw = np.cumsum(weights)
+  cumw[-1] = 1.0
+  isample = np.searchsorted(cumw, (np.random.uniform() + np.arange(nsample))
+                                  / nsample)
+  posterior = deadp[isample][:,ifree].T
+  bestp = deadp[np.argmax(deadlogl)]
+  bestchisq = 2*(lognorm - np.amax(deadlogl))
+
+  # Print out Summary:
+  mu.msg(1, "\nFin, Nested-sampling Summary:\n-----------------------------",
+         log)
+  fmtlen = len(str(neval))
+  mu.msg(1, "Burned in iterations per chain: {:{}d}".format(0, fmtlen), log, 1)
+  mu.msg(1, "Nested-sampling iterations:     {:{}d}".format(i+1, fmtlen),
+         log, 1)
+  mu.msg(1, "Number of model evaluations:    {:{}d}".format(neval, fmtlen),
+         log, 1)
+  mu.msg(1, "Posterior effective sample size: {:.1f}".format(ess), log, 1)
+  mu.msg(1, "log(Evidence):     {:.4f} +/- {:.4f}".format(logz, logzerr),
+         log, 1)
+  mu.msg(1, "Information (nats): {:.4f}\n ".format(info), log, 1)
+  meanp   = np.mean(posterior, axis=1)
+  uncertp = np.std (posterior, axis=1)
+  mu.msg(1, "Best-fit params    Uncertainties   Signal/Noise       Sample "
+            "Mean", log, 1)
+  for j in np.arange(nfree):
+    mu.msg(1, "{: 15.7e}  {: 15.7e}   {:12.2f}   {: 15.7e}".
+               format(bestp[ifree][j], uncertp[j],
+                      np.abs(bestp[ifree][j])/uncertp[j], meanp[j]), log, 1)
+  mu.msg(1, " ", log)
+  mu.msg(1, "Best-parameter's chi-squared:     {:.4f}\n".format(bestchisq),
+         log, 1)
+
+  # Save results:
+  if savefile is not None:
+    np.save(savefile, posterior[np.newaxis])
+    np.savez(os.path.splitext(savefile)[0] + "_nested.npz",
+             logz=logz, logzerr=logzerr, information=info, ess=ess,
+             samples=deadp[:,ifree].T, logl=deadlogl, logwt=deadlogwt)
+
+  if plots:
+    if savefile is not None:
+      fname = os.path.splitext(os.path.basename(savefile))[0]
+    else:
+      fname = "NS"
+    mp.plots(posterior, fname, nproc=1, cachefile=fname+"_plotdata.npz")
+
+  return posterior, bestp
@@ -8,6 +8,7 @@
 extern int opacity P_((struct transit *tr));
 extern int calcprofiles P_((struct transit *tr));
 extern int calcopacity P_((struct transit *tr, FILE *fp));
+extern int resumeopacity P_((struct transit *tr, FILE *fp));
 extern int readopacity P_((struct transit *tr, FILE *fp));
 extern int shareopacity P_((struct transit *tr, FILE *fp));
 extern int attachopacity P_((struct transit *tr));
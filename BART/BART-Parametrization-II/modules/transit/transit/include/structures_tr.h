@@ -354,6 +354,8 @@ struct transithint{
                            mass or number                                    */
   _Bool opabreak;       /* Break after opacity calculation flag              */
   _Bool opashare;       /* Attempt to place opacity grid in shared memory.   */
+  long opakey;          /* Opacity shared-memory key (0: use ftok)           */
+  int opathreads;       /* Number of threads for the opacity-grid calculation */
   long fl;              /* flags                                             */
   _Bool userefraction;  /* Whether to use variable refraction                */
   _Bool savefiles    ;  /* Whether to save files                             */
@@ -401,6 +403,8 @@ struct transit{
   prop_atm atm;      /* Sampled atmospheric data                            */
   _Bool opabreak;    /* Break after opacity calculation                     */
   _Bool opashare;    /* Attempt to place opacity grid in shared memory.     */
+  long opakey;       /* Opacity shared-memory key (0: use ftok)             */
+  int opathreads;    /* Threads for the opacity-grid calculation            */
   int ndivs,         /* Number of exact divisors of the oversampling factor */
      *odivs;         /* Exact divisors of the oversampling factor           */
   int voigtfine;     /* Number of fine-bins of the Voigt function           */
@@ -46,6 +46,9 @@
 #include <stdlib.h>
 #include <stdio.h>
 #include <alloca.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #define compattliversion 5
 
@@ -28,7 +28,8 @@ transit_module = Extension('_transit_module',sources=['src/transit_wrap.c'],
                                            op.join(pu,'numerical.o'),
                                            op.join(pu,'xmalloc.o'),
                                            op.join(pu,'spline.o'),
-                                           op.join(pu,'sampling.o')])
+                                           op.join(pu,'sampling.o')],
+                            extra_link_args=['-fopenmp'])
 
 setup (name="transit_module",
        version= '0.1',
@@ -404,9 +404,9 @@ computemolext(struct transit *tr, /* transit struct                         */
   else
     Nmol = 1;
 
-  /* Temporary extinction array:                                            */
+  /* Temporary extinction array (zero-initialized, the lines co-add):       */
   ktmp    = (double **)malloc(Nmol            * sizeof(double *));
-  ktmp[0] = (double  *)malloc(Nmol*tr->owns.n * sizeof(double  ));
+  ktmp[0] = (double  *)calloc(Nmol*tr->owns.n,  sizeof(double  ));
   for (i=1; i<Nmol; i++)
     ktmp[i] = ktmp[0] + tr->owns.n * i;
 
@@ -90,13 +90,19 @@ opacity(struct transit *tr){
   /* Opacity file specified, but it just doesn't exist yet:                 */
   if (file_exists == -1) {
 
-    /* Open file for writing:                                               */
-    tr->fp_opa = fopen(tr->f_opa, "wb");
+    /* Write the grid into a partial file (renamed once complete).  If a
+       previous calculation was interrupted, resume from its file:          */
+    char *partfile = (char *)calloc(strlen(tr->f_opa)+6, sizeof(char));
+    sprintf(partfile, "%s.part", tr->f_opa);
+    tr->fp_opa = fopen(partfile, "r+b");
+    if (tr->fp_opa == NULL)
+      tr->fp_opa = fopen(partfile, "w+b");
 
     /* Immediately return if the file could not be opened:                  */
     if (tr->fp_opa == NULL){
       transiterror(TERR_WARNING, "Opacity filename '%s' cannot be opened "
-                                 "for writing.\n", tr->f_opa);
+                                 "for writing.\n", partfile);
+      free(partfile);
       return -1;
     }
 
@@ -108,6 +114,10 @@ opacity(struct transit *tr){
     transitprint(1, verblevel, "Calculating new grid of opacities: '%s'.\n",
                                tr->f_opa);
     calcopacity(tr, tr->fp_opa);
+    if (rename(partfile, tr->f_opa) != 0)
+      transiterror(TERR_SERIOUS, "Cannot rename the opacity file '%s' to "
+                                 "'%s'.\n", partfile, tr->f_opa);
+    free(partfile);
 
     /* Free the line-transition memory:                                     */
     freemem_linetransition(&tr->ds.li->lt, &tr->pi);
@@ -141,8 +151,9 @@ opacity(struct transit *tr){
   /* Should attempt to use shared memory:                                   */
   if (tr->opashare) {
 
-    /* Get ID or create shared opacityhint struct:                          */
-    key_t hintkey = ftok(tr->f_opa, 'a');
+    /* Get ID or create shared opacityhint struct (the key comes from the
+       opacity-grid content when opakey is set, else from the file):        */
+    key_t hintkey = tr->opakey ? (key_t)tr->opakey : ftok(tr->f_opa, 'a');
     op.hintID = shmget(hintkey, sizeof(struct opacityhint), 0644 | IPC_CREAT);
 
     /* If reserving the hint segment was unsuccessful, give up:             */
@@ -342,13 +353,10 @@ calcopacity(struct transit *tr,
   struct lineinfo *li=tr->ds.li;    /* Lineinfo struct                      */
   long Nmol, Ntemp, Nlayer, Nwave;  /* Opacity-grid  dimension sizes        */
   int i, j, t, r,                   /* for-loop indices                     */
-      rn, iso1db;
+      r0, iso1db;
   double *z;
   int k;
 
-  PREC_ATM *density = (PREC_ATM *)calloc(mol->nmol, sizeof(PREC_ATM));
-  double   *Z       = (double   *)calloc(iso->n_i,  sizeof(double));
-
   /* Make temperature array from hinted values:                             */
   maketempsample(tr);
   Ntemp = op->Ntemp = tr->temp.n;
@@ -434,10 +442,29 @@ calcopacity(struct transit *tr,
     if (!op->o[0][0][0])
       transitprint(1, verblevel, "Allocation fail.\n");
 
+    /* Read the layers computed by an interrupted calculation (or write
+       the header of a new file):                                           */
+    r0 = resumeopacity(tr, fp);
+
+#ifdef _OPENMP
+    if (tr->opathreads > 0)
+      omp_set_num_threads(tr->opathreads);
+    transitprint(1, verblevel, "Computing the opacity grid with %d "
+                               "threads.\n", omp_get_max_threads());
+#endif
+
     /* Compute extinction:                                                  */
-    for (r=0;   r<Nlayer; r++){  /* For each layer:                         */
+    for (r=r0;  r<Nlayer; r++){  /* For each layer:                         */
       transitprint(3, verblevel, "\nOpacity Grid at layer %03d/%03ld.\n",
                                  r+1, Nlayer);
+      /* The temperatures of a layer are independent (each thread gets its
+         own density and partition-function arrays):                        */
+      #pragma omp parallel private(j)
+      {
+      PREC_ATM *density = (PREC_ATM *)calloc(mol->nmol, sizeof(PREC_ATM));
+      double   *Z       = (double   *)calloc(iso->n_i,  sizeof(double));
+      int rn;
+      #pragma omp for schedule(dynamic)
       for (t=0; t<Ntemp;  t++){  /* For each temperature:                   */
         /* Get density and partition-function arrays:                       */
         for (j=0; j < mol->nmol; j++)
@@ -449,25 +476,16 @@ calcopacity(struct transit *tr,
           transiterror(TERR_CRITICAL, "extinction() returned error code %i.\n",
                                       rn);
       }
-    }
-
-    /* Save dimension sizes:                                                */
-    fwrite(&Nmol,   sizeof(long), 1, fp);
-    fwrite(&Ntemp,  sizeof(long), 1, fp);
-    fwrite(&Nlayer, sizeof(long), 1, fp);
-    fwrite(&Nwave,  sizeof(long), 1, fp);
-
-    /* Save arrays:                                                         */
-    fwrite(&op->molID[0], sizeof(int),      Nmol,   fp);
-    fwrite(&op->temp[0],  sizeof(PREC_RES), Ntemp,  fp);
-    fwrite(&op->press[0], sizeof(PREC_RES), Nlayer, fp);
-    fwrite(&op->wns[0],   sizeof(PREC_RES), Nwave,  fp);
+      free(density);
+      free(Z);
+      }
 
-    /* Save opacity:                                                        */
-    for (r=0; r<Nlayer; r++)
+      /* Save the layer (checkpoint):                                       */
       for (t=0; t<Ntemp; t++)
         for (i=0; i<Nmol; i++)
           fwrite(op->o[r][t][i], sizeof(PREC_RES), Nwave, fp);
+      fflush(fp);
+    }
 
     fclose(fp);
   }
@@ -476,6 +494,92 @@ calcopacity(struct transit *tr,
 }
 
 
+/* FUNCTION: Prepare the file of an opacity-grid calculation.  If the file
+   holds the layers of an interrupted calculation of the same grid, read
+   them into the opacity struct and place the file pointer after them;
+   else, write the grid header into an empty file.
+   Return: the number of layers already computed                            */
+int
+resumeopacity(struct transit *tr,  /* transit struct                        */
+              FILE *fp){           /* Opacity-grid file (read/write)        */
+  struct opacity *op=tr->ds.op;    /* Opacity struct                        */
+  long Nmol   = op->Nmol,
+       Ntemp  = op->Ntemp,
+       Nlayer = op->Nlayer,
+       Nwave  = op->Nwave;
+  long dims[4], nlayers=0, size;
+  int i, t, r,                     /* for-loop indices                      */
+      same=0;
+  /* Size of the header and of a layer (in bytes):                          */
+  long hsize = 4*sizeof(long) + Nmol*sizeof(int) +
+               (Ntemp+Nlayer+Nwave)*sizeof(PREC_RES),
+       lsize = Ntemp*Nmol*Nwave*sizeof(PREC_RES);
+
+  int      *molID = (int      *)calloc(Nmol,   sizeof(int));
+  PREC_RES *temp  = (PREC_RES *)calloc(Ntemp,  sizeof(PREC_RES)),
+           *press = (PREC_RES *)calloc(Nlayer, sizeof(PREC_RES)),
+           *wns   = (PREC_RES *)calloc(Nwave,  sizeof(PREC_RES));
+
+  /* Compare the header of the file to the current grid:                    */
+  fseek(fp, 0, SEEK_END);
+  size = ftell(fp);
+  rewind(fp);
+  if (size >= hsize                                        &&
+      fread(dims,  sizeof(long),     4,      fp) == 4      &&
+      dims[0] == Nmol && dims[1] == Ntemp                  &&
+      dims[2] == Nlayer && dims[3] == Nwave                &&
+      fread(molID, sizeof(int),      Nmol,   fp) == Nmol   &&
+      fread(temp,  sizeof(PREC_RES), Ntemp,  fp) == Ntemp  &&
+      fread(press, sizeof(PREC_RES), Nlayer, fp) == Nlayer &&
+      fread(wns,   sizeof(PREC_RES), Nwave,  fp) == Nwave  &&
+      memcmp(molID, op->molID, Nmol  *sizeof(int))      == 0 &&
+      memcmp(temp,  op->temp,  Ntemp *sizeof(PREC_RES)) == 0 &&
+      memcmp(press, op->press, Nlayer*sizeof(PREC_RES)) == 0 &&
+      memcmp(wns,   op->wns,   Nwave *sizeof(PREC_RES)) == 0)
+    same = 1;
+
+  free(molID);
+  free(temp);
+  free(press);
+  free(wns);
+
+  if (same){
+    /* Number of complete layers in the file:                               */
+    nlayers = (size - hsize) / lsize;
+    if (nlayers > Nlayer)
+      nlayers = Nlayer;
+    for (r=0; r<nlayers; r++)
+      for (t=0; t<Ntemp; t++)
+        for (i=0; i<Nmol; i++)
+          fread(op->o[r][t][i], sizeof(PREC_RES), Nwave, fp);
+    /* Overwrite any incomplete layer:                                      */
+    fseek(fp, hsize + nlayers*lsize, SEEK_SET);
+    transitprint(1, verblevel, "Resuming the opacity grid from layer "
+                               "%ld/%ld.\n", nlayers+1, Nlayer);
+    return (int)nlayers;
+  }
+
+  /* Start a new file:                                                      */
+  rewind(fp);
+  if (ftruncate(fileno(fp), 0) != 0)
+    transiterror(TERR_SERIOUS, "Cannot truncate the opacity file.\n");
+
+  /* Save dimension sizes:                                                  */
+  fwrite(&Nmol,   sizeof(long), 1, fp);
+  fwrite(&Ntemp,  sizeof(long), 1, fp);
+  fwrite(&Nlayer, sizeof(long), 1, fp);
+  fwrite(&Nwave,  sizeof(long), 1, fp);
+
+  /* Save arrays:                                                           */
+  fwrite(&op->molID[0], sizeof(int),      Nmol,   fp);
+  fwrite(&op->temp[0],  sizeof(PREC_RES), Ntemp,  fp);
+  fwrite(&op->press[0], sizeof(PREC_RES), Nlayer, fp);
+  fwrite(&op->wns[0],   sizeof(PREC_RES), Nwave,  fp);
+  fflush(fp);
+  return 0;
+}
+
+
 /* FUNCTION: Read the opacity file and store values in the transit
    structure.                                                               */
 int
@@ -621,7 +725,7 @@ attachopacity(struct transit *tr){ /* transit struct                        */
     + sizeof(PREC_RES) * op->Nwave;   /* op->wns    */
 
   /* Allocate or locate the main shared memory:                             */
-  key_t mainkey = ftok(tr->f_opa, 'b');
+  key_t mainkey = tr->opakey ? (key_t)(tr->opakey+1) : ftok(tr->f_opa, 'b');
   op->mainID = shmget(mainkey, main_shm_size, 0644 | IPC_CREAT);
 
   /* If allocation failed, abort:                                           */